@@ -1,10 +1,21 @@
+import time
+
 from flask import Flask
 from flask_cors import CORS
 from .route import bp
+from . import cli, encoding, metrics, migrations
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__)
     CORS(app) # allow frontend requests
+    encoding.register(app)
 
     app.register_blueprint(bp, url_prefix="/api")
-    return app
\ No newline at end of file
+    cli.register(app)
+    metrics.register(app)
+
+    # Schema changes are applied by `flask --app run migrate`; startup only checks the version
+    migrations.check()
+    app.config["STARTUP_SECONDS"] = round(time.perf_counter() - started, 4)
+    return app
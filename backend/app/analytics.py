@@ -0,0 +1,343 @@
+"""Pre-aggregated analytics rollups.
+
+``analytics_rollup`` holds one row per (scope, scope_id, period, bucket_start)
+where scope is 'field' or 'user' and period is 'day', 'week' or 'month'.
+Rows store sums and counts rather than averages so user rollups can be
+summed from field rollups. Writers call ``refresh`` with the (field_id, day)
+pairs they touched; only those buckets are recomputed, so the cost of a
+write does not depend on how much history exists, and reads are a primary
+key range scan over a handful of buckets.
+"""
+from datetime import date, datetime, timedelta
+
+from .model import BACKEND
+
+PERIODS = ('day', 'week', 'month')
+
+# view period -> (bucket period, how far back to look)
+VIEWS = {
+    'week': ('day', timedelta(days=6)),
+    'month': ('week', timedelta(days=34)),
+    'year': ('month', timedelta(days=364)),
+}
+
+# Philippine cropping seasons by month
+WET_SEASON_MONTHS = {6, 7, 8, 9, 10, 11}
+
+METRIC_COLUMNS = [
+    'samples', 'temp_count', 'temp_sum', 'temp_min', 'temp_max',
+    'humidity_count', 'humidity_sum', 'precip_total', 'wind_count', 'wind_sum',
+    'crops_planted',
+]
+
+_FIELD_REFRESH_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT t.field_id, date_trunc(%(period)s, t.day)::date AS bucket_start
+        FROM unnest(%(field_ids)s::int[], %(days)s::date[]) AS t(field_id, day)
+    ),
+    w AS (
+        SELECT t.field_id, t.bucket_start,
+               count(wx.weather_id) AS samples,
+               count(wx.temperature) AS temp_count,
+               coalesce(sum(wx.temperature), 0) AS temp_sum,
+               min(wx.temperature) AS temp_min,
+               max(wx.temperature) AS temp_max,
+               count(wx.relative_humidity) AS humidity_count,
+               coalesce(sum(wx.relative_humidity), 0) AS humidity_sum,
+               coalesce(sum(wx.precipitation), 0) AS precip_total,
+               count(wx.wind_speed_10m) AS wind_count,
+               coalesce(sum(wx.wind_speed_10m), 0) AS wind_sum
+        FROM touched t
+        LEFT JOIN weather wx
+               ON wx.field_id = t.field_id
+              AND wx.observed_at >= t.bucket_start
+              AND wx.observed_at < t.bucket_start + %(step)s::interval
+        GROUP BY t.field_id, t.bucket_start
+    ),
+    c AS (
+        SELECT t.field_id, t.bucket_start, count(cr.crop_id) AS crops_planted
+        FROM touched t
+        LEFT JOIN crops cr
+               ON cr.field_id = t.field_id
+              AND cr.planting_date >= t.bucket_start
+              AND cr.planting_date < t.bucket_start + %(step)s::interval
+        GROUP BY t.field_id, t.bucket_start
+    )
+    INSERT INTO analytics_rollup (scope, scope_id, period, bucket_start, {columns}, updated_at)
+    SELECT 'field', w.field_id, %(period)s, w.bucket_start,
+           w.samples, w.temp_count, w.temp_sum, w.temp_min, w.temp_max,
+           w.humidity_count, w.humidity_sum, w.precip_total, w.wind_count, w.wind_sum,
+           c.crops_planted, CURRENT_TIMESTAMP
+    FROM w JOIN c USING (field_id, bucket_start)
+    ON CONFLICT (scope, scope_id, period, bucket_start) DO UPDATE SET {updates};
+"""
+
+_USER_REFRESH_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT f.user_id, date_trunc(%(period)s, t.day)::date AS bucket_start
+        FROM unnest(%(field_ids)s::int[], %(days)s::date[]) AS t(field_id, day)
+        JOIN fields f ON f.field_id = t.field_id
+        WHERE f.user_id IS NOT NULL
+    )
+    INSERT INTO analytics_rollup (scope, scope_id, period, bucket_start, {columns}, updated_at)
+    SELECT 'user', t.user_id, %(period)s, t.bucket_start,
+           coalesce(sum(r.samples), 0), coalesce(sum(r.temp_count), 0), coalesce(sum(r.temp_sum), 0),
+           min(r.temp_min), max(r.temp_max),
+           coalesce(sum(r.humidity_count), 0), coalesce(sum(r.humidity_sum), 0),
+           coalesce(sum(r.precip_total), 0), coalesce(sum(r.wind_count), 0), coalesce(sum(r.wind_sum), 0),
+           coalesce(sum(r.crops_planted), 0), CURRENT_TIMESTAMP
+    FROM touched t
+    JOIN fields f ON f.user_id = t.user_id
+    LEFT JOIN analytics_rollup r
+           ON r.scope = 'field' AND r.scope_id = f.field_id
+          AND r.period = %(period)s AND r.bucket_start = t.bucket_start
+    GROUP BY t.user_id, t.bucket_start
+    ON CONFLICT (scope, scope_id, period, bucket_start) DO UPDATE SET {updates};
+"""
+
+
+# SQLite has no date_trunc/unnest; bucket bounds are computed in Python
+# (bucket_bounds) and bound as a JSON array of [field_id, start, end].
+# ``WHERE true`` keeps the upsert's SELECT from parsing ON CONFLICT as a join.
+_SQLITE_FIELD_REFRESH_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT json_extract(value, '$[0]') AS field_id,
+               json_extract(value, '$[1]') AS bucket_start,
+               json_extract(value, '$[2]') AS bucket_end
+        FROM json_each(%(buckets)s)
+    ),
+    w AS (
+        SELECT t.field_id, t.bucket_start,
+               count(wx.weather_id) AS samples,
+               count(wx.temperature) AS temp_count,
+               coalesce(sum(wx.temperature), 0) AS temp_sum,
+               min(wx.temperature) AS temp_min,
+               max(wx.temperature) AS temp_max,
+               count(wx.relative_humidity) AS humidity_count,
+               coalesce(sum(wx.relative_humidity), 0) AS humidity_sum,
+               coalesce(sum(wx.precipitation), 0) AS precip_total,
+               count(wx.wind_speed_10m) AS wind_count,
+               coalesce(sum(wx.wind_speed_10m), 0) AS wind_sum
+        FROM touched t
+        LEFT JOIN weather wx
+               ON wx.field_id = t.field_id
+              AND wx.observed_at >= t.bucket_start
+              AND wx.observed_at < t.bucket_end
+        GROUP BY t.field_id, t.bucket_start
+    ),
+    c AS (
+        SELECT t.field_id, t.bucket_start, count(cr.crop_id) AS crops_planted
+        FROM touched t
+        LEFT JOIN crops cr
+               ON cr.field_id = t.field_id
+              AND cr.planting_date >= t.bucket_start
+              AND cr.planting_date < t.bucket_end
+        GROUP BY t.field_id, t.bucket_start
+    )
+    INSERT INTO analytics_rollup (scope, scope_id, period, bucket_start, {columns}, updated_at)
+    SELECT 'field', w.field_id, %(period)s, w.bucket_start,
+           w.samples, w.temp_count, w.temp_sum, w.temp_min, w.temp_max,
+           w.humidity_count, w.humidity_sum, w.precip_total, w.wind_count, w.wind_sum,
+           c.crops_planted, CURRENT_TIMESTAMP
+    FROM w JOIN c USING (field_id, bucket_start)
+    WHERE true
+    ON CONFLICT (scope, scope_id, period, bucket_start) DO UPDATE SET {updates};
+"""
+
+_SQLITE_USER_REFRESH_SQL = """
+    WITH touched AS (
+        SELECT DISTINCT f.user_id, json_extract(t.value, '$[1]') AS bucket_start
+        FROM json_each(%(buckets)s) t
+        JOIN fields f ON f.field_id = json_extract(t.value, '$[0]')
+        WHERE f.user_id IS NOT NULL
+    )
+    INSERT INTO analytics_rollup (scope, scope_id, period, bucket_start, {columns}, updated_at)
+    SELECT 'user', t.user_id, %(period)s, t.bucket_start,
+           coalesce(sum(r.samples), 0), coalesce(sum(r.temp_count), 0), coalesce(sum(r.temp_sum), 0),
+           min(r.temp_min), max(r.temp_max),
+           coalesce(sum(r.humidity_count), 0), coalesce(sum(r.humidity_sum), 0),
+           coalesce(sum(r.precip_total), 0), coalesce(sum(r.wind_count), 0), coalesce(sum(r.wind_sum), 0),
+           coalesce(sum(r.crops_planted), 0), CURRENT_TIMESTAMP
+    FROM touched t
+    JOIN fields f ON f.user_id = t.user_id
+    LEFT JOIN analytics_rollup r
+           ON r.scope = 'field' AND r.scope_id = f.field_id
+          AND r.period = %(period)s AND r.bucket_start = t.bucket_start
+    WHERE true
+    GROUP BY t.user_id, t.bucket_start
+    ON CONFLICT (scope, scope_id, period, bucket_start) DO UPDATE SET {updates};
+"""
+
+
+def _render(sql):
+    return sql.format(
+        columns=", ".join(METRIC_COLUMNS),
+        updates=", ".join(f"{c} = EXCLUDED.{c}" for c in METRIC_COLUMNS + ['updated_at']),
+    )
+
+
+if BACKEND == "sqlite":
+    FIELD_REFRESH_SQL = _render(_SQLITE_FIELD_REFRESH_SQL)
+    USER_REFRESH_SQL = _render(_SQLITE_USER_REFRESH_SQL)
+    _TOUCHED_DAYS_SQL = "date(observed_at)"
+else:
+    FIELD_REFRESH_SQL = _render(_FIELD_REFRESH_SQL)
+    USER_REFRESH_SQL = _render(_USER_REFRESH_SQL)
+    _TOUCHED_DAYS_SQL = "observed_at::date"
+
+
+def bucket_bounds(period, day):
+    """[start, end) of the day/week/month bucket containing ``day`` (Postgres date_trunc semantics)."""
+    if period == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    if period == 'month':
+        start = day.replace(day=1)
+        return start, (start + timedelta(days=32)).replace(day=1)
+    return day, day + timedelta(days=1)
+
+
+def _as_date(day):
+    if isinstance(day, datetime):
+        return day.date()
+    return day if isinstance(day, date) else date.fromisoformat(str(day))
+
+
+def refresh(cursor, touched):
+    """Recompute the day/week/month buckets covering ``touched`` (field_id, day) pairs.
+
+    Runs inside the caller's transaction; field rollups are refreshed first so
+    the user rollups can be summed from them.
+    """
+    pairs = {(field_id, day) for field_id, day in touched if field_id is not None}
+    if not pairs:
+        return
+    field_ids = [p[0] for p in pairs]
+    days = [p[1] for p in pairs]
+    for period in PERIODS:
+        if BACKEND == "sqlite":
+            buckets = {(fid, *bucket_bounds(period, _as_date(day))) for fid, day in pairs}
+            params = {'period': period,
+                      'buckets': [[fid, start.isoformat(), end.isoformat()] for fid, start, end in buckets]}
+        else:
+            params = {'period': period, 'step': f'1 {period}', 'field_ids': field_ids, 'days': days}
+        cursor.execute(FIELD_REFRESH_SQL, params)
+        cursor.execute(USER_REFRESH_SQL, params)
+
+
+def rebuild(cursor):
+    """Recompute every bucket from the raw tables (initial backfill / repair).
+
+    Weather rows written before observed_at existed are single samples without
+    an hour and are left out of the rollups.
+    """
+    cursor.execute(f"""
+        SELECT DISTINCT field_id, {_TOUCHED_DAYS_SQL} FROM weather
+        WHERE field_id IS NOT NULL AND observed_at IS NOT NULL
+        UNION
+        SELECT DISTINCT field_id, planting_date FROM crops
+        WHERE field_id IS NOT NULL AND planting_date IS NOT NULL;
+    """)
+    touched = cursor.fetchall()
+    cursor.execute("DELETE FROM analytics_rollup;")
+    refresh(cursor, touched)
+    return len(touched)
+
+
+def season_of(day):
+    return "Wet Season" if day.month in WET_SEASON_MONTHS else "Dry Season"
+
+
+def _metrics(row):
+    """Convert rollup sums/counts into the averages and totals the API returns."""
+    def avg(total, count):
+        return round(total / count, 2) if count else None
+
+    return {
+        "samples": row['samples'],
+        "temperature_avg": avg(row['temp_sum'], row['temp_count']),
+        "temperature_min": row['temp_min'],
+        "temperature_max": row['temp_max'],
+        "humidity_avg": avg(row['humidity_sum'], row['humidity_count']),
+        "precipitation_total": round(row['precip_total'] or 0, 2),
+        "wind_speed_avg": avg(row['wind_sum'], row['wind_count']),
+        "crops_planted": row['crops_planted'],
+    }
+
+
+def _combine(rows):
+    """Merge several rollup rows into one (sums add, min/max fold)."""
+    total = {c: 0 for c in METRIC_COLUMNS}
+    total['temp_min'] = total['temp_max'] = None
+    for r in rows:
+        for c in METRIC_COLUMNS:
+            if c == 'temp_min':
+                if r[c] is not None:
+                    total[c] = r[c] if total[c] is None else min(total[c], r[c])
+            elif c == 'temp_max':
+                if r[c] is not None:
+                    total[c] = r[c] if total[c] is None else max(total[c], r[c])
+            else:
+                total[c] += r[c] or 0
+    return total
+
+
+def _select(cursor, where, params):
+    cursor.execute(
+        f"""
+        SELECT scope_id, bucket_start, {", ".join(METRIC_COLUMNS)}
+        FROM analytics_rollup
+        WHERE {where}
+        ORDER BY scope_id, bucket_start;
+        """,
+        params,
+    )
+    return [
+        dict(zip(['scope_id', 'bucket_start'] + METRIC_COLUMNS, row))
+        for row in cursor.fetchall()
+    ]
+
+
+def report(cursor, scope, scope_id, view='month', mode='location', today=None):
+    """Build the analytics payload for a user or field over a week/month/year view."""
+    period, lookback = VIEWS[view]
+    today = today or datetime.utcnow().date()
+    start, _ = bucket_bounds(period, today - lookback)
+
+    rows = _select(cursor, "scope = %s AND scope_id = %s AND period = %s AND bucket_start BETWEEN %s AND %s",
+                   (scope, scope_id, period, start, today))
+    result = {
+        "scope": scope,
+        "scope_id": scope_id,
+        "view": view,
+        "bucket": period,
+        "start": start.isoformat(),
+        "end": today.isoformat(),
+        "series": [{"bucket_start": r['bucket_start'].isoformat(), **_metrics(r)} for r in rows],
+        "summary": _metrics(_combine(rows)),
+    }
+
+    if mode == 'season':
+        seasons = {}
+        for r in rows:
+            seasons.setdefault(season_of(r['bucket_start']), []).append(r)
+        result["by_season"] = [
+            {"season": name, **_metrics(_combine(members))}
+            for name, members in sorted(seasons.items())
+        ]
+    elif mode == 'location' and scope == 'user':
+        cursor.execute("SELECT field_id, location FROM fields WHERE user_id = %s;", (scope_id,))
+        locations = dict(cursor.fetchall())
+        field_rows = _select(
+            cursor,
+            "scope = 'field' AND scope_id = ANY(%s) AND period = %s AND bucket_start BETWEEN %s AND %s",
+            (list(locations), period, start, today),
+        ) if locations else []
+        per_field = {}
+        for r in field_rows:
+            per_field.setdefault(r['scope_id'], []).append(r)
+        result["by_location"] = [
+            {"field_id": field_id, "location": locations.get(field_id), **_metrics(_combine(members))}
+            for field_id, members in per_field.items()
+        ]
+    return result
@@ -0,0 +1,129 @@
+"""Request authentication.
+
+``load_user`` runs before every blueprint request. It verifies the Bearer
+token once and puts the caller on ``g`` (``g.user_id``, ``g.role``).
+Verified tokens are kept in a bounded LRU until their ``exp``, so the
+dashboard's repeated calls skip signature verification. Handlers opt in
+to enforcement with ``login_required`` / ``admin_required``.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+import jwt
+from flask import g, jsonify, request
+
+from .cache import LRUCache
+from .model import connection
+
+JWT_SECRET = os.environ.get("JWT_SECRET")
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "1024"))
+# Upper bound on how long a token without an exp claim stays cached
+TOKEN_CACHE_MAX_TTL = 300
+
+# Endpoints that never look at the Authorization header
+PUBLIC_ENDPOINTS = {"routes.login", "routes.signup"}
+
+_verified = LRUCache(TOKEN_CACHE_SIZE)
+
+
+def issue_token(user_id, role, hours=24):
+    return jwt.encode({
+        "user_id": user_id,
+        "role": role,
+        "exp": datetime.utcnow() + timedelta(hours=hours)
+    }, JWT_SECRET, algorithm="HS256")
+
+
+def verify_token(token):
+    """Return the token payload, from the cache when it was verified before.
+
+    Raises jwt.InvalidTokenError if the token is invalid or expired.
+    """
+    payload = _verified.get(token)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    exp = payload.get("exp")
+    _verified.put(token, payload, exp - time.time() if exp else TOKEN_CACHE_MAX_TTL)
+    return payload
+
+
+def load_user():
+    """before_request hook: authenticate the caller if a token was sent.
+
+    A missing header leaves the request anonymous; a malformed or invalid
+    token is rejected outright.
+    """
+    g.user_id = None
+    g.role = None
+    if request.endpoint in PUBLIC_ENDPOINTS or request.method == "OPTIONS":
+        return None
+
+    auth = request.headers.get("Authorization")
+    if not auth:
+        return None
+    if not auth.startswith("Bearer "):
+        return jsonify({"message": "Missing or invalid Authorization header"}), 401
+
+    token = auth.split(" ", 1)[1].strip()
+    try:
+        payload = verify_token(token)
+    except Exception as e:
+        return jsonify({"message": "Invalid token", "error": str(e)}), 401
+    g.user_id = payload.get("user_id")
+    g.role = payload.get("role")
+    return None
+
+
+def current_role():
+    """Caller's role. Tokens issued before roles were embedded fall back to one lookup."""
+    if g.role is None and g.user_id is not None:
+        with connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT role FROM users WHERE user_id=%s", (g.user_id,))
+            row = cursor.fetchone()
+        g.role = row[0] if row else None
+    return g.role
+
+
+def is_admin():
+    return g.user_id is not None and current_role() == "admin"
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.user_id is None:
+            return jsonify({"message": "Missing or invalid Authorization header"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.user_id is None:
+            return jsonify({"message": "Missing or invalid Authorization header"}), 401
+        if current_role() != "admin":
+            return jsonify({"message": "Admin role required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def scoped_user_id(requested):
+    """Resolve the user_id a list query should be limited to.
+
+    Callers default to themselves; only admins may ask for another user's
+    rows. Anonymous callers get 401.
+    Returns (user_id or None, error response or None).
+    """
+    if g.user_id is None:
+        return None, (jsonify({"message": "Missing or invalid Authorization header"}), 401)
+    if requested and str(requested) != str(g.user_id) and not is_admin():
+        return None, (jsonify({"message": "Not allowed to list another user's data"}), 403)
+    return requested or g.user_id, None
+
+
+def stats():
+    return {"token_cache_entries": len(_verified), "token_cache_max": TOKEN_CACHE_SIZE}
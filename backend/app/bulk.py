@@ -0,0 +1,136 @@
+"""Multi-row inserts for fields and crops.
+
+Batch endpoints validate the whole request first, then insert each table
+with a single multi-row ``INSERT ... VALUES`` (execute_values) inside the
+caller's transaction, so a batch is all-or-nothing and costs one round trip
+per table instead of one request + commit per row.
+"""
+import os
+
+from .model import execute_values
+from .weather import parse_location
+
+MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+
+class BatchError(ValueError):
+    """The batch was rejected before touching the database."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def _items(data, key):
+    items = data.get(key) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise BatchError(f"Body must be a non-empty list or {{{key}: [...]}}")
+    if len(items) > MAX_ITEMS:
+        raise BatchError(f"At most {MAX_ITEMS} {key} per request")
+    return items
+
+
+def _owner(item, user_id, any_owner):
+    # only admins (any_owner) may create rows for another user
+    return (item.get("user_id") or user_id) if any_owner else user_id
+
+
+def _crop_row(item, user_id, field_id=None):
+    return {
+        "name": item.get("name"),
+        "health_status": item.get("health_status"),
+        "planting_date": item.get("planting_date") or None,
+        "user_id": user_id,
+        "field_id": field_id if field_id is not None else item.get("field_id"),
+    }
+
+
+def parse_crops(data, user_id, any_owner=False):
+    """Validate a crop batch owned by ``user_id``. Returns a list of crop dicts in input order.
+
+    ``any_owner`` lets each item name its own ``user_id`` (admins).
+    """
+    crops, errors = [], []
+    for i, item in enumerate(_items(data, "crops")):
+        if not isinstance(item, dict) or not item.get("name"):
+            errors.append({"index": i, "error": "Crop name is required"})
+            continue
+        field_id = item.get("field_id")
+        if field_id not in (None, "") and not str(field_id).strip().isdigit():
+            errors.append({"index": i, "error": "field_id must be an integer"})
+            continue
+        crops.append(_crop_row(item, _owner(item, user_id, any_owner),
+                               int(field_id) if field_id not in (None, "") else None))
+    if errors:
+        raise BatchError("Invalid crops", errors)
+    return crops
+
+
+def parse_fields(data, user_id, any_owner=False):
+    """Validate a field batch owned by ``user_id``; each field may carry its own ``crops`` list.
+
+    ``any_owner`` lets each field name its own ``user_id`` (admins).
+    Returns a list of field dicts (with a ``crops`` list each) in input order.
+    """
+    fields, errors = [], []
+    for i, item in enumerate(_items(data, "fields")):
+        if not isinstance(item, dict) or not item.get("location"):
+            errors.append({"index": i, "error": "Field location is required"})
+            continue
+        nested = item.get("crops") or []
+        if not isinstance(nested, list):
+            errors.append({"index": i, "error": "crops must be a list"})
+            continue
+        crops = []
+        for j, crop in enumerate(nested):
+            if not isinstance(crop, dict) or not crop.get("name"):
+                errors.append({"index": i, "crop_index": j, "error": "Crop name is required"})
+                continue
+            crops.append(crop)
+        owner = _owner(item, user_id, any_owner)
+        # numeric copy of the coordinates for the spatial queries; None if not "lat,lon"
+        point = parse_location(item["location"]) or (None, None)
+        fields.append({"location": item["location"], "user_id": owner, "lat": point[0], "lon": point[1],
+                       "crops": [_crop_row(c, owner) for c in crops]})
+    if errors:
+        raise BatchError("Invalid fields", errors)
+    return fields
+
+
+def _insert_returning_ids(cursor, sql, values, template):
+    rows = execute_values(cursor, sql, values, template=template, page_size=len(values), fetch=True)
+    # Serial ids are handed out in VALUES order within a statement, so sorting
+    # maps them back onto the input rows without relying on RETURNING order
+    return sorted(r[0] for r in rows)
+
+
+def insert_crops(cursor, crops):
+    """Insert crop dicts; sets each dict's ``id``. Returns the (field_id, planting_date) pairs touched."""
+    if not crops:
+        return []
+    ids = _insert_returning_ids(
+        cursor,
+        "INSERT INTO crops (name, health_status, planting_date, user_id, field_id) VALUES %s RETURNING crop_id;",
+        [(c["name"], c["health_status"], c["planting_date"], c["user_id"], c["field_id"]) for c in crops],
+        "(%s, %s, %s, %s, %s)",
+    )
+    for crop, crop_id in zip(crops, ids):
+        crop["id"] = crop_id
+    return [(c["field_id"], c["planting_date"]) for c in crops if c["field_id"] and c["planting_date"]]
+
+
+def insert_fields(cursor, fields):
+    """Insert field dicts and their nested crops; sets ``id`` on each. Returns touched analytics pairs."""
+    ids = _insert_returning_ids(
+        cursor,
+        "INSERT INTO fields (location, user_id, lat, lon) VALUES %s RETURNING field_id;",
+        [(f["location"], f["user_id"], f["lat"], f["lon"]) for f in fields],
+        "(%s, %s, %s, %s)",
+    )
+    crops = []
+    for field, field_id in zip(fields, ids):
+        field["id"] = field_id
+        for crop in field["crops"]:
+            crop["field_id"] = field_id
+            crops.append(crop)
+    return insert_crops(cursor, crops)
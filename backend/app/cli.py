@@ -0,0 +1,71 @@
+import json
+
+import click
+
+from . import analytics, inventory, market, migrations, weather
+from .model import connection
+
+
+@click.command("migrate")
+@click.option("--target", type=int, default=None, help="Stop at this schema version (default: latest).")
+@click.option("--status", is_flag=True, help="Only print the current and latest schema versions.")
+def migrate_command(target, status):
+    """Apply pending schema migrations."""
+    if status:
+        with connection() as conn, conn.cursor() as cursor:
+            version = migrations.current_version(cursor)
+        click.echo(f"Database schema version {version}, latest {migrations.LATEST_VERSION}.")
+        return
+    applied = migrations.migrate(target, log=click.echo)
+    if not applied:
+        click.echo("Schema is up to date.")
+
+
+@click.command("refresh-weather")
+@click.option("--forecast-days", default=0, show_default=True, type=click.IntRange(0, weather.MAX_FORECAST_DAYS),
+              help="Extra days of hourly forecast to store beyond today.")
+@click.option("--batch-size", default=weather.BATCH_SIZE, show_default=True, type=click.IntRange(1),
+              help="Grid cells per Open-Meteo request.")
+@click.option("--concurrency", default=weather.CONCURRENCY, show_default=True, type=click.IntRange(1),
+              help="Batches fetched in parallel.")
+def refresh_weather_command(forecast_days, batch_size, concurrency):
+    """Refresh hourly weather for every field in the fields table."""
+    summary = weather.refresh_all(forecast_days, batch_size, concurrency)
+    click.echo(json.dumps(summary, indent=2))
+
+
+@click.command("rebuild-analytics")
+def rebuild_analytics_command():
+    """Recompute every analytics rollup bucket from the raw tables."""
+    with connection() as conn, conn.cursor() as cursor:
+        touched = analytics.rebuild(cursor)
+        conn.commit()
+    click.echo(f"Rebuilt analytics rollups from {touched} field-days.")
+
+
+@click.command("rebuild-market")
+def rebuild_market_command():
+    """Recompute the market price daily rollup from the raw prices."""
+    with connection() as conn, conn.cursor() as cursor:
+        days = market.rebuild(cursor)
+        conn.commit()
+    click.echo(f"Rebuilt market price rollup: {days} crop-days.")
+
+
+@click.command("compact-inventory")
+@click.option("--keep-days", default=inventory.LEDGER_DAYS, show_default=True, type=click.IntRange(0),
+              help="Days of per-movement ledger detail to keep (0 keeps everything).")
+def compact_inventory_command(keep_days):
+    """Snapshot daily closing stock per item and prune ledger rows past the retention."""
+    with connection() as conn, conn.cursor() as cursor:
+        summary = inventory.compact(cursor, keep_days)
+        conn.commit()
+    click.echo(json.dumps(summary, indent=2, default=str))
+
+
+def register(app):
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(refresh_weather_command)
+    app.cli.add_command(rebuild_analytics_command)
+    app.cli.add_command(rebuild_market_command)
+    app.cli.add_command(compact_inventory_command)
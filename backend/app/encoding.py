@@ -0,0 +1,147 @@
+"""Response encoding: fast JSON and negotiated compression.
+
+``FastJSONProvider`` replaces Flask's JSON provider. It serializes with
+orjson when that is installed (stdlib ``json`` otherwise), writes dates and
+datetimes as ISO 8601 and decimals as strings, and leaves keys unsorted.
+Views can therefore hand rows with date columns straight to ``jsonify``
+instead of converting them one by one. ``dumps`` is the same serializer for
+code running outside a request (streamed exports).
+
+``register`` adds an after_request hook that compresses responses of at
+least COMPRESS_MIN_BYTES with brotli (if the ``brotli`` package is
+installed) or gzip, whichever the client's Accept-Encoding prefers. Small
+bodies, streamed responses and non-text types are sent as they are.
+COMPRESS=0 turns compression off; JSON_ORJSON=0 forces the stdlib encoder.
+"""
+import decimal
+import gzip
+import json
+import os
+import uuid
+from datetime import date, datetime, time
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+COMPRESS = os.getenv("COMPRESS", "1") != "0"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+# brotli's mid qualities compress better than gzip -6 at similar speed; 11 is for static assets
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+COMPRESSIBLE = ("application/json", "application/x-ndjson", "text/")
+
+try:
+    if os.getenv("JSON_ORJSON", "1") == "0":
+        raise ImportError
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj):
+        return _encoder.encode(obj).encode("utf-8")
+
+    def loads(data):
+        return json.loads(data)
+
+
+def dumps(obj):
+    """Serialize ``obj`` to a JSON string (same rules as the app's responses)."""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # explicit json.dumps options (indent, sort_keys...) keep stdlib behaviour
+            kwargs.setdefault("default", _default)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def choose_encoding(accept):
+    """Pick "br", "gzip" or None from an Accept-Encoding header (werkzeug MIMEAccept)."""
+    options = [("gzip", accept.quality("gzip"))]
+    if brotli is not None:
+        options.insert(0, ("br", accept.quality("br")))
+    best, quality = max(options, key=lambda o: o[1])  # max keeps the first on ties: br wins
+    return best if quality > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _compress_response(response):
+    # only successful full bodies are compressed (2xx except 204/206)
+    if (response.direct_passthrough or response.is_streamed or not 200 <= response.status_code < 300
+            or response.status_code in (204, 206) or "Content-Encoding" in response.headers
+            or not (response.mimetype or "").startswith(COMPRESSIBLE)):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def stats():
+    encodings = []
+    if COMPRESS:
+        encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return {"json": "orjson" if orjson is not None else "json", "compression": encodings,
+            "compress_min_bytes": COMPRESS_MIN_BYTES}
+
+
+def register(app):
+    """Use FastJSONProvider for jsonify and compress eligible responses."""
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
+    if COMPRESS:
+        app.after_request(_compress_response)
@@ -0,0 +1,172 @@
+"""Field event log (watering / fertilizer / pesticide / note per day).
+
+One row per (field_id, date) in ``field_events``. Writes are upserts on that
+key, so re-sending the same day from the planting calendar or re-importing
+a CSV is idempotent. CSV uses the calendar's export format
+``date,watered,fertilizer,pesticide,note``; bulk files spanning many fields
+add a leading ``field_id`` column. Imports are parsed and written in chunks
+and exports stream from a server-side cursor, so neither holds a whole
+history in memory.
+"""
+import csv
+import io
+import os
+from datetime import date
+
+from .model import execute_values
+
+FLAGS = ("watered", "fertilizer", "pesticide")
+CSV_COLUMNS = ("date",) + FLAGS + ("note",)
+# rows per INSERT during CSV imports
+IMPORT_CHUNK = int(os.getenv("EVENTS_IMPORT_CHUNK", "1000"))
+
+_TRUE = {"1", "true", "yes", "y", "on"}
+_FALSE = {"0", "false", "no", "n", "off", ""}
+
+UPSERT_SQL = """
+    INSERT INTO field_events (field_id, date, watered, fertilizer, pesticide, note, updated_at)
+    VALUES %s
+    ON CONFLICT (field_id, date) DO UPDATE
+    SET watered = EXCLUDED.watered, fertilizer = EXCLUDED.fertilizer,
+        pesticide = EXCLUDED.pesticide, note = EXCLUDED.note, updated_at = EXCLUDED.updated_at;
+"""
+
+SELECT_SQL = "SELECT field_id, date, watered, fertilizer, pesticide, note FROM field_events"
+
+
+class EventError(ValueError):
+    """An event row or CSV line could not be parsed."""
+
+
+def _flag(value, name):
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise EventError(f"{name} must be 0/1 or true/false, got '{value}'")
+
+
+def _day(value):
+    try:
+        return date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise EventError(f"date must be YYYY-MM-DD, got '{value}'")
+
+
+def from_dict(field_id, item):
+    """Normalize one event dict to a (field_id, date, watered, fertilizer, pesticide, note) tuple."""
+    if not isinstance(item, dict):
+        raise EventError("Each event must be an object")
+    note = item.get("note")
+    return (field_id, _day(item.get("date")), *(_flag(item.get(f), f) for f in FLAGS),
+            str(note) if note not in (None, "") else None)
+
+
+def parse_events(field_id, data):
+    """Events from a JSON body.
+
+    Accepts ``{events: [{date, ...}]}``, a bare list, or the calendar's
+    localStorage shape ``{"YYYY-MM-DD": {watered, ...}}``.
+    """
+    if isinstance(data, dict) and "events" in data:
+        data = data["events"]
+    if isinstance(data, dict):
+        data = [{"date": day, **(entry or {})} for day, entry in data.items()]
+    if not isinstance(data, list):
+        raise EventError("Body must be a list of events or {events: [...]}")
+    rows = []
+    for i, item in enumerate(data):
+        try:
+            rows.append(from_dict(field_id, item))
+        except EventError as e:
+            raise EventError(f"Event {i}: {e}")
+    return rows
+
+
+def read_csv(stream, field_id=None):
+    """Yield event tuples from a CSV text stream, one line at a time.
+
+    Without ``field_id`` the file must have a ``field_id`` column.
+    """
+    reader = csv.reader(stream)
+    header = [h.strip().lower() for h in next(reader, [])]
+    if "date" not in header:
+        raise EventError(f"CSV header must include {','.join(CSV_COLUMNS)}")
+    if field_id is None and "field_id" not in header:
+        raise EventError("CSV header must include field_id")
+    index = {name: i for i, name in enumerate(header)}
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        item = {name: values[i] if i < len(values) else "" for name, i in index.items()}
+        try:
+            fid = field_id if field_id is not None else int(item["field_id"])
+            yield from_dict(fid, item)
+        except (EventError, ValueError) as e:
+            raise EventError(f"Line {reader.line_num}: {e}")
+
+
+def upsert(cursor, rows):
+    """Upsert event tuples. Later rows for the same (field_id, date) win."""
+    # A single INSERT ... ON CONFLICT cannot touch the same key twice
+    latest = {(r[0], r[1]): r for r in rows}
+    if latest:
+        execute_values(cursor, UPSERT_SQL, list(latest.values()),
+                       template="(%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)", page_size=IMPORT_CHUNK)
+    return len(latest)
+
+
+def import_rows(cursor, rows, check_fields=None):
+    """Upsert an iterable of event tuples in chunks. Returns the number of rows written.
+
+    ``check_fields(cursor, field_ids)`` is called per chunk and should raise
+    if any id is not writable by the caller.
+    """
+    written = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= IMPORT_CHUNK:
+            written += _write_chunk(cursor, chunk, check_fields)
+            chunk = []
+    if chunk:
+        written += _write_chunk(cursor, chunk, check_fields)
+    return written
+
+
+def _write_chunk(cursor, chunk, check_fields):
+    if check_fields:
+        check_fields(cursor, {r[0] for r in chunk})
+    return upsert(cursor, chunk)
+
+
+def to_dict(row):
+    field_id, day, watered, fertilizer, pesticide, note = row
+    return {"field_id": field_id, "date": day.isoformat(), "watered": watered,
+            "fertilizer": fertilizer, "pesticide": pesticide, "note": note or ""}
+
+
+def render_csv(cursor, with_field=False, lines_per_chunk=500):
+    """Yield CSV text for rows from ``cursor`` in the calendar's export format.
+
+    All values are quoted and lines end in CRLF, matching PlantingCalendar's
+    Export CSV. Output is yielded a few hundred lines at a time.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+    writer.writerow((("field_id",) if with_field else ()) + CSV_COLUMNS)
+    pending = 1
+    for field_id, day, watered, fertilizer, pesticide, note in cursor:
+        values = [day.isoformat(), *("1" if v else "0" for v in (watered, fertilizer, pesticide)), note or ""]
+        writer.writerow([field_id] + values if with_field else values)
+        pending += 1
+        if pending >= lines_per_chunk:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+            pending = 0
+    if pending:
+        yield out.getvalue()
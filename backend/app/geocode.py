@@ -0,0 +1,280 @@
+"""Cached reverse geocoding.
+
+Lookups are keyed on a lat/lon grid cell (GEOCODE_GRID_DECIMALS, default 3
+decimals ~ 110 m) and answered from an in-process LRU first, then from the
+``geocode_cache`` table, and only then from Nominatim. Upstream calls go
+through a process-wide rate limiter so we stay within Nominatim's
+1 request/second usage policy, and through ``upstream.nominatim`` (pooled
+session, circuit breaker). When Nominatim is failing, expired cache rows
+(kept for GEOCODE_STALE_TTL) are served with ``stale: true``.
+"""
+import os
+import threading
+import time
+
+from . import versions
+from .cache import LRUCache
+from .model import BACKEND, connection, execute_values
+from .upstream import UpstreamError, nominatim
+
+GRID_DECIMALS = int(os.getenv("GEOCODE_GRID_DECIMALS", "3"))
+CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+# expired rows stay this long as a fallback for Nominatim outages
+STALE_TTL = max(CACHE_TTL, float(os.getenv("GEOCODE_STALE_TTL", str(180 * 24 * 3600))))
+LRU_SIZE = int(os.getenv("GEOCODE_LRU_SIZE", "4096"))
+MIN_INTERVAL = float(os.getenv("GEOCODE_MIN_INTERVAL", "1.0"))
+# Purge expired rows from the table once every this many upstream writes
+PURGE_EVERY = 100
+
+
+class GeocodeError(Exception):
+    """Nominatim timed out or returned a service error."""
+
+
+class RateLimiter:
+    """Spaces calls at least ``interval`` seconds apart across all threads."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Block until a slot is free. Returns False if that would take longer than ``timeout``."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at)
+            if timeout is not None and slot - now > timeout:
+                return False
+            self._next_at = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+
+_memory = LRUCache(LRU_SIZE)
+_limiter = RateLimiter(MIN_INTERVAL)
+
+if BACKEND == "sqlite":
+    # key pairs are bound as two JSON arrays and zipped back together on array index
+    _SELECT_SQL = """
+        SELECT lat_key, lon_key, city, state, display_name,
+               (julianday('now') - julianday(fetched_at)) * 86400
+        FROM geocode_cache
+        WHERE grid_decimals = %s
+          AND fetched_at > datetime('now', '-' || %s || ' seconds')
+          AND (lat_key, lon_key) IN (SELECT a.value, b.value FROM json_each(%s) a JOIN json_each(%s) b ON b.key = a.key);
+    """
+    _PURGE_SQL = "DELETE FROM geocode_cache WHERE fetched_at < datetime('now', '-' || %s || ' seconds');"
+else:
+    _SELECT_SQL = """
+        SELECT lat_key, lon_key, city, state, display_name,
+               EXTRACT(EPOCH FROM NOW() - fetched_at)
+        FROM geocode_cache
+        WHERE grid_decimals = %s
+          AND fetched_at > NOW() - %s * INTERVAL '1 second'
+          AND (lat_key, lon_key) IN (SELECT * FROM unnest(%s::int[], %s::int[]));
+    """
+    _PURGE_SQL = "DELETE FROM geocode_cache WHERE fetched_at < NOW() - %s * INTERVAL '1 second';"
+
+_writes_since_purge = 0
+_purge_lock = threading.Lock()
+
+
+def grid_key(lat, lon):
+    scale = 10 ** GRID_DECIMALS
+    return int(round(lat * scale)), int(round(lon * scale))
+
+
+def _cell_center(key):
+    scale = 10 ** GRID_DECIMALS
+    return key[0] / scale, key[1] / scale
+
+
+def _parse_location(raw):
+    """Map a Nominatim /reverse JSON body to city/state/display_name."""
+    if not isinstance(raw, dict) or raw.get('error'):
+        # e.g. {"error": "Unable to geocode"} for points at sea
+        return {"city": None, "state": None, "display_name": None}
+    address = raw.get('address', {}) or {}
+    city = (address.get('city') or address.get('town') or address.get('village') or
+            address.get('hamlet') or address.get('county') or None)
+    # Prefer 'state' but fall back to other region-like fields
+    state = address.get('state') or address.get('region') or None
+    return {"city": city, "state": state, "display_name": raw.get('display_name')}
+
+
+def _load_cached(keys, max_age=CACHE_TTL):
+    """Fetch rows younger than ``max_age`` for ``keys`` from the table. Returns {key: (result, age_seconds)}."""
+    if not keys:
+        return {}
+    lat_keys = [k[0] for k in keys]
+    lon_keys = [k[1] for k in keys]
+    try:
+        with connection() as conn, conn.cursor() as cursor:
+            cursor.execute(_SELECT_SQL, (GRID_DECIMALS, max_age, lat_keys, lon_keys))
+            rows = cursor.fetchall()
+    except Exception as e:
+        # The table is only a cache tier; fall through to upstream if it is unavailable
+        print(f"Geocode cache read failed: {e}")
+        return {}
+    return {
+        (lat_key, lon_key): ({"city": city, "state": state, "display_name": display_name}, float(age))
+        for lat_key, lon_key, city, state, display_name, age in rows
+    }
+
+
+def _store_cached(entries):
+    """Upsert {key: result} into the table and purge expired rows now and then."""
+    global _writes_since_purge
+    if not entries:
+        return
+    values = [(GRID_DECIMALS, k[0], k[1], r["city"], r["state"], r["display_name"]) for k, r in entries.items()]
+    with _purge_lock:
+        _writes_since_purge += len(values)
+        purge = _writes_since_purge >= PURGE_EVERY
+        if purge:
+            _writes_since_purge = 0
+    try:
+        with connection() as conn, conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO geocode_cache (grid_decimals, lat_key, lon_key, city, state, display_name, fetched_at)
+                VALUES %s
+                ON CONFLICT (grid_decimals, lat_key, lon_key) DO UPDATE
+                SET city = EXCLUDED.city, state = EXCLUDED.state,
+                    display_name = EXCLUDED.display_name, fetched_at = EXCLUDED.fetched_at;
+                """,
+                values,
+                template="(%s, %s, %s, %s, %s, %s, NOW())",
+            )
+            if purge:
+                cursor.execute(_PURGE_SQL, (STALE_TTL,))
+            conn.commit()
+        versions.bump(["geocode"])
+    except Exception as e:
+        print(f"Geocode cache write failed: {e}")
+
+
+def _lookup_upstream(key, wait_timeout=None):
+    """Rate-limited Nominatim lookup for a grid cell. Returns None if no slot was free in time."""
+    if nominatim.state() == "open":
+        # don't spend a rate-limit slot on a call that will be refused
+        raise GeocodeError("Nominatim is unavailable (circuit open)")
+    if not _limiter.acquire(wait_timeout):
+        return None
+    lat, lon = _cell_center(key)
+    try:
+        raw = nominatim.get_json("/reverse", {
+            "format": "jsonv2", "lat": lat, "lon": lon, "addressdetails": 1, "accept-language": "en",
+        })
+    except UpstreamError as e:
+        raise GeocodeError(str(e)) from e
+    return _parse_location(raw)
+
+
+def _load_stale(keys):
+    """Expired-but-kept rows for ``keys``: {key: result with stale=True}."""
+    return {key: {**result, "stale": True} for key, (result, _) in _load_cached(keys, STALE_TTL).items()}
+
+
+def _resolve_cached(keys):
+    """Answer as many keys as possible from memory and the table. Returns {key: result}."""
+    found = {}
+    missing = []
+    for key in keys:
+        hit = _memory.get(key)
+        if hit is not None:
+            found[key] = hit
+        else:
+            missing.append(key)
+
+    for key, (result, age) in _load_cached(missing).items():
+        _memory.put(key, result, CACHE_TTL - age)
+        found[key] = result
+    return found
+
+
+def reverse(lat, lon):
+    """Reverse-geocode one point. Returns (result, cached).
+
+    Raises GeocodeError if the upstream call fails and no stale row is kept.
+    """
+    key = grid_key(lat, lon)
+    found = _resolve_cached([key])
+    if key in found:
+        return found[key], True
+
+    try:
+        result = _lookup_upstream(key)
+    except GeocodeError:
+        stale = _load_stale([key])
+        if key in stale:
+            return stale[key], True
+        raise
+    _memory.put(key, result, CACHE_TTL)
+    _store_cached({key: result})
+    return result, False
+
+
+def lookup_cached(points):
+    """Cached results for (lat, lon) points in input order, None where the cell is not cached.
+
+    Never calls Nominatim; memory first, then one table query for the rest.
+    """
+    keys = [grid_key(lat, lon) for lat, lon in points]
+    found = _resolve_cached(list(dict.fromkeys(keys)))
+    return [found.get(key) for key in keys]
+
+
+def reverse_many(points, max_upstream):
+    """Reverse-geocode many (lat, lon) points in input order.
+
+    Cached cells are answered straight away; at most ``max_upstream`` distinct
+    misses are sent to Nominatim (rate-limited). Each result carries
+    ``cached`` and, for unresolved points, a ``warning``.
+    """
+    keys = [grid_key(lat, lon) for lat, lon in points]
+    unique = list(dict.fromkeys(keys))
+    found = _resolve_cached(unique)
+    cached = set(found)
+
+    fresh = {}
+    failed = {}
+    for key in unique:
+        if key in found:
+            continue
+        if len(fresh) + len(failed) >= max_upstream:
+            failed[key] = "deferred"
+            continue
+        try:
+            result = _lookup_upstream(key)
+        except Exception as e:
+            failed[key] = "geocoding_failed"
+            print(f"Reverse geocode failed for {_cell_center(key)}: {e}")
+            continue
+        _memory.put(key, result, CACHE_TTL)
+        fresh[key] = result
+    found.update(fresh)
+    _store_cached(fresh)
+    stale = _load_stale([k for k, reason in failed.items() if reason == "geocoding_failed"])
+    found.update(stale)
+    cached.update(stale)
+
+    results = []
+    for (lat, lon), key in zip(points, keys):
+        item = {"lat": lat, "lon": lon}
+        if key in found:
+            item.update(found[key])
+            item["cached"] = key in cached
+        else:
+            item.update({"city": None, "state": None, "display_name": None,
+                         "cached": False, "warning": failed.get(key)})
+        results.append(item)
+    return results
+
+
+def stats():
+    return {"memory_entries": len(_memory), "memory_max": LRU_SIZE, "grid_decimals": GRID_DECIMALS}
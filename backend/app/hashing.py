@@ -0,0 +1,154 @@
+"""Password hashing off the request thread.
+
+scrypt/pbkdf2 are deliberately slow and hold the GIL, so a burst of logins
+would stall every other request on the worker. Hashes are computed in a
+small process pool instead. The number of queued + running jobs is capped
+(HASH_MAX_PENDING); past that ``HashingBusy`` is raised immediately so the
+endpoint can answer 503 instead of piling up requests. Jobs slower than
+HASH_TIMEOUT and pools whose worker died (crash, OOM kill) end up on the
+same 503 path; a broken pool is replaced on the next call.
+
+PASSWORD_HASH_METHOD sets the werkzeug method and work factor, e.g.
+"scrypt:32768:8:1" or "pbkdf2:sha256:600000". Stored hashes made with weaker
+parameters are upgraded on the next successful login (see ``needs_rehash``).
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", str(WORKERS * 8)))
+TIMEOUT = float(os.getenv("HASH_TIMEOUT", "15"))
+# Passwords per worker task in hash_many; small enough that logins interleave
+BULK_CHUNK = int(os.getenv("HASH_BULK_CHUNK", "32"))
+
+
+class HashingBusy(Exception):
+    """Hashing cannot be served right now: queue full, too slow, or the pool is restarting."""
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn, not fork: forking a threaded server can copy held locks and
+                # open DB sockets into the children
+                _executor = ProcessPoolExecutor(
+                    max_workers=WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def _discard(executor):
+    """Forget a pool whose worker died so the next call builds a fresh one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy(f"More than {MAX_PENDING} password hashing jobs pending")
+    try:
+        executor = _get_executor()
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _discard(executor)
+        raise HashingBusy("Password hashing pool restarted, please retry")
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=TIMEOUT)
+    except BrokenProcessPool:
+        _discard(executor)
+        raise HashingBusy("Password hashing pool restarted, please retry")
+    except FutureTimeout:
+        raise HashingBusy(f"Password hashing took longer than {TIMEOUT}s")
+
+
+def hash_password(password, method=None):
+    return _submit(generate_password_hash, password, method or HASH_METHOD)
+
+
+def check_password(stored_hash, password):
+    return _submit(check_password_hash, stored_hash, password)
+
+
+def _hash_chunk(passwords, method):
+    return [generate_password_hash(p, method) for p in passwords]
+
+
+def hash_many(passwords, method=None):
+    """Hash a batch of passwords across the pool, preserving order.
+
+    The batch takes one pending slot and keeps at most WORKERS chunks in
+    flight, so single logins submitted meanwhile are not stuck behind it.
+    """
+    method = method or HASH_METHOD
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy(f"More than {MAX_PENDING} password hashing jobs pending")
+    try:
+        executor = _get_executor()
+        results = []
+        in_flight = deque()
+        for i in range(0, len(passwords), BULK_CHUNK):
+            in_flight.append(executor.submit(_hash_chunk, passwords[i:i + BULK_CHUNK], method))
+            if len(in_flight) >= WORKERS:
+                results.extend(in_flight.popleft().result())
+        while in_flight:
+            results.extend(in_flight.popleft().result())
+        return results
+    except BrokenProcessPool:
+        _discard(executor)
+        raise HashingBusy("Password hashing pool restarted, please retry")
+    finally:
+        _slots.release()
+
+
+def _parse_method(method):
+    """Split a werkzeug method string into (name, params), e.g. ("scrypt", (32768, 8, 1))."""
+    name, *params = method.split(":")
+    if name == "pbkdf2":
+        # pbkdf2:<hash_name>[:iterations]; werkzeug's default iterations when omitted
+        hash_name = params[0] if params else "sha256"
+        iterations = int(params[1]) if len(params) > 1 else 600000
+        return f"pbkdf2:{hash_name}", (iterations,)
+    if name == "scrypt":
+        n, r, p = (int(x) for x in params) if params else (32768, 8, 1)
+        return name, (n, r, p)
+    return name, tuple(params)
+
+
+def needs_rehash(stored_hash, method=None):
+    """True if ``stored_hash`` uses a different algorithm or weaker parameters than configured."""
+    try:
+        stored_name, stored_params = _parse_method(stored_hash.split("$", 1)[0])
+        want_name, want_params = _parse_method(method or HASH_METHOD)
+    except (AttributeError, ValueError):
+        return True
+    if stored_name != want_name:
+        return True
+    return any(s < w for s, w in zip(stored_params, want_params))
+
+
+def stats():
+    # BoundedSemaphore keeps its counter in _value; good enough for a health readout
+    return {"workers": WORKERS, "max_pending": MAX_PENDING, "free_slots": _slots._value, "method": HASH_METHOD}
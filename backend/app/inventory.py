@@ -0,0 +1,264 @@
+"""Inventory stock: atomic deltas, an append-only movement ledger and snapshots.
+
+``inventory.quantity`` is the current stock and the only thing list and
+detail reads touch. Writers never read-modify-write it. A batch of
+movements is summed per item and applied as one
+``UPDATE ... SET quantity = quantity + delta`` guarded by
+``quantity + delta >= 0``, so concurrent workers cannot lose each other's
+updates and a row lock is held only until the batch commits. On Postgres
+the batch first locks its items in item_id order (``FOR UPDATE``), so two
+overlapping batches queue instead of deadlocking.
+
+Every movement is also appended to ``inventory_movements`` in the same
+transaction, with the balance it left behind (``quantity_after``). Ledger
+rows are never updated. ``compact`` (``flask compact-inventory``, run from
+cron) writes each item's closing balance per day into
+``inventory_snapshots`` and deletes ledger rows older than LEDGER_DAYS.
+Detail stays in the ledger for that long and daily balances are kept for
+good. ``stock_at`` answers "how much on day D" with two index lookups,
+whatever the item's history.
+"""
+import os
+from datetime import date, datetime, time, timedelta
+
+from .model import BACKEND, execute_values
+
+# movements accepted in one batch
+MAX_BATCH = int(os.getenv("INVENTORY_MAX_BATCH", "1000"))
+# days of per-movement detail compaction keeps; 0 keeps every row
+LEDGER_DAYS = int(os.getenv("INVENTORY_LEDGER_DAYS", "365"))
+# quantity is an INTEGER column on both backends
+MAX_QUANTITY = 2 ** 31 - 1
+
+COLUMNS = "item_id, name, quantity, type, user_id"
+MOVEMENT_COLUMNS = "movement_id, item_id, delta, quantity_after, reason, actor_id, created_at"
+
+if BACKEND == "sqlite":
+    # one writer at a time: the UPDATE itself serializes batches
+    _LOCK_SQL = "SELECT item_id, user_id FROM inventory WHERE item_id = ANY(%s) ORDER BY item_id;"
+    # per-item totals travel as a JSON array of [item_id, delta]
+    _APPLY_SQL = """
+        UPDATE inventory SET quantity = COALESCE(quantity, 0) + d.delta
+        FROM (SELECT json_extract(value, '$[0]') AS item_id, json_extract(value, '$[1]') AS delta
+              FROM json_each(%(totals)s)) AS d
+        WHERE inventory.item_id = d.item_id
+          AND COALESCE(inventory.quantity, 0) + d.delta BETWEEN 0 AND %(max)s
+        RETURNING item_id, quantity;
+    """
+    _DAY = "date(created_at)"
+else:
+    _LOCK_SQL = "SELECT item_id, user_id FROM inventory WHERE item_id = ANY(%s) ORDER BY item_id FOR UPDATE;"
+    _APPLY_SQL = """
+        UPDATE inventory i SET quantity = COALESCE(i.quantity, 0) + d.delta
+        FROM unnest(%(ids)s::int[], %(deltas)s::bigint[]) AS d(item_id, delta)
+        WHERE i.item_id = d.item_id
+          AND COALESCE(i.quantity, 0) + d.delta BETWEEN 0 AND %(max)s
+        RETURNING i.item_id, i.quantity;
+    """
+    _DAY = "created_at::date"
+
+# closing balance per (item, day): the quantity_after of the day's last movement
+_SNAPSHOT_SQL = f"""
+    INSERT INTO inventory_snapshots (item_id, day, quantity, movement_id)
+    SELECT m.item_id, {_DAY}, m.quantity_after, m.movement_id
+    FROM inventory_movements m
+    JOIN (SELECT MAX(movement_id) AS movement_id FROM inventory_movements
+          WHERE created_at >= %(since)s AND created_at < %(until)s
+          GROUP BY item_id, {_DAY}) closing ON closing.movement_id = m.movement_id
+    WHERE true
+    ON CONFLICT (item_id, day) DO UPDATE SET quantity = EXCLUDED.quantity, movement_id = EXCLUDED.movement_id;
+"""
+
+
+class InventoryError(ValueError):
+    """An item or movement in the request is invalid."""
+
+
+class InsufficientStock(InventoryError):
+    """Applying the movements would take an item below zero (or past MAX_QUANTITY)."""
+
+
+def _int(value, name):
+    if isinstance(value, bool):
+        raise InventoryError(f"{name} must be an integer, got '{value}'")
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise InventoryError(f"{name} must be an integer, got '{value}'")
+
+
+def parse_item(data):
+    """(name, quantity, type) of a new item from a JSON body."""
+    if not isinstance(data, dict):
+        raise InventoryError("Body must be an object")
+    name = " ".join(str(data.get("name") or "").split())
+    if not name:
+        raise InventoryError("Item name is required")
+    quantity = _int(data.get("quantity") or 0, "quantity")
+    if not 0 <= quantity <= MAX_QUANTITY:
+        raise InventoryError("quantity must be between 0 and 2147483647")
+    return name, quantity, (data.get("type") or None)
+
+
+def from_dict(item):
+    """Normalize one movement dict to an (item_id, delta, reason) tuple."""
+    if not isinstance(item, dict):
+        raise InventoryError("Each movement must be an object")
+    if item.get("item_id") in (None, ""):
+        raise InventoryError("item_id is required")
+    item_id = _int(item["item_id"], "item_id")
+    delta = _int(item.get("delta"), "delta")
+    if delta == 0 or abs(delta) > MAX_QUANTITY:
+        raise InventoryError("delta must be a non-zero integer within the quantity range")
+    reason = " ".join(str(item.get("reason") or "").split()) or None
+    return item_id, delta, reason
+
+
+def parse_movements(data):
+    """Movement tuples from ``{movements: [...]}`` or a bare list, in the order given."""
+    if isinstance(data, dict):
+        data = data.get("movements")
+    if not isinstance(data, list) or not data:
+        raise InventoryError("Body must be a non-empty list of movements or {movements: [...]}")
+    if len(data) > MAX_BATCH:
+        raise InventoryError(f"At most {MAX_BATCH} movements per batch")
+    movements = []
+    for i, item in enumerate(data):
+        try:
+            movements.append(from_dict(item))
+        except InventoryError as e:
+            raise InventoryError(f"Movement {i}: {e}")
+    return movements
+
+
+def lock(cursor, item_ids):
+    """Owners of the items, {item_id: user_id}; on Postgres the rows stay locked until commit."""
+    cursor.execute(_LOCK_SQL, (sorted(set(item_ids)),))
+    return dict(cursor.fetchall())
+
+
+def _append(cursor, rows):
+    ids = execute_values(
+        cursor,
+        "INSERT INTO inventory_movements (item_id, delta, quantity_after, reason, actor_id, created_at) "
+        "VALUES %s RETURNING movement_id;",
+        rows,
+        page_size=len(rows),
+        fetch=True,
+    )
+    # ids are handed out in VALUES order; sorting maps them back onto the rows
+    return sorted(r[0] for r in ids)
+
+
+def apply(cursor, movements, actor_id):
+    """Apply movements (already locked with ``lock``) and append them to the ledger.
+
+    Movements are applied in the order given; the batch fails with
+    InsufficientStock if any item would drop below zero along the way.
+    Returns (movement dicts, {item_id: new quantity}).
+    """
+    totals = {}
+    for item_id, delta, _ in movements:
+        totals[item_id] = totals.get(item_id, 0) + delta
+    if BACKEND == "sqlite":
+        params = {"totals": [[i, d] for i, d in sorted(totals.items())]}
+    else:
+        params = {"ids": sorted(totals), "deltas": [totals[i] for i in sorted(totals)]}
+    params["max"] = MAX_QUANTITY
+    cursor.execute(_APPLY_SQL, params)
+    quantities = dict(cursor.fetchall())
+    short = sorted(set(totals) - set(quantities))
+    if short:
+        raise InsufficientStock(f"Stock would fall below zero or exceed {MAX_QUANTITY} for item(s): {short}")
+
+    # replay the batch from each item's opening balance to get per-movement balances
+    running = {i: quantities[i] - totals[i] for i in totals}
+    now = datetime.utcnow()
+    rows = []
+    for item_id, delta, reason in movements:
+        running[item_id] += delta
+        if running[item_id] < 0:
+            raise InsufficientStock(f"Not enough stock for item(s): [{item_id}]")
+        rows.append((item_id, delta, running[item_id], reason, actor_id, now))
+    ids = _append(cursor, rows)
+    result = [movement_dict((mid,) + row) for mid, row in zip(ids, rows)]
+    return result, quantities
+
+
+def create(cursor, name, quantity, item_type, user_id, actor_id):
+    """Insert an item; a non-zero starting quantity is the ledger's first movement. Returns item_id."""
+    cursor.execute(
+        "INSERT INTO inventory (name, quantity, type, user_id) VALUES (%s, %s, %s, %s) RETURNING item_id;",
+        (name, quantity, item_type, user_id),
+    )
+    item_id = cursor.fetchone()[0]
+    if quantity:
+        _append(cursor, [(item_id, quantity, quantity, "initial stock", actor_id, datetime.utcnow())])
+    return item_id
+
+
+def stock_at(cursor, item_id, day):
+    """Quantity at the end of ``day`` (UTC), or None before the item had any recorded stock.
+
+    The newest ledger row before the end of the day wins; once that detail
+    has been compacted away, the newest daily snapshot up to the day does.
+    """
+    end = datetime.combine(day + timedelta(days=1), time())
+    cursor.execute(
+        "SELECT quantity_after FROM inventory_movements WHERE item_id = %s AND created_at < %s "
+        "ORDER BY created_at DESC, movement_id DESC LIMIT 1;",
+        (item_id, end),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(
+            "SELECT quantity FROM inventory_snapshots WHERE item_id = %s AND day <= %s ORDER BY day DESC LIMIT 1;",
+            (item_id, day),
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def compact(cursor, keep_days=LEDGER_DAYS, today=None):
+    """Snapshot closing balances of every finished day and prune old ledger rows.
+
+    Days from the newest snapshot up to yesterday are (re)summarized, so a
+    missed run is caught up by the next one and reruns are harmless.
+    Movements older than ``keep_days`` are deleted afterwards (``0`` keeps
+    them all). Returns a summary dict.
+    """
+    today = today or datetime.utcnow().date()
+    until = datetime.combine(today, time())
+    cursor.execute("SELECT MAX(day) FROM inventory_snapshots;")
+    since = cursor.fetchone()[0]
+    if isinstance(since, str):  # SQLite aggregates lose the DATE type
+        since = date.fromisoformat(since)
+    since = datetime.combine(since, time()) if since else datetime.min
+    cursor.execute(_SNAPSHOT_SQL, {"since": since, "until": until})
+    snapshots = cursor.rowcount
+
+    pruned = 0
+    if keep_days > 0:
+        cursor.execute("DELETE FROM inventory_movements WHERE created_at < %s;",
+                       (until - timedelta(days=keep_days),))
+        pruned = cursor.rowcount
+    return {"snapshots": snapshots, "pruned": pruned, "through": today - timedelta(days=1),
+            "keep_days": keep_days}
+
+
+def item_dict(row):
+    item_id, name, quantity, item_type, user_id = row
+    return {"id": item_id, "name": name, "quantity": quantity or 0, "type": item_type, "user_id": user_id}
+
+
+def movement_dict(row):
+    movement_id, item_id, delta, quantity_after, reason, actor_id, created_at = row
+    return {
+        "id": movement_id,
+        "item_id": item_id,
+        "delta": delta,
+        "quantity_after": quantity_after,
+        "reason": reason,
+        "actor_id": actor_id,
+        "created_at": created_at,
+    }
@@ -0,0 +1,265 @@
+"""Market prices: bulk ingestion and rolling per-crop trends.
+
+Every reported price is a row in ``marketprice``. Imports also recompute
+the ``market_daily`` rows for the (crop, day) pairs they touched (quote
+count, sum, min and max of that day's prices) in the same transaction, in
+the style of analytics.refresh. Trend and moving-average queries read only
+``market_daily``. A crop's 7/30/90-day figures are a primary key range scan
+over at most 90 daily rows, however many years of prices are stored.
+
+Crops are matched on ``crop_key``, the name trimmed and case-folded, so
+"Rice" and "rice " aggregate together. Imports append: sending the same
+file twice records every price twice.
+"""
+import csv
+import math
+import os
+from datetime import date, timedelta
+
+from .model import BACKEND, execute_values
+
+WINDOWS = (7, 30, 90)
+CSV_COLUMNS = ("crop_name", "date", "price_per_kg", "crop_id")
+# rows per INSERT during imports
+IMPORT_CHUNK = int(os.getenv("MARKET_IMPORT_CHUNK", "1000"))
+# longest date range the series endpoint returns
+MAX_SERIES_DAYS = 3 * 366
+
+_REFRESH_COLUMNS = "crop_key, day, crop_name, quotes, price_sum, price_min, price_max"
+_REFRESH_UPDATES = ("crop_name = EXCLUDED.crop_name, quotes = EXCLUDED.quotes, price_sum = EXCLUDED.price_sum, "
+                    "price_min = EXCLUDED.price_min, price_max = EXCLUDED.price_max")
+
+if BACKEND == "sqlite":
+    # touched pairs travel as a JSON array of [crop_key, day]
+    _REFRESH_SQL = f"""
+        INSERT INTO market_daily ({_REFRESH_COLUMNS})
+        SELECT m.crop_key, m.date, MAX(m.crop_name), COUNT(*), SUM(m.price_per_kg),
+               MIN(m.price_per_kg), MAX(m.price_per_kg)
+        FROM json_each(%(pairs)s) t
+        JOIN marketprice m ON m.crop_key = json_extract(t.value, '$[0]') AND m.date = json_extract(t.value, '$[1]')
+        WHERE m.price_per_kg IS NOT NULL
+        GROUP BY m.crop_key, m.date
+        ON CONFLICT (crop_key, day) DO UPDATE SET {_REFRESH_UPDATES};
+    """
+else:
+    _REFRESH_SQL = f"""
+        INSERT INTO market_daily ({_REFRESH_COLUMNS})
+        SELECT m.crop_key, m.date, MAX(m.crop_name), COUNT(*), SUM(m.price_per_kg),
+               MIN(m.price_per_kg), MAX(m.price_per_kg)
+        FROM unnest(%(keys)s::text[], %(days)s::date[]) AS t(crop_key, day)
+        JOIN marketprice m ON m.crop_key = t.crop_key AND m.date = t.day
+        WHERE m.price_per_kg IS NOT NULL
+        GROUP BY m.crop_key, m.date
+        ON CONFLICT (crop_key, day) DO UPDATE SET {_REFRESH_UPDATES};
+    """
+
+
+class MarketError(ValueError):
+    """A price row or CSV line could not be parsed."""
+
+
+def crop_key(name):
+    return " ".join(str(name).split()).casefold()
+
+
+def from_dict(item):
+    """Normalize one price dict to a (crop_name, crop_key, date, price_per_kg, crop_id) tuple."""
+    if not isinstance(item, dict):
+        raise MarketError("Each price must be an object")
+    name = " ".join(str(item.get("crop_name") or "").split())
+    if not name:
+        raise MarketError("crop_name is required")
+    try:
+        day = date.fromisoformat(str(item.get("date")).strip())
+    except ValueError:
+        raise MarketError(f"date must be YYYY-MM-DD, got '{item.get('date')}'")
+    try:
+        price = float(item.get("price_per_kg"))
+    except (TypeError, ValueError):
+        price = math.nan
+    if not (math.isfinite(price) and price > 0):
+        raise MarketError(f"price_per_kg must be a positive number, got '{item.get('price_per_kg')}'")
+    crop_id = item.get("crop_id")
+    try:
+        crop_id = int(crop_id) if crop_id not in (None, "") else None
+    except (TypeError, ValueError):
+        raise MarketError(f"crop_id must be an integer, got '{crop_id}'")
+    return name, crop_key(name), day, price, crop_id
+
+
+def parse_prices(data):
+    """Price tuples from a JSON body: ``{prices: [...]}`` or a bare list."""
+    if isinstance(data, dict):
+        data = data.get("prices")
+    if not isinstance(data, list) or not data:
+        raise MarketError("Body must be a non-empty list of prices or {prices: [...]}")
+    rows = []
+    for i, item in enumerate(data):
+        try:
+            rows.append(from_dict(item))
+        except MarketError as e:
+            raise MarketError(f"Price {i}: {e}")
+    return rows
+
+
+def read_csv(stream):
+    """Yield price tuples from a CSV text stream (crop_name,date,price_per_kg[,crop_id])."""
+    reader = csv.reader(stream)
+    header = [h.strip().lower() for h in next(reader, [])]
+    if not {"crop_name", "date", "price_per_kg"} <= set(header):
+        raise MarketError(f"CSV header must include {','.join(CSV_COLUMNS[:3])}")
+    index = {name: i for i, name in enumerate(header)}
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        item = {name: values[i] if i < len(values) else "" for name, i in index.items()}
+        try:
+            yield from_dict(item)
+        except MarketError as e:
+            raise MarketError(f"Line {reader.line_num}: {e}")
+
+
+def refresh(cursor, pairs):
+    """Recompute the market_daily rows of the touched (crop_key, day) pairs."""
+    pairs = sorted(set(pairs))
+    if not pairs:
+        return
+    if BACKEND == "sqlite":
+        params = {"pairs": [[key, day.isoformat()] for key, day in pairs]}
+    else:
+        params = {"keys": [p[0] for p in pairs], "days": [p[1] for p in pairs]}
+    cursor.execute(_REFRESH_SQL, params)
+
+
+def import_rows(cursor, rows):
+    """Insert price tuples in chunks and refresh the daily rollup once at the end.
+
+    Returns (prices inserted, crop-days refreshed).
+    """
+    inserted = 0
+    touched = set()
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= IMPORT_CHUNK:
+            inserted += _write_chunk(cursor, chunk, touched)
+            chunk = []
+    if chunk:
+        inserted += _write_chunk(cursor, chunk, touched)
+    refresh(cursor, touched)
+    return inserted, len(touched)
+
+
+def _write_chunk(cursor, chunk, touched):
+    execute_values(
+        cursor,
+        "INSERT INTO marketprice (crop_name, crop_key, date, price_per_kg, crop_id) VALUES %s;",
+        chunk,
+        page_size=IMPORT_CHUNK,
+    )
+    touched.update((r[1], r[2]) for r in chunk)
+    return len(chunk)
+
+
+def rebuild(cursor):
+    """Recompute market_daily from every stored price (repair). Returns the number of crop-days."""
+    cursor.execute("DELETE FROM market_daily;")
+    cursor.execute(f"""
+        INSERT INTO market_daily ({_REFRESH_COLUMNS})
+        SELECT crop_key, date, MAX(crop_name), COUNT(*), SUM(price_per_kg), MIN(price_per_kg), MAX(price_per_kg)
+        FROM marketprice
+        WHERE crop_key IS NOT NULL AND date IS NOT NULL AND price_per_kg IS NOT NULL
+        GROUP BY crop_key, date;
+    """)
+    cursor.execute("SELECT COUNT(*) FROM market_daily;")
+    return cursor.fetchone()[0]
+
+
+def _daily(cursor, keys, first, last):
+    """market_daily rows with first <= day <= last, as {crop_key: [row dict, ...]} in day order."""
+    where = "day BETWEEN %s AND %s"
+    params = [first, last]
+    if keys:
+        where += " AND crop_key = ANY(%s)"
+        params.append(list(keys))
+    cursor.execute(
+        f"SELECT {_REFRESH_COLUMNS} FROM market_daily WHERE {where} ORDER BY crop_key, day;",
+        params,
+    )
+    result = {}
+    for key, day, name, quotes, total, low, high in cursor.fetchall():
+        result.setdefault(key, []).append(
+            {"day": day, "crop_name": name, "quotes": quotes, "sum": total, "min": low, "max": high})
+    return result
+
+
+def _window(rows):
+    quotes = sum(r["quotes"] for r in rows)
+    first, last = rows[0], rows[-1]
+    first_avg = first["sum"] / first["quotes"]
+    last_avg = last["sum"] / last["quotes"]
+    return {
+        "avg": round(sum(r["sum"] for r in rows) / quotes, 2),
+        "min": min(r["min"] for r in rows),
+        "max": max(r["max"] for r in rows),
+        "quotes": quotes,
+        "days": len(rows),
+        "first": {"date": first["day"], "avg": round(first_avg, 2)},
+        "last": {"date": last["day"], "avg": round(last_avg, 2)},
+        # last day's average against the window's first day with prices
+        "change_pct": round((last_avg - first_avg) / first_avg * 100, 2),
+    }
+
+
+def trends(cursor, crops=None, as_of=None):
+    """Average, min/max and percent change per crop over each of WINDOWS, ending ``as_of``.
+
+    ``crops`` limits the result to those names (any spelling of the key).
+    Windows without a price are null.
+    """
+    as_of = as_of or date.today()
+    longest = max(WINDOWS)
+    keys = [crop_key(c) for c in crops] if crops else None
+    daily = _daily(cursor, keys, as_of - timedelta(days=longest - 1), as_of)
+    result = []
+    for key, rows in daily.items():
+        windows = {}
+        for days in WINDOWS:
+            start = as_of - timedelta(days=days - 1)
+            inside = [r for r in rows if r["day"] >= start]
+            windows[f"{days}d"] = _window(inside) if inside else None
+        result.append({"crop": rows[-1]["crop_name"], "crop_key": key, "windows": windows})
+    return {"as_of": as_of, "crops": result}
+
+
+def series(cursor, crop, start, end, window=7):
+    """Daily avg/min/max of one crop from ``start`` to ``end`` with a trailing ``window``-day moving average.
+
+    The moving average weighs every price in the window equally (sum / quotes).
+    Days without prices are left out.
+    """
+    key = crop_key(crop)
+    rows = _daily(cursor, [key], start - timedelta(days=window - 1), end).get(key, [])
+    points = []
+    total = quotes = 0
+    tail = 0
+    for row in rows:
+        total += row["sum"]
+        quotes += row["quotes"]
+        # drop the days that fell out of the trailing window
+        while rows[tail]["day"] <= row["day"] - timedelta(days=window):
+            total -= rows[tail]["sum"]
+            quotes -= rows[tail]["quotes"]
+            tail += 1
+        if row["day"] < start:
+            continue
+        points.append({
+            "date": row["day"],
+            "avg": round(row["sum"] / row["quotes"], 2),
+            "min": row["min"],
+            "max": row["max"],
+            "quotes": row["quotes"],
+            "moving_avg": round(total / quotes, 2),
+        })
+    return {"crop": rows[-1]["crop_name"] if rows else crop, "crop_key": key, "start": start, "end": end,
+            "window": window, "series": points}
@@ -0,0 +1,210 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+A deliberately small registry (counters, histograms, scrape-time gauges)
+with no third-party dependency. Recording is a dict lookup and a few adds
+under a lock, cheap enough to leave on everywhere:
+
+- per route: request count by status and latency histogram (``register``)
+- per SQL statement: latency histogram by label (``TimedCursor`` in model.py)
+- per upstream: latency by outcome, and fail-fast rejections (upstream.py)
+- connection pool checkout wait and pool errors (model.py)
+
+``GET /metrics`` serves the text format. If METRICS_TOKEN is set the scraper
+must send it as a bearer token.
+"""
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, g, request
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# seconds; covers sub-millisecond cache hits through multi-second upstream calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_gauges = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, state):
+                cumulative += n
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {state[-2]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {state[-1]}"
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def gauge(name, help, collect):
+    """Register a gauge read at scrape time. ``collect()`` returns {label dict or None: value}."""
+    _gauges.append((name, help, collect))
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.",
+                        ("method", "route", "status"))
+HTTP_DURATION = Histogram("http_request_duration_seconds", "Time to build the HTTP response.",
+                          ("method", "route"))
+HTTP_EXCEPTIONS = Counter("http_exceptions_total", "Unhandled exceptions raised by views.", ("route",))
+DB_QUERY = Histogram("db_query_duration_seconds", "SQL statement execution time by statement label.",
+                     ("statement",))
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "SQL statements that raised.", ("statement",))
+POOL_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.")
+POOL_ERRORS = Counter("db_pool_errors_total", "Connection checkouts that failed.", ("reason",))
+UPSTREAM_DURATION = Histogram("upstream_request_duration_seconds", "Outbound HTTP call time by upstream.",
+                              ("upstream", "outcome"))
+UPSTREAM_REJECTED = Counter("upstream_rejected_total", "Outbound calls refused locally without trying.",
+                            ("upstream", "reason"))
+
+_VERB_TARGET = re.compile(r"\b(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", re.I)
+_FROM = re.compile(r"\bFROM\s+(\w+)", re.I)
+_FIRST_WORD = re.compile(r"\s*(\w+)")
+
+
+def statement_label(sql):
+    """Low-cardinality label for a SQL statement, e.g. "select fields" or "insert weather"."""
+    if isinstance(sql, bytes):
+        sql = sql[:2000].decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    return _label(sql[:2000])
+
+
+@lru_cache(maxsize=1024)
+def _label(text):
+    write = _VERB_TARGET.search(text)
+    if write:
+        return f"{write.group(1).split()[0].lower()} {write.group(2).lower()}"
+    first = _FIRST_WORD.match(text)
+    verb = first.group(1).lower() if first else "unknown"
+    source = _FROM.search(text)
+    return f"{verb} {source.group(1).lower()}" if source else verb
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def _before():
+    g._metrics_started = time.perf_counter()
+
+
+def _after(response):
+    started = g.pop("_metrics_started", None)
+    if started is not None:
+        route = _route()
+        HTTP_DURATION.observe(time.perf_counter() - started, request.method, route)
+        HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+    return response
+
+
+def _teardown(exc):
+    if exc is not None:
+        HTTP_EXCEPTIONS.inc(_route())
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    for name, help, collect in _gauges:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        try:
+            values = collect()
+        except Exception as e:
+            print(f"Metrics gauge {name} failed: {e}")
+            continue
+        for labels, value in values.items():
+            labels = dict(labels or ())
+            lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+def register(app):
+    """Time every request and expose GET /metrics."""
+    app.before_request(_before)
+    app.after_request(_after)
+    app.teardown_request(_teardown)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
@@ -0,0 +1,689 @@
+"""Versioned schema migrations.
+
+Each migration is (version, description, [SQL statements]) and is applied at
+most once, in its own transaction, by ``flask --app run migrate``. Applied
+versions are recorded in ``schema_version``. App startup only runs
+``check`` (one SELECT) instead of re-issuing DDL in every worker.
+
+Statements are written to be idempotent (IF NOT EXISTS) so migration 1 can
+adopt databases created before versioning existed.
+
+With DB_BACKEND=sqlite the same versions apply; ``SQLITE_STATEMENTS``
+replaces the statements SQLite cannot run (SERIAL, ADD COLUMN IF NOT
+EXISTS, ADD COLUMN with a CURRENT_TIMESTAMP default); a step may also be a
+function taking the cursor where SQL alone cannot do it. SQLite databases are
+always created by these migrations, so version 1 declares the columns
+Postgres only gains in version 3.
+"""
+import sqlite3
+
+import psycopg2.errors
+
+from .model import BACKEND, connection
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent migrate runs serialize
+_LOCK_KEY = 827_364_001
+
+if BACKEND == "sqlite":
+    # name -> key pairs travel as a JSON array of [crop_name, crop_key]
+    _CROP_KEY_SQL = (
+        "UPDATE marketprice SET crop_key = json_extract(t.value, '$[1]') FROM json_each(%(keys)s) t "
+        "WHERE marketprice.crop_name = json_extract(t.value, '$[0]') AND marketprice.crop_key IS NULL;"
+    )
+else:
+    _CROP_KEY_SQL = (
+        "UPDATE marketprice SET crop_key = t.key FROM unnest(%(names)s::text[], %(keys)s::text[]) AS t(name, key) "
+        "WHERE marketprice.crop_name = t.name AND marketprice.crop_key IS NULL;"
+    )
+
+
+def _backfill_crop_keys(cursor):
+    """Migration 10: key existing prices with market.crop_key itself, on both backends.
+
+    A SQL backfill (lower/regexp_replace) does not case-fold like str.casefold,
+    so its keys would not match the ones imports write.
+    """
+    from .market import crop_key
+
+    cursor.execute("SELECT DISTINCT crop_name FROM marketprice WHERE crop_key IS NULL;")
+    names = [name for (name,) in cursor.fetchall()]
+    if not names:
+        return
+    if BACKEND == "sqlite":
+        params = {"keys": [[name, crop_key(name)] for name in names]}
+    else:
+        params = {"names": names, "keys": [crop_key(name) for name in names]}
+    cursor.execute(_CROP_KEY_SQL, params)
+
+
+# Migration 10 after marketprice.crop_key exists; the same on both backends
+_MARKET_DAILY = [
+    "CREATE INDEX IF NOT EXISTS idx_marketprice_crop_date ON marketprice (crop_key, date);",
+    """
+    CREATE TABLE IF NOT EXISTS market_daily(
+           crop_key TEXT NOT NULL,
+           day DATE NOT NULL,
+           crop_name TEXT NOT NULL,
+           quotes INTEGER NOT NULL,
+           price_sum FLOAT NOT NULL,
+           price_min FLOAT,
+           price_max FLOAT,
+           PRIMARY KEY (crop_key, day)
+           )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_market_daily_day ON market_daily (day);",
+    """
+    INSERT INTO market_daily (crop_key, day, crop_name, quotes, price_sum, price_min, price_max)
+    SELECT crop_key, date, MAX(crop_name), COUNT(*), SUM(price_per_kg), MIN(price_per_kg), MAX(price_per_kg)
+    FROM marketprice
+    WHERE crop_key IS NOT NULL AND date IS NOT NULL AND price_per_kg IS NOT NULL
+    GROUP BY crop_key, date
+    ON CONFLICT (crop_key, day) DO NOTHING
+    """,
+]
+
+# Migration 11 after the ledger table exists; the same on both backends
+_INVENTORY_LEDGER = [
+    "CREATE INDEX IF NOT EXISTS idx_inventory_movements_item ON inventory_movements (item_id, created_at);",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_movements_created ON inventory_movements (created_at);",
+    """
+    CREATE TABLE IF NOT EXISTS inventory_snapshots(
+           item_id INTEGER NOT NULL REFERENCES inventory(item_id) ON DELETE CASCADE,
+           day DATE NOT NULL,
+           quantity INTEGER NOT NULL,
+           movement_id BIGINT NOT NULL,
+           PRIMARY KEY (item_id, day)
+           )
+    """,
+    # opening balances for items that predate the ledger
+    """
+    INSERT INTO inventory_snapshots (item_id, day, quantity, movement_id)
+    SELECT item_id, CURRENT_DATE, COALESCE(quantity, 0), 0 FROM inventory
+    WHERE true
+    ON CONFLICT (item_id, day) DO NOTHING
+    """,
+]
+
+MIGRATIONS = [
+    (1, "baseline schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users(
+               user_id SERIAL PRIMARY KEY,
+               name TEXT NOT NULL,
+               role TEXT NOT NULL,
+               email TEXT UNIQUE NOT NULL,
+               password TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fields(
+               field_id SERIAL PRIMARY KEY,
+               location TEXT NOT NULL,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS weather(
+               weather_id SERIAL PRIMARY KEY,
+               date DATE NOT NULL,
+               weather_code INT,
+               temperature FLOAT,
+               relative_humidity FLOAT,
+               precipitation_probability FLOAT,
+               precipitation FLOAT,
+               cloud_cover FLOAT,
+               wind_speed_10m FLOAT,
+               wind_direction_10m FLOAT,
+               field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE,
+               location TEXT
+               )
+        """,
+        # Columns added to weather over time before migrations existed
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS weather_code INT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS temperature FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS relative_humidity FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS precipitation_probability FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS precipitation FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS cloud_cover FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS wind_speed_10m FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS wind_direction_10m FLOAT;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS field_id INTEGER;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS location TEXT;",
+        """
+        CREATE TABLE IF NOT EXISTS inventory(
+               item_id SERIAL PRIMARY KEY,
+               name TEXT NOT NULL,
+               quantity INTEGER DEFAULT 0,
+               type TEXT,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS crops(
+               crop_id SERIAL PRIMARY KEY,
+               name TEXT NOT NULL,
+               health_status TEXT,
+               planting_date DATE,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+               field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS marketprice(
+               price_id SERIAL PRIMARY KEY,
+               crop_name TEXT NOT NULL,
+               price_per_kg FLOAT,
+               date DATE,
+               crop_id INTEGER REFERENCES crops(crop_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS soiltest(
+               test_id SERIAL PRIMARY KEY,
+               ph_level FLOAT,
+               nutrients TEXT,
+               field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS synclog(
+               sync_id SERIAL PRIMARY KEY,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+               sync_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               status TEXT
+               )
+        """,
+    ]),
+    (2, "reverse-geocode cache", [
+        # keys are lat/lon scaled by 10**grid_decimals
+        """
+        CREATE TABLE IF NOT EXISTS geocode_cache(
+               grid_decimals SMALLINT NOT NULL,
+               lat_key INTEGER NOT NULL,
+               lon_key INTEGER NOT NULL,
+               city TEXT,
+               state TEXT,
+               display_name TEXT,
+               fetched_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (grid_decimals, lat_key, lon_key)
+               )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_geocode_cache_fetched_at ON geocode_cache (fetched_at);",
+    ]),
+    (3, "hourly weather series", [
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS observed_at TIMESTAMP;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
+        # One row per hour per field (or per location for rows not tied to a field); the
+        # partial unique indexes are the ON CONFLICT targets for the hourly series upsert
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_weather_field_observed
+        ON weather (field_id, observed_at) WHERE field_id IS NOT NULL;
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_weather_location_observed
+        ON weather (location, observed_at) WHERE field_id IS NULL;
+        """,
+    ]),
+    (4, "analytics rollups", [
+        # see app/analytics.py; sums/counts per time bucket
+        """
+        CREATE TABLE IF NOT EXISTS analytics_rollup(
+               scope TEXT NOT NULL,
+               scope_id INTEGER NOT NULL,
+               period TEXT NOT NULL,
+               bucket_start DATE NOT NULL,
+               samples INTEGER NOT NULL DEFAULT 0,
+               temp_count INTEGER NOT NULL DEFAULT 0,
+               temp_sum FLOAT NOT NULL DEFAULT 0,
+               temp_min FLOAT,
+               temp_max FLOAT,
+               humidity_count INTEGER NOT NULL DEFAULT 0,
+               humidity_sum FLOAT NOT NULL DEFAULT 0,
+               precip_total FLOAT NOT NULL DEFAULT 0,
+               wind_count INTEGER NOT NULL DEFAULT 0,
+               wind_sum FLOAT NOT NULL DEFAULT 0,
+               crops_planted INTEGER NOT NULL DEFAULT 0,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (scope, scope_id, period, bucket_start)
+               )
+        """,
+    ]),
+    (5, "per-user / per-field lookup indexes", [
+        # The trailing primary key column lets keyset pagination
+        # (WHERE user_id=... AND pk > ... ORDER BY pk) run as one index range scan.
+        # weather.field_id lookups are served by uq_weather_field_observed.
+        "CREATE INDEX IF NOT EXISTS idx_fields_user_id ON fields (user_id, field_id);",
+        "CREATE INDEX IF NOT EXISTS idx_crops_user_id ON crops (user_id, crop_id);",
+        "CREATE INDEX IF NOT EXISTS idx_crops_field_id ON crops (field_id, crop_id);",
+    ]),
+    (6, "field event log", [
+        # see app/events.py; one row per field per day
+        """
+        CREATE TABLE IF NOT EXISTS field_events(
+               field_id INTEGER NOT NULL REFERENCES fields(field_id) ON DELETE CASCADE,
+               date DATE NOT NULL,
+               watered BOOLEAN NOT NULL DEFAULT FALSE,
+               fertilizer BOOLEAN NOT NULL DEFAULT FALSE,
+               pesticide BOOLEAN NOT NULL DEFAULT FALSE,
+               note TEXT,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (field_id, date)
+               )
+        """,
+    ]),
+    (7, "delta sync change tracking", [
+        # see app/sync.py. row_version is the writing transaction's id; deletions
+        # leave a tombstone in sync_deleted (also for rows removed by ON DELETE CASCADE)
+        "ALTER TABLE fields ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0;",
+        "ALTER TABLE crops ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0;",
+        "ALTER TABLE inventory ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0;",
+        "ALTER TABLE weather ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0;",
+        "ALTER TABLE synclog ADD COLUMN IF NOT EXISTS rows_sent INTEGER;",
+        """
+        CREATE TABLE IF NOT EXISTS sync_deleted(
+               table_name TEXT NOT NULL,
+               row_id INTEGER NOT NULL,
+               user_id INTEGER,
+               row_version BIGINT NOT NULL,
+               deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (table_name, row_id)
+               )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sync_deleted_user ON sync_deleted (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_sync_deleted_at ON sync_deleted (deleted_at);",
+        "CREATE INDEX IF NOT EXISTS idx_fields_user_version ON fields (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_crops_user_version ON crops (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_user_version ON inventory (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_weather_field_version ON weather (field_id, row_version);",
+        # An update that only refreshes fetched_at (the hourly weather re-upsert) keeps its version
+        """
+        CREATE OR REPLACE FUNCTION sync_touch() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND (to_jsonb(NEW) - 'row_version' - 'fetched_at')
+                                  = (to_jsonb(OLD) - 'row_version' - 'fetched_at') THEN
+                NEW.row_version := OLD.row_version;
+            ELSE
+                NEW.row_version := txid_current();
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+        # TG_ARGV[0] is the primary key column; rows without user_id belong to their field's owner
+        """
+        CREATE OR REPLACE FUNCTION sync_tombstone() RETURNS trigger AS $$
+        DECLARE
+            old_row jsonb := to_jsonb(OLD);
+        BEGIN
+            INSERT INTO sync_deleted (table_name, row_id, user_id, row_version)
+            VALUES (TG_TABLE_NAME, (old_row ->> TG_ARGV[0])::int,
+                    COALESCE((old_row ->> 'user_id')::int,
+                             (SELECT user_id FROM fields WHERE field_id = (old_row ->> 'field_id')::int)),
+                    txid_current())
+            ON CONFLICT (table_name, row_id) DO UPDATE
+            SET user_id = EXCLUDED.user_id, row_version = EXCLUDED.row_version, deleted_at = CURRENT_TIMESTAMP;
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql;
+        """,
+        *[
+            statement
+            for table, pk in (("fields", "field_id"), ("crops", "crop_id"),
+                              ("inventory", "item_id"), ("weather", "weather_id"))
+            for statement in (
+                f"DROP TRIGGER IF EXISTS {table}_sync_touch ON {table};",
+                f"CREATE TRIGGER {table}_sync_touch BEFORE INSERT OR UPDATE ON {table} "
+                f"FOR EACH ROW EXECUTE PROCEDURE sync_touch();",
+                f"DROP TRIGGER IF EXISTS {table}_sync_tombstone ON {table};",
+                f"CREATE TRIGGER {table}_sync_tombstone AFTER DELETE ON {table} "
+                f"FOR EACH ROW EXECUTE PROCEDURE sync_tombstone('{pk}');",
+            )
+        ],
+    ]),
+    (8, "weather time index", [
+        # Per-field history (app/weather.py load_history) is a range scan on
+        # uq_weather_field_observed (field_id, observed_at). Time ranges across
+        # fields get a BRIN index: rows arrive roughly in observed_at order, so
+        # block ranges summarize well at a tiny fraction of a btree's size.
+        "CREATE INDEX IF NOT EXISTS idx_weather_observed_brin ON weather USING BRIN (observed_at) "
+        "WITH (pages_per_range = 32);",
+    ]),
+    (9, "numeric field coordinates", [
+        # see app/spatial.py; new rows get lat/lon from the app (bulk.insert_fields),
+        # existing ones are parsed here. Text that is not "lat,lon" stays NULL.
+        "ALTER TABLE fields ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION;",
+        "ALTER TABLE fields ADD COLUMN IF NOT EXISTS lon DOUBLE PRECISION;",
+        r"""
+        UPDATE fields
+        SET lat = split_part(location, ',', 1)::float8, lon = split_part(location, ',', 2)::float8
+        WHERE location ~ '^\s*[-+]?[0-9]*\.?[0-9]+\s*,\s*[-+]?[0-9]*\.?[0-9]+\s*$';
+        """,
+        "UPDATE fields SET lat = NULL, lon = NULL WHERE lat NOT BETWEEN -90 AND 90 OR lon NOT BETWEEN -180 AND 180;",
+        # built-in geometric types: <@ box containment and <-> KNN ordering use this index
+        "CREATE INDEX IF NOT EXISTS idx_fields_point ON fields USING GIST (point(lon, lat));",
+    ]),
+    (10, "market price daily rollup", [
+        # see app/market.py; crop_key is the trimmed, case-folded crop name
+        "ALTER TABLE marketprice ADD COLUMN IF NOT EXISTS crop_key TEXT;",
+        _backfill_crop_keys,
+        *_MARKET_DAILY,
+    ]),
+    (11, "inventory movement ledger", [
+        # see app/inventory.py; append-only, compacted into inventory_snapshots
+        """
+        CREATE TABLE IF NOT EXISTS inventory_movements(
+               movement_id BIGSERIAL PRIMARY KEY,
+               item_id INTEGER NOT NULL REFERENCES inventory(item_id) ON DELETE CASCADE,
+               delta INTEGER NOT NULL,
+               quantity_after INTEGER NOT NULL,
+               reason TEXT,
+               actor_id INTEGER,
+               created_at TIMESTAMP NOT NULL
+               )
+        """,
+        *_INVENTORY_LEDGER,
+    ]),
+]
+
+def _sqlite_sync_triggers(table, pk, owner, changed=None):
+    """SQLite version of sync_touch / sync_tombstone for one table.
+
+    Versions come from the single-row ``sync_clock``; SQLite has one writer
+    at a time, so they increase in commit order. ``changed`` is an extra
+    WHEN condition for updates; the version bump itself is excluded by the
+    row_version comparison.
+    """
+    stamp = f"""
+            UPDATE sync_clock SET version = version + 1;
+            UPDATE {table} SET row_version = (SELECT version FROM sync_clock) WHERE {pk} = NEW.{pk};"""
+    when = "NEW.row_version IS OLD.row_version" + (f" AND ({changed})" if changed else "")
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} BEGIN{stamp}\n        END;",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} WHEN {when} BEGIN{stamp}\n        END;",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_sync_tombstone AFTER DELETE ON {table} BEGIN
+            UPDATE sync_clock SET version = version + 1;
+            INSERT INTO sync_deleted (table_name, row_id, user_id, row_version)
+            VALUES ('{table}', OLD.{pk}, {owner}, (SELECT version FROM sync_clock))
+            ON CONFLICT (table_name, row_id) DO UPDATE
+            SET user_id = excluded.user_id, row_version = excluded.row_version, deleted_at = CURRENT_TIMESTAMP;
+        END;""",
+    ]
+
+
+_FIELD_OWNER = "(SELECT user_id FROM fields WHERE field_id = OLD.field_id)"
+_LAT_TEXT = "trim(substr(location, 1, instr(location, ',') - 1))"
+_LON_TEXT = "trim(substr(location, instr(location, ',') + 1))"
+_WEATHER_DATA = ("date", "weather_code", "temperature", "relative_humidity", "precipitation_probability",
+                 "precipitation", "cloud_cover", "wind_speed_10m", "wind_direction_10m", "field_id",
+                 "location", "observed_at")
+
+SQLITE_STATEMENTS = {
+    1: [
+        """
+        CREATE TABLE IF NOT EXISTS users(
+               user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               name TEXT NOT NULL,
+               role TEXT NOT NULL,
+               email TEXT UNIQUE NOT NULL,
+               password TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fields(
+               field_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               location TEXT NOT NULL,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS weather(
+               weather_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               date DATE NOT NULL,
+               weather_code INT,
+               temperature FLOAT,
+               relative_humidity FLOAT,
+               precipitation_probability FLOAT,
+               precipitation FLOAT,
+               cloud_cover FLOAT,
+               wind_speed_10m FLOAT,
+               wind_direction_10m FLOAT,
+               field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE,
+               location TEXT,
+               observed_at TIMESTAMP,
+               fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS inventory(
+               item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               name TEXT NOT NULL,
+               quantity INTEGER DEFAULT 0,
+               type TEXT,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE
+               )
+        """,
+        # Postgres rejects malformed dates on insert; the CHECK does the same here
+        """
+        CREATE TABLE IF NOT EXISTS crops(
+               crop_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               name TEXT NOT NULL,
+               health_status TEXT,
+               planting_date DATE CHECK (planting_date IS NULL OR date(planting_date) = planting_date),
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+               field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS marketprice(
+               price_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               crop_name TEXT NOT NULL,
+               price_per_kg FLOAT,
+               date DATE,
+               crop_id INTEGER REFERENCES crops(crop_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS soiltest(
+               test_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               ph_level FLOAT,
+               nutrients TEXT,
+               field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE
+               )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS synclog(
+               sync_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
+               sync_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               status TEXT
+               )
+        """,
+    ],
+    3: [
+        # observed_at / fetched_at are already part of the version 1 table
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_weather_field_observed
+        ON weather (field_id, observed_at) WHERE field_id IS NOT NULL;
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_weather_location_observed
+        ON weather (location, observed_at) WHERE field_id IS NULL;
+        """,
+    ],
+    7: [
+        "ALTER TABLE fields ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0;",
+        "ALTER TABLE crops ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0;",
+        "ALTER TABLE inventory ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0;",
+        "ALTER TABLE weather ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0;",
+        "ALTER TABLE synclog ADD COLUMN rows_sent INTEGER;",
+        """
+        CREATE TABLE IF NOT EXISTS sync_clock(
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               version INTEGER NOT NULL
+               )
+        """,
+        "INSERT OR IGNORE INTO sync_clock (id, version) VALUES (1, 0);",
+        """
+        CREATE TABLE IF NOT EXISTS sync_deleted(
+               table_name TEXT NOT NULL,
+               row_id INTEGER NOT NULL,
+               user_id INTEGER,
+               row_version INTEGER NOT NULL,
+               deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (table_name, row_id)
+               )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sync_deleted_user ON sync_deleted (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_sync_deleted_at ON sync_deleted (deleted_at);",
+        "CREATE INDEX IF NOT EXISTS idx_fields_user_version ON fields (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_crops_user_version ON crops (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_user_version ON inventory (user_id, row_version);",
+        "CREATE INDEX IF NOT EXISTS idx_weather_field_version ON weather (field_id, row_version);",
+        *_sqlite_sync_triggers("fields", "field_id", "OLD.user_id"),
+        *_sqlite_sync_triggers("crops", "crop_id", f"COALESCE(OLD.user_id, {_FIELD_OWNER})"),
+        *_sqlite_sync_triggers("inventory", "item_id", "OLD.user_id"),
+        # the hourly re-upsert rewrites fetched_at on every row; only real changes count
+        *_sqlite_sync_triggers("weather", "weather_id", _FIELD_OWNER,
+                               " OR ".join(f"NEW.{c} IS NOT OLD.{c}" for c in _WEATHER_DATA)),
+    ],
+    # no BRIN in SQLite; a plain btree serves the cross-field time ranges
+    8: [
+        "CREATE INDEX IF NOT EXISTS idx_weather_observed ON weather (observed_at);",
+    ],
+    9: [
+        "ALTER TABLE fields ADD COLUMN lat REAL;",
+        "ALTER TABLE fields ADD COLUMN lon REAL;",
+        f"""
+        UPDATE fields
+        SET lat = CAST({_LAT_TEXT} AS REAL), lon = CAST({_LON_TEXT} AS REAL)
+        WHERE instr(location, ',') > 0
+          AND {_LAT_TEXT} GLOB '*[0-9]*' AND {_LAT_TEXT} NOT GLOB '*[^0-9.+-]*'
+          AND {_LON_TEXT} GLOB '*[0-9]*' AND {_LON_TEXT} NOT GLOB '*[^0-9.+-]*';
+        """,
+        "UPDATE fields SET lat = NULL, lon = NULL WHERE lat NOT BETWEEN -90 AND 90 OR lon NOT BETWEEN -180 AND 180;",
+        # no GiST here: boxes are range scans on lat, nearest-N widens a box (spatial.py)
+        "CREATE INDEX IF NOT EXISTS idx_fields_lat_lon ON fields (lat, lon);",
+    ],
+    10: [
+        "ALTER TABLE marketprice ADD COLUMN crop_key TEXT;",
+        _backfill_crop_keys,
+        *_MARKET_DAILY,
+    ],
+    11: [
+        """
+        CREATE TABLE IF NOT EXISTS inventory_movements(
+               movement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               item_id INTEGER NOT NULL REFERENCES inventory(item_id) ON DELETE CASCADE,
+               delta INTEGER NOT NULL,
+               quantity_after INTEGER NOT NULL,
+               reason TEXT,
+               actor_id INTEGER,
+               created_at TIMESTAMP NOT NULL
+               )
+        """,
+        *_INVENTORY_LEDGER,
+    ],
+}
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def statements_for(version, statements):
+    """The statements to run for ``version`` on the configured backend."""
+    if BACKEND == "sqlite":
+        return SQLITE_STATEMENTS.get(version, statements)
+    return statements
+
+
+def _lock(conn, cursor):
+    """Serialize concurrent migrate runs until the current transaction ends."""
+    if BACKEND == "sqlite":
+        conn.begin()
+    else:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s);", (_LOCK_KEY,))
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version(
+               version INTEGER PRIMARY KEY,
+               description TEXT,
+               applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+               )
+        """)
+
+
+def current_version(cursor):
+    """Highest applied version, 0 for an unversioned database."""
+    if BACKEND == "sqlite":
+        cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version');")
+    else:
+        cursor.execute("SELECT to_regclass('schema_version') IS NULL;")
+    if cursor.fetchone()[0]:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+    return cursor.fetchone()[0]
+
+
+def migrate(target=None, log=print):
+    """Apply pending migrations up to ``target`` (default: latest). Returns the versions applied."""
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    with connection() as conn, conn.cursor() as cursor:
+        _lock(conn, cursor)
+        _ensure_version_table(cursor)
+        conn.commit()
+
+        for version, description, statements in MIGRATIONS:
+            if version > target:
+                break
+            # Re-check under the lock each time so a concurrent runner's work is skipped
+            _lock(conn, cursor)
+            cursor.execute("SELECT 1 FROM schema_version WHERE version = %s;", (version,))
+            if cursor.fetchone():
+                conn.rollback()
+                continue
+            try:
+                for statement in statements_for(version, statements):
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                    (version, description),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            log(f"Applied migration {version}: {description}")
+            applied.append(version)
+    return applied
+
+
+def check(log=print):
+    """Cheap startup check: one query comparing the database version with the code.
+
+    Returns the database version, or None if the database is unreachable.
+    """
+    try:
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version;")
+                version = cursor.fetchone()[0]
+            except psycopg2.errors.UndefinedTable:
+                version = 0
+            except sqlite3.OperationalError as e:
+                if "no such table" not in str(e):
+                    raise
+                version = 0
+    except Exception as e:
+        log(f"Schema version check skipped: {e}")
+        return None
+    if version < LATEST_VERSION:
+        log(f"Database schema is at version {version}, code expects {LATEST_VERSION}. "
+            "Run 'flask --app run migrate'.")
+    return version
@@ -1,8 +1,15 @@
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from pathlib import Path
 
+from . import metrics, sqlite_db
+
 # Load .env if present. If not, try .env.example in the repository root so
 # users who only have the example file still get reasonable defaults.
 loaded = load_dotenv()
@@ -13,152 +20,269 @@ if not loaded and env_example.exists():
 elif not loaded:
         print("No .env file found. Copy '.env.example' to '.env' or set environment variables for the database.")
 
-def get_connection():
-    try:
-                db_host = os.getenv("DB_HOST")
-                db_port = os.getenv("DB_PORT")
-                db_name = os.getenv("DB_NAME")
-                db_user = os.getenv("DB_USER")
-                db_password = os.getenv("DB_PASSWORD")
-
-                if not all([db_host, db_port, db_name, db_user]):
-                        print("Missing one or more required DB environment variables (DB_HOST, DB_PORT, DB_NAME, DB_USER).")
-
-                if not db_password:
-                        print("DB_PASSWORD not set — psycopg2 will fail to authenticate without a password.\n"
-                                  "Make sure you have a .env file or set the DB_PASSWORD environment variable.")
-
-                conn = psycopg2.connect(
-                        host=db_host,
-                        port=db_port,
-                        database=db_name,
-                        user=db_user,
-                        password=db_password
+# "postgres" (default) or "sqlite" for a single-node install backed by one
+# file at SQLITE_PATH; see sqlite_db.py
+BACKEND = os.getenv("DB_BACKEND", "postgres").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", str(Path(__file__).resolve().parents[1] / "croptech.db"))
+if BACKEND not in ("postgres", "sqlite"):
+    raise ValueError(f"DB_BACKEND must be postgres or sqlite, got '{BACKEND}'")
+
+# -------------------------
+# Connection pool
+# -------------------------
+class PoolError(Exception):
+    """Raised when a database connection cannot be checked out of the pool."""
+
+
+class PoolTimeout(PoolError):
+    """Raised when every pooled connection stayed busy for the whole checkout timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections.
+
+    Connections are opened lazily up to ``maxconn`` and handed out LIFO so the
+    hottest connection is reused first. A connection that has been idle longer
+    than ``check_interval`` seconds is pinged with ``SELECT 1`` before it is
+    returned to a caller; dead ones are replaced transparently.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0, check_interval=30.0):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+
+        self._cond = threading.Condition()
+        self._idle = []  # stack of (conn, idle_since)
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._errors = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(minconn):
+            try:
+                self._idle.append((self._connect(), time.monotonic()))
+            except Exception as e:
+                print(f"Connection pool prefill failed: {e}")
+                break
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        conn = since = None
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed")
+                    if self._idle:
+                        conn, since = self._idle.pop()
+                        break
+                    if self._in_use < self.maxconn:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        metrics.POOL_ERRORS.inc("timeout")
+                        raise PoolTimeout(f"Timed out after {timeout:.1f}s waiting for a database connection")
+                    self._cond.wait(remaining)
+                # reserve the slot before leaving the lock; the connect/ping happens outside it
+                self._in_use += 1
+            finally:
+                self._waiting -= 1
+
+        try:
+            if conn is not None and not self._is_alive(conn, since):
+                self._close_quietly(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception as e:
+            with self._cond:
+                self._in_use -= 1
+                self._errors += 1
+                self._cond.notify()
+            metrics.POOL_ERRORS.inc("connect")
+            raise PoolError(f"Could not open database connection: {e}") from e
+
+        waited = time.monotonic() - started
+        metrics.POOL_WAIT.observe(waited)
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        # Never hand the next caller a connection that is mid-transaction.
+        if not discard and not getattr(conn, "closed", 0):
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            keep = (not discard and not self._closed and not getattr(conn, "closed", 0)
+                    and len(self._idle) < self.maxconn)
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if not keep:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "active": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "errors": self._errors,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_max": round(self._wait_max, 6),
+                "wait_seconds_avg": round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+            }
+
+    def _is_alive(self, conn, idle_since):
+        if getattr(conn, "closed", 0):
+            return False
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that records each statement's latency under metrics.DB_QUERY."""
+
+    def execute(self, query, vars=None):
+        label = metrics.statement_label(query)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            metrics.DB_QUERY_ERRORS.inc(label)
+            raise
+        finally:
+            metrics.DB_QUERY.observe(time.perf_counter() - started, label)
+
+
+def _db_settings():
+    settings = {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
+    }
+    if not all([settings["host"], settings["port"], settings["database"], settings["user"]]):
+        print("Missing one or more required DB environment variables (DB_HOST, DB_PORT, DB_NAME, DB_USER).")
+    if not settings["password"]:
+        print("DB_PASSWORD not set — psycopg2 will fail to authenticate without a password.\n"
+              "Make sure you have a .env file or set the DB_PASSWORD environment variable.")
+    return settings
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use.
+
+    Connections go to Postgres or to the SQLite file, per DB_BACKEND. Sizing
+    is read once from DB_POOL_MIN / DB_POOL_MAX / DB_POOL_TIMEOUT /
+    DB_POOL_CHECK_INTERVAL.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if BACKEND == "sqlite":
+                    connect = lambda: sqlite_db.connect(SQLITE_PATH)
+                else:
+                    settings = _db_settings()
+                    connect = lambda: psycopg2.connect(cursor_factory=TimedCursor, **settings)
+                _pool = ConnectionPool(
+                    connect,
+                    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+                    check_interval=float(os.getenv("DB_POOL_CHECK_INTERVAL", "30")),
                 )
-                print("Connected successfully!")
-                return conn
-    except Exception as e:
-        print(f"Connection failed: {e}")
-        return None
-
-def create_tables():
-    conn= get_connection()
-    if conn is None:
-        print("Cannot create tables without a database connection.")
-        return 
-    
-    cursor = conn.cursor()
-
-    # user table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users(
-                   user_id SERIAL PRIMARY KEY,
-                   name TEXT NOT NULL,
-                   role TEXT NOT NULL,
-                   email TEXT UNIQUE NOT NULL,
-                   password TEXT NOT NULL,
-                   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                   )
-            """)
-    
-    # field table 
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS fields(
-                   field_id SERIAL PRIMARY KEY,
-                   location TEXT NOT NULL,
-                   user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE
-                  )
-            """)
-
-    #weather data table (created after fields so FK can reference fields)
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS weather(
-                   weather_id SERIAL PRIMARY KEY,
-                   date DATE NOT NULL,
-                   weather_code INT,
-                   temperature FLOAT,
-                   relative_humidity FLOAT,
-                   precipitation_probability FLOAT,
-                   precipitation FLOAT,
-                   cloud_cover FLOAT,
-                   wind_speed_10m FLOAT,
-                   wind_direction_10m FLOAT,
-                   field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE,
-                   location TEXT
-                   )
-            """)
-    # Ensure columns exist for existing tables (handle upgrades/migrations)
-    # ALTER TABLE ADD COLUMN IF NOT EXISTS is supported in modern Postgres
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS weather_code INT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS temperature FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS relative_humidity FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS precipitation_probability FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS precipitation FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS cloud_cover FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS wind_speed_10m FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS wind_direction_10m FLOAT;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS field_id INTEGER;")
-    cursor.execute("ALTER TABLE weather ADD COLUMN IF NOT EXISTS location TEXT;")
-    # Ensure foreign key constraint for field_id exists if possible (skip if already present)
-    # Note: adding FK constraints via ALTER while avoiding duplicates is more involved; keep simple for now
-    
-    # inventory table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS inventory(
-                   item_id SERIAL PRIMARY KEY,
-                   name TEXT NOT NULL,
-                   quantity INTEGER DEFAULT 0,
-                   type TEXT,
-                   user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE
-                   )       
-            """)
-    
-    # crops table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS crops(
-                   crop_id SERIAL PRIMARY KEY,
-                   name TEXT NOT NULL,
-                   health_status TEXT,
-                   planting_date DATE,
-                   user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
-                   field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE
-                   )       
-            """)
-    
-    # marketprice table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS marketprice(
-                   price_id SERIAL PRIMARY KEY,
-                   crop_name TEXT NOT NULL,
-                   price_per_kg FLOAT,
-                   date DATE,
-                   crop_id INTEGER REFERENCES crops(crop_id) ON DELETE CASCADE
-                   )       
-            """)
-    
-    # soiltest table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS soiltest(
-                   test_id SERIAL PRIMARY KEY,
-                   ph_level FLOAT,
-                   nutrients TEXT,
-                   field_id INTEGER REFERENCES fields(field_id) ON DELETE CASCADE
-                   )       
-            """)
-    
-    # synclog table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS synclog(
-                   sync_id SERIAL PRIMARY KEY,
-                   user_id INTEGER REFERENCES users(user_id) ON DELETE CASCADE,
-                   sync_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                   status TEXT
-                   )       
-            """)
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
-    
-
-    
\ No newline at end of file
+    return _pool
+
+
+def _pool_gauge():
+    if _pool is None:
+        return {}
+    stats = _pool.stats()
+    return {(("state", k),): stats[k] for k in ("active", "idle", "waiting")}
+
+
+metrics.gauge("db_pool_connections", "Pooled connections by state.", _pool_gauge)
+
+
+def connection(timeout=None):
+    """Context manager that borrows a pooled connection and returns it on exit.
+
+    Any transaction left open by the caller is rolled back when the
+    connection goes back to the pool, so commit explicitly.
+    Raises PoolError if no connection could be obtained.
+    """
+    return get_pool().connection(timeout)
+
+
+def execute_values(cursor, sql, argslist, template=None, page_size=100, fetch=False):
+    """Multi-row ``INSERT ... VALUES %s`` for the configured backend (psycopg2.extras.execute_values)."""
+    if BACKEND == "sqlite":
+        return sqlite_db.execute_values(cursor, sql, argslist, template, page_size, fetch)
+    return psycopg2.extras.execute_values(cursor, sql, argslist, template=template, page_size=page_size, fetch=fetch)
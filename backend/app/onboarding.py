@@ -0,0 +1,119 @@
+"""Bulk user onboarding for cooperatives.
+
+Accepts many users at once (JSON list or CSV with a name,email,password[,role]
+header), validates each row, hashes all passwords in parallel through the
+hashing pool and inserts them with one set-based
+``INSERT ... ON CONFLICT (email) DO NOTHING``. Every input row gets a result
+entry so the caller can see exactly which accounts were created.
+"""
+import csv
+import io
+import os
+
+from . import hashing
+from .model import execute_values
+
+MAX_ROWS = int(os.getenv("BULK_USERS_MAX", "20000"))
+# Method used for bulk-imported passwords. Setting a cheaper one here speeds up
+# large imports; those hashes are upgraded on each user's first login.
+HASH_METHOD = os.getenv("BULK_PASSWORD_HASH_METHOD") or hashing.HASH_METHOD
+ROLES = {"farmer", "admin"}
+
+
+class BulkInputError(ValueError):
+    """The request body as a whole could not be read."""
+
+
+def parse_csv(stream):
+    """Read users from a CSV text stream with a header row."""
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or not {"name", "email", "password"} <= {f.strip() for f in reader.fieldnames}:
+        raise BulkInputError("CSV header must include name, email and password")
+    rows = []
+    for row in reader:
+        rows.append({(k or "").strip(): (v or "").strip() for k, v in row.items()})
+        if len(rows) > MAX_ROWS:
+            raise BulkInputError(f"At most {MAX_ROWS} users per request")
+    return rows
+
+
+def parse_request(req):
+    """Extract the list of user dicts from a Flask request (JSON or CSV body)."""
+    if req.mimetype in ("text/csv", "application/csv"):
+        return parse_csv(io.TextIOWrapper(req.stream, encoding="utf-8-sig"))
+    data = req.get_json(silent=True)
+    users = data.get("users") if isinstance(data, dict) else data
+    if not isinstance(users, list):
+        raise BulkInputError("Body must be a JSON list of users, {users: [...]}, or text/csv")
+    if len(users) > MAX_ROWS:
+        raise BulkInputError(f"At most {MAX_ROWS} users per request")
+    return users
+
+
+def validate(users):
+    """Split rows into (valid, results) where results holds an entry for every input row.
+
+    Valid rows are (index, name, email, password, role); invalid ones already
+    have their error recorded in results.
+    """
+    results = [None] * len(users)
+    valid = []
+    seen = set()
+    for i, u in enumerate(users):
+        if not isinstance(u, dict):
+            results[i] = {"row": i, "status": "invalid", "error": "Row must be an object"}
+            continue
+        name = str(u.get("name") or "").strip()
+        email = str(u.get("email") or "").strip()
+        password = u.get("password") or ""
+        role = str(u.get("role") or "farmer").strip()
+        if not name or not email or not password:
+            results[i] = {"row": i, "email": email or None, "status": "invalid",
+                          "error": "Name, email, and password are required"}
+        elif role not in ROLES:
+            results[i] = {"row": i, "email": email, "status": "invalid", "error": f"Unknown role '{role}'"}
+        elif email in seen:
+            results[i] = {"row": i, "email": email, "status": "duplicate", "error": "Email repeated in this batch"}
+        else:
+            seen.add(email)
+            valid.append((i, name, email, str(password), role))
+    return valid, results
+
+
+def hash_users(users):
+    """Validate the rows and hash the valid passwords. Returns (rows to insert, results).
+
+    Runs before a database connection is checked out: hashing a large
+    import takes seconds of pool time. Rows are (index, name, email, hash, role).
+    """
+    valid, results = validate(users)
+    hashes = hashing.hash_many([v[3] for v in valid], HASH_METHOD) if valid else []
+    return [(i, name, email, h, role) for (i, name, email, _, role), h in zip(valid, hashes)], results
+
+
+def insert_users(cursor, rows, results):
+    """Insert rows from ``hash_users`` with one statement. Returns (results, summary); the caller commits."""
+    if rows:
+        created = dict(execute_values(
+            cursor,
+            """
+            INSERT INTO users (name, email, password, role, created_at)
+            VALUES %s
+            ON CONFLICT (email) DO NOTHING
+            RETURNING email, user_id;
+            """,
+            [(name, email, h, role) for _, name, email, h, role in rows],
+            template="(%s, %s, %s, %s, CURRENT_TIMESTAMP)",
+            page_size=len(rows),
+            fetch=True,
+        ))
+        for i, _, email, _, role in rows:
+            if email in created:
+                results[i] = {"row": i, "email": email, "status": "created", "id": created[email], "role": role}
+            else:
+                results[i] = {"row": i, "email": email, "status": "exists", "error": "User with this email already exists"}
+
+    summary = {}
+    for r in results:
+        summary[r["status"]] = summary.get(r["status"], 0) + 1
+    return results, summary
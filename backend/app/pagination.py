@@ -0,0 +1,109 @@
+"""Keyset pagination and streamed list responses.
+
+List endpoints accept ``limit`` and ``after`` (the last primary key the client
+has seen) and return ``next_after`` when more rows exist. With ``stream=ndjson``
+or ``stream=json`` the whole filtered set is instead written out row by row
+from a server-side (named) cursor, so memory stays flat on large exports.
+"""
+import os
+import uuid
+
+from flask import Response
+
+from . import encoding
+from .model import get_pool
+
+DEFAULT_LIMIT = int(os.getenv("PAGE_LIMIT_DEFAULT", "500"))
+MAX_LIMIT = int(os.getenv("PAGE_LIMIT_MAX", "1000"))
+# rows fetched per round trip by streaming cursors
+STREAM_ITERSIZE = int(os.getenv("STREAM_ITERSIZE", "2000"))
+STREAM_FORMATS = ("ndjson", "json")
+
+
+def page_args(args):
+    """Parse limit/after from request args. Raises ValueError with a client-facing message."""
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+        after = args.get("after")
+        after = int(after) if after not in (None, "") else None
+    except ValueError:
+        raise ValueError("limit and after must be integers")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+    return limit, after
+
+
+def keyset_query(select, key, clauses, params, after=None, limit=None):
+    """Append keyset filtering/ordering to ``select``.
+
+    Fetches ``limit + 1`` rows so the caller can tell whether another page exists.
+    """
+    clauses = list(clauses)
+    params = list(params)
+    if after is not None:
+        clauses.append(f"{key} > %s")
+        params.append(after)
+    sql = select
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {key}"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit + 1)
+    return sql, params
+
+
+def split_page(rows, limit, key_index=0):
+    """Trim the look-ahead row. Returns (rows, next_after)."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][key_index]
+    return rows, None
+
+
+def stream_rows(name, sql, params, to_dict, fmt):
+    """Stream query results as NDJSON lines or as a ``{"<name>": [...]}`` JSON document."""
+    def render(cursor):
+        if fmt == "json":
+            yield '{"%s": [' % name
+            sep = ""
+            for row in cursor:
+                yield sep + encoding.dumps(to_dict(row))
+                sep = ","
+            yield "]}"
+        else:
+            for row in cursor:
+                yield encoding.dumps(to_dict(row)) + "\n"
+
+    mimetype = "application/json" if fmt == "json" else "application/x-ndjson"
+    return stream_query(name, sql, params, render, mimetype)
+
+
+def stream_query(name, sql, params, render, mimetype, headers=None):
+    """Stream ``render(cursor)`` output for ``sql`` run on a server-side cursor.
+
+    The connection is checked out before the response starts so pool errors
+    still produce a normal error response; it is returned when the stream
+    finishes or the client goes away.
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            pool.putconn(conn)
+
+    def generate():
+        try:
+            with conn.cursor(name=f"stream_{name}_{uuid.uuid4().hex[:8]}") as cursor:
+                cursor.itersize = STREAM_ITERSIZE
+                cursor.execute(sql, params)
+                yield from render(cursor)
+        finally:
+            release()
+
+    response = Response(generate(), mimetype=mimetype, headers=headers)
+    response.call_on_close(release)
+    return response
@@ -1,43 +1,61 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, g, jsonify, request
+import io
 import os
 from dotenv import load_dotenv
-from werkzeug.security import generate_password_hash, check_password_hash
-from .model import get_connection, create_tables
-import jwt
+from .model import BACKEND, connection, get_pool, PoolError, PoolTimeout
+from . import analytics, auth, bulk, encoding, events, geocode, hashing, inventory, market, onboarding, pagination, spatial, sync, upstream, versions, weather
 from datetime import datetime, timedelta
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-import requests
-from dateutil import parser as date_parser
-from math import fabs
 
-# Create blueprint and load JWT secret before defining routes
+# Create blueprint; every request is authenticated once by auth.load_user
 bp = Blueprint("routes", __name__)
-JWT_SECRET = os.environ.get("JWT_SECRET")
+bp.before_request(auth.load_user)
 
-# create tables when the module is imported
-create_tables()
+# batch reverse-geocode limits (see reverse_geocode_batch)
+GEOCODE_BATCH_MAX = int(os.environ.get("GEOCODE_BATCH_MAX", "500"))
+GEOCODE_BATCH_MAX_MISSES = int(os.environ.get("GEOCODE_BATCH_MAX_MISSES", "5"))
+# GET /fields?near=lat,lon without a limit
+NEAREST_DEFAULT = 10
 
-# geocoder instance used for reverse geocoding
-_geolocator = Nominatim(user_agent="croptech-reverse-geocoder")
+
+@bp.errorhandler(hashing.HashingBusy)
+def handle_hashing_busy(e):
+    return jsonify({"message": "Server busy, please retry shortly", "error": str(e)}), 503, {"Retry-After": "1"}
+
+
+@bp.errorhandler(PoolError)
+def handle_pool_error(e):
+    # Pool exhaustion is transient; tell clients to retry instead of reporting a server bug
+    status = 503 if isinstance(e, PoolTimeout) else 500
+    return jsonify({"message": "Database connection not available", "error": str(e)}), status
+
+
+# -------------------------
+# Health / cache stats
+# -------------------------
+@bp.route("/health", methods=["GET"])
+def health():
+    """Report startup time, connection pool occupancy, checkout wait times and cache sizes."""
+    return jsonify({
+        "status": "ok",
+        "db_backend": BACKEND,
+        "startup_seconds": current_app.config.get("STARTUP_SECONDS"),
+        "db_pool": get_pool().stats(),
+        "geocode_cache": geocode.stats(),
+        "auth": auth.stats(),
+        "hashing": hashing.stats(),
+        "response_cache": versions.stats(),
+        "encoding": encoding.stats(),
+        "upstreams": upstream.stats(),
+    }), 200
 
 
 # -------------------------
 # Change password
 # -------------------------
 @bp.route("/change-password", methods=["POST"])
+@auth.login_required
 def change_password():
-    # Expect Authorization: Bearer <token>
-    auth = request.headers.get("Authorization")
-    if not auth or not auth.startswith("Bearer "):
-        return jsonify({"message": "Missing or invalid Authorization header"}), 401
-
-    token = auth.split(" ", 1)[1].strip()
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user_id = payload.get("user_id")
-    except Exception as e:
-        return jsonify({"message": "Invalid token", "error": str(e)}), 401
+    user_id = g.user_id
 
     data = request.get_json() or {}
     current_password = data.get("current_password")
@@ -46,37 +64,32 @@ def change_password():
     if not new_password:
         return jsonify({"message": "New password is required"}), 400
 
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
-
-    cursor = conn.cursor()
-    try:
+    with connection() as conn, conn.cursor() as cursor:
         cursor.execute("SELECT password FROM users WHERE user_id=%s", (user_id,))
         row = cursor.fetchone()
-        if not row:
-            return jsonify({"message": "User not found"}), 404
+    if not row:
+        return jsonify({"message": "User not found"}), 404
 
-        stored_hash = row[0]
+    stored_hash = row[0]
 
-        # If user has a stored password, require current password match
-        if stored_hash:
-            if not current_password:
-                return jsonify({"message": "Current password is required"}), 400
-            if not check_password_hash(stored_hash, current_password):
-                return jsonify({"message": "Current password is incorrect"}), 401
+    # If user has a stored password, require current password match.
+    # Hashing runs in the hashing pool without holding a DB connection.
+    if stored_hash:
+        if not current_password:
+            return jsonify({"message": "Current password is required"}), 400
+        if not hashing.check_password(stored_hash, current_password):
+            return jsonify({"message": "Current password is incorrect"}), 401
 
-        new_hash = generate_password_hash(new_password)
-        cursor.execute("UPDATE users SET password=%s WHERE user_id=%s", (new_hash, user_id))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error updating password", "error": str(e)}), 500
+    new_hash = hashing.hash_password(new_password)
+
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            cursor.execute("UPDATE users SET password=%s WHERE user_id=%s", (new_hash, user_id))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error updating password", "error": str(e)}), 500
 
-    cursor.close()
-    conn.close()
     return jsonify({"message": "Password updated successfully"}), 200
 
 # -------------------------
@@ -91,37 +104,32 @@ def signup():
     name= data.get("name")
     email= data.get("email")
     password= data.get("password")
-    role= data.get("role", "farmer")  # default role is farmer
+    # self-service accounts are always farmers; admins are created through POST /users/bulk
+    role= "farmer"
     if not email or not password or not name:
         return jsonify({"message": "Name, email, and password are required"}), 400
     
-    hashed_password = generate_password_hash(password)
-
-    conn= get_connection()
-    cursor= conn.cursor()
+    hashed_password = hashing.hash_password(password)
 
-    try:
-        if email:
+    with connection() as conn, conn.cursor() as cursor:
+        try:
             cursor.execute("SELECT * FROM users WHERE email=%s", (email,))
             existing_user= cursor.fetchone()
             if existing_user:
                 return jsonify({"message": "User with this email already exists"}), 400
-            
+
             cursor.execute("""
                           INSERT INTO users (name, email, password, role, created_at)
                             VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
                             """, (name, email, hashed_password, role))
-            
+
             conn.commit()
+            versions.bump(["users"])
+
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error creating user", "error": str(e)}), 500
 
-    except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error creating user", "error": str(e)}), 500
-    
-    cursor.close()
-    conn.close()
     return jsonify({"message": "User created successfully",
                     "user": {
                         "name": name,
@@ -131,6 +139,37 @@ def signup():
                     }}), 201
 
 
+# -------------------------
+# Bulk signup (cooperative onboarding)
+# -------------------------
+@bp.route("/users/bulk", methods=["POST"])
+@auth.admin_required
+def bulk_signup():
+    """Create many users in one request. Admin only.
+
+    Body: JSON list (or { users: [...] }) of {name, email, password, role?}, or
+    text/csv with a name,email,password[,role] header. Returns one result per
+    input row (created / exists / duplicate / invalid) plus counts per status.
+    """
+    try:
+        users = onboarding.parse_request(request)
+    except (onboarding.BulkInputError, UnicodeDecodeError) as e:
+        return jsonify({"message": str(e)}), 400
+
+    # hash before checking out a connection so a large import does not hold one
+    rows, results = onboarding.hash_users(users)
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            results, summary = onboarding.insert_users(cursor, rows, results)
+            conn.commit()
+            versions.bump(["users"])
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error creating users", "error": str(e)}), 500
+
+    return jsonify({"results": results, "summary": summary}), 200
+
+
 # -------------------------
 # Login
 # -------------------------
@@ -140,28 +179,33 @@ def login():
     email= data.get("email")
     password_input= data.get("password")
 
-    conn= get_connection()
-    cursor= conn.cursor()
-
-    cursor.execute("""
-                   SELECT user_id, password, name, role FROM users WHERE email=%s;
-                   """, (email,))
-    user= cursor.fetchone()
-    cursor.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+                       SELECT user_id, password, name, role FROM users WHERE email=%s;
+                       """, (email,))
+        user= cursor.fetchone()
 
     if not user:
         return jsonify({"message": "Invalid email or password"}), 401
     
     user_id, password, name, role= user
-    if not check_password_hash(password, password_input):
-        return jsonify({"message": "Invalid email or password"}), 401 
+    if not password_input or not hashing.check_password(password, password_input):
+        return jsonify({"message": "Invalid email or password"}), 401
 
-    # Create JWT token
-    token = jwt.encode({
-        "user_id": user_id,
-        "exp": datetime.utcnow() + timedelta(hours=24)
-    }, JWT_SECRET, algorithm="HS256")
+    # Transparently upgrade hashes made with an older/weaker work factor
+    if hashing.needs_rehash(password):
+        try:
+            new_hash = hashing.hash_password(password_input)
+            with connection() as conn, conn.cursor() as cursor:
+                cursor.execute("UPDATE users SET password=%s WHERE user_id=%s AND password=%s",
+                               (new_hash, user_id, password))
+                conn.commit()
+        except Exception as e:
+            # The login itself succeeded; try again next time
+            print(f"Password rehash for user {user_id} skipped: {e}")
+
+    # Create JWT token (role is embedded so requests can be authorized without a lookup)
+    token = auth.issue_token(user_id, role)
 
     return jsonify({"msg": "Login successful", "token": token,
                     "user": {
@@ -176,130 +220,537 @@ def login():
 # List users 
 # -------------------------
 @bp.route("/users", methods=["GET"])
+@auth.admin_required
 def list_users():
-    """Return a list of registered users (omits password).
+    """Return a list of registered users (omits password). Admin only.
 
-    WARNING: This endpoint is intended for local development and debugging only.
-    Do NOT expose it in production without proper authentication and authorization.
+    Query params: limit, after (keyset pagination on user id), stream (ndjson|json).
     """
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
+    return _list_rows("users", "SELECT user_id, name, email, role, created_at FROM users", "user_id",
+                      [], [], _user_dict, "Error fetching users")
+
+
+def _user_dict(row):
+    user_id, name, email, role, created_at = row
+    # created_at is serialized as ISO 8601 by the JSON provider (app/encoding.py)
+    return {
+        "id": user_id,
+        "name": name,
+        "email": email,
+        "role": role,
+        "created_at": created_at,
+    }
+
 
-    cursor = conn.cursor()
+def _list_rows(name, select, key, clauses, params, to_dict, error_message, scope_user=None, tables=None):
+    """Shared body of the list endpoints: keyset page by default, streamed export on request.
+
+    Page responses look like { <name>: [...], next_after: <key|null> } and are
+    served through versions.conditional (ETag / 304 / response cache) keyed on
+    ``tables`` (default: the ``name`` table) and ``scope_user``.
+    """
     try:
-        cursor.execute("SELECT user_id, name, email, role, created_at FROM users;")
-        rows = cursor.fetchall()
-        users = []
-        for row in rows:
-            user_id, name, email, role, created_at = row
-            # Convert created_at to ISO string if it's a datetime
+        limit, after = pagination.page_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    fmt = request.args.get("stream")
+    if fmt:
+        if fmt not in pagination.STREAM_FORMATS:
+            return jsonify({"message": "stream must be ndjson or json"}), 400
+        sql, sql_params = pagination.keyset_query(select, key, clauses, params, after)
+        return pagination.stream_rows(name, sql, sql_params, to_dict, fmt)
+
+    def build():
+        sql, sql_params = pagination.keyset_query(select, key, clauses, params, after, limit)
+        with connection() as conn, conn.cursor() as cursor:
             try:
-                created_iso = created_at.isoformat()
-            except Exception:
-                created_iso = str(created_at)
-
-            users.append({
-                "id": user_id,
-                "name": name,
-                "email": email,
-                "role": role,
-                "created_at": created_iso,
-            })
+                cursor.execute(sql, sql_params)
+                rows = cursor.fetchall()
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"message": error_message, "error": str(e)}), 500
 
-    except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error fetching users", "error": str(e)}), 500
+        rows, next_after = pagination.split_page(rows, limit)
+        return jsonify({name: [to_dict(row) for row in rows], "next_after": next_after}), 200
 
-    cursor.close()
-    conn.close()
-    return jsonify({"users": users}), 200
+    return versions.conditional(tables or [name], scope_user, build)
 
 
 # -------------------------
 # Fields endpoints
 # -------------------------
 @bp.route("/fields", methods=["POST"]) 
+@auth.login_required
 def create_field():
+    """Create one field. An optional ``crops`` list is created with it in the same transaction."""
     data = request.get_json() or {}
-    location = data.get("location")
-
-    if not location:
+    if not data.get("location"):
         return jsonify({"message": "Field location is required"}), 400
 
-    # Try to get user_id from token if provided
-    auth = request.headers.get("Authorization")
-    user_id = None
-    if auth and auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
+    # Owner is the authenticated caller; only admins may name another user_id in the body
+    try:
+        fields = bulk.parse_fields([data], g.user_id, auth.is_admin())
+    except bulk.BatchError as e:
+        return jsonify({"message": str(e), "errors": e.errors}), 400
+
+    error = _insert_fields(fields)
+    if error:
+        return error
+    field = fields[0]
+    if "crops" not in data:
+        field.pop("crops")
+    return jsonify({"field": field}), 201
+
+
+@bp.route("/fields/batch", methods=["POST"])
+@auth.login_required
+def create_fields_batch():
+    """Create many fields (each with optional nested ``crops``) atomically.
+
+    Body: { fields: [{location, user_id?, crops?: [...]}, ...] }. Returns the
+    fields in input order with their new ids and their crops' ids.
+    """
+    try:
+        fields = bulk.parse_fields(request.get_json(silent=True), g.user_id, auth.is_admin())
+    except bulk.BatchError as e:
+        return jsonify({"message": str(e), "errors": e.errors}), 400
+
+    error = _insert_fields(fields)
+    if error:
+        return error
+    return jsonify({"fields": fields}), 201
+
+
+def _insert_fields(fields):
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            touched = bulk.insert_fields(cursor, fields)
+            analytics.refresh(cursor, touched)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error creating field", "error": str(e)}), 500
+    tables = ["fields", "crops"] if any(f["crops"] for f in fields) else ["fields"]
+    versions.bump(tables, {f["user_id"] for f in fields})
+    return None
+
+
+@bp.route("/fields", methods=["GET"]) 
+def list_fields():
+    """List fields. Optional query params: id, user_id, limit, after, stream.
+
+    bbox=west,south,east,north (Leaflet's toBBoxString) keeps the fields whose
+    coordinates are inside the map viewport; near=lat,lon instead returns the
+    ``limit`` (default 10) closest fields, nearest first, each with
+    distance_km. Both are served from the spatial index (app/spatial.py);
+    fields whose location is not a "lat,lon" pair never match them.
+    """
+    q_id = request.args.get("id")
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
+
+    clauses, params = [], []
+    if q_id:
+        clauses.append("field_id=%s")
+        params.append(q_id)
+    if q_user:
+        clauses.append("user_id=%s")
+        params.append(q_user)
+
+    if request.args.get("near"):
+        point = weather.parse_location(request.args["near"])
+        if point is None:
+            return jsonify({"message": "near must be lat,lon in degrees"}), 400
+        try:
+            limit = int(request.args.get("limit", NEAREST_DEFAULT))
+        except ValueError:
+            return jsonify({"message": "limit must be an integer"}), 400
+        if not 1 <= limit <= pagination.MAX_LIMIT:
+            return jsonify({"message": f"limit must be between 1 and {pagination.MAX_LIMIT}"}), 400
+        return versions.conditional(["fields"], q_user,
+                                    lambda: _nearest_fields(point, limit, clauses, params))
+
+    if request.args.get("bbox"):
+        try:
+            clause, box_params = spatial.bbox_clause(*spatial.parse_bbox(request.args["bbox"]))
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        clauses.append(clause)
+        params.extend(box_params)
+    return _list_rows("fields", f"SELECT {spatial.COLUMNS} FROM fields", "field_id",
+                      clauses, params, _field_dict, "Error fetching fields", q_user)
+
+
+def _nearest_fields(point, limit, clauses, params):
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            found = spatial.nearest(cursor, point[0], point[1], limit, clauses, params)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching fields", "error": str(e)}), 500
+
+    fields = []
+    for distance, row in found:
+        field = _field_dict(row)
+        field["distance_km"] = round(distance, 3)
+        fields.append(field)
+    return jsonify({"fields": fields, "next_after": None}), 200
+
+
+_OVERVIEW_SELECT = f"""
+    SELECT f.field_id, f.location, f.user_id, f.lat, f.lon,
+           c.crop_id, c.name, c.health_status, c.planting_date, c.user_id, c.field_id,
+           w.weather_id, w.observed_at, {", ".join("w." + col for col in weather.COLUMNS)}
+    FROM fields f
+    LEFT JOIN LATERAL (
+        SELECT crop_id, name, health_status, planting_date, user_id, field_id
+        FROM crops WHERE field_id = f.field_id ORDER BY crop_id LIMIT 1
+    ) c ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT weather_id, observed_at, {", ".join(weather.COLUMNS)}
+        FROM weather WHERE field_id = f.field_id AND observed_at <= %s
+        ORDER BY observed_at DESC LIMIT 1
+    ) w ON TRUE
+"""
+
+if BACKEND == "sqlite":
+    # no LATERAL in SQLite; the same two index lookups as correlated subqueries
+    _OVERVIEW_SELECT = f"""
+        SELECT f.field_id, f.location, f.user_id, f.lat, f.lon,
+               c.crop_id, c.name, c.health_status, c.planting_date, c.user_id, c.field_id,
+               w.weather_id, w.observed_at, {", ".join("w." + col for col in weather.COLUMNS)}
+        FROM fields f
+        LEFT JOIN crops c ON c.crop_id = (SELECT MIN(crop_id) FROM crops WHERE field_id = f.field_id)
+        LEFT JOIN weather w ON w.weather_id = (
+            SELECT weather_id FROM weather WHERE field_id = f.field_id AND observed_at <= %s
+            ORDER BY observed_at DESC LIMIT 1
+        )
+    """
+
+
+@bp.route("/fields/overview", methods=["GET"])
+def fields_overview():
+    """Everything the fields dashboard needs in one call.
+
+    Each field comes with its first crop, cached city/state and latest
+    stored weather sample. One query (two per-field lookups riding the
+    field_id indexes) plus one geocode cache lookup, however many fields
+    there are. ``geocoded`` is false where the location's cell is not
+    cached yet; those can be resolved with POST /reverse-geocode.
+    Supports user_id, limit and after like GET /fields.
+    """
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
+    try:
+        limit, after = pagination.page_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    now = datetime.utcnow()
+    # the hour is part of the tag because "latest weather" moves with the clock
+    return versions.conditional(["fields", "crops", "weather", "geocode", now.strftime("%Y%m%d%H")], q_user,
+                                lambda: _fields_overview(q_user, limit, after, now))
+
+
+def _fields_overview(q_user, limit, after, now):
+    clauses, params = [], [now]
+    if q_user:
+        clauses.append("f.user_id=%s")
+        params.append(q_user)
+    sql, params = pagination.keyset_query(_OVERVIEW_SELECT, "f.field_id", clauses, params, after, limit)
+
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            cursor.execute(sql, params)
+            rows, next_after = pagination.split_page(cursor.fetchall(), limit)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching fields overview", "error": str(e)}), 500
+
+    points = [(r[3], r[4]) if r[3] is not None else None for r in rows]
+    located = [p for p in points if p]
+    places = iter(geocode.lookup_cached(located)) if located else iter(())
+
+    fields = []
+    for row, point in zip(rows, points):
+        field = _field_dict(row[:5])
+        field["crop"] = _crop_dict(row[5:11]) if row[5] is not None else None
+        latest = None
+        if row[11] is not None:
+            latest = {"weather_id": row[11], "observed_at": row[12], **dict(zip(weather.COLUMNS, row[13:]))}
+        field["latest_weather"] = weather.serialize(latest, field["id"], field["location"]) if latest else None
+        place = next(places) if point else None
+        field["city"] = place["city"] if place else None
+        field["state"] = place["state"] if place else None
+        field["geocoded"] = place is not None
+        fields.append(field)
+
+    return jsonify({"fields": fields, "next_after": next_after}), 200
+
+
+def _field_dict(row):
+    fid, location, uid, lat, lon = row
+    return {"id": fid, "location": location, "user_id": uid, "lat": lat, "lon": lon}
+
+
+@bp.route("/fields/<int:field_id>", methods=["GET"])
+@auth.login_required
+def get_field(field_id):
+    """Return one field with its crops and latest stored weather sample."""
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            cursor.execute(f"SELECT {spatial.COLUMNS} FROM fields WHERE field_id=%s;", (field_id,))
+            row = cursor.fetchone()
+            if not row:
+                return jsonify({"message": "Field not found"}), 404
+            if row[2] != g.user_id and not auth.is_admin():
+                return jsonify({"message": "Not allowed to view this field"}), 403
+            cursor.execute(
+                "SELECT crop_id, name, health_status, planting_date, user_id, field_id FROM crops WHERE field_id=%s ORDER BY crop_id;",
+                (field_id,),
+            )
+            crop_rows = cursor.fetchall()
+            latest = weather.load_latest(cursor, field_id)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching field", "error": str(e)}), 500
+
+    field = _field_dict(row)
+    field["crops"] = [_crop_dict(r) for r in crop_rows]
+    field["latest_weather"] = weather.serialize(latest, field_id, field["location"]) if latest else None
+    return jsonify({"field": field}), 200
+
+
+@bp.route("/fields/<int:field_id>/weather", methods=["GET"])
+@auth.login_required
+def field_weather_history(field_id):
+    """Stored hourly weather of one field over a time range, downsampled for charts.
+
+    Query params: start, end (ISO date or datetime, UTC; default the last 7
+    days), points (budget, default 500), mode (bucket: min/avg/max per time
+    bucket, the default; lttb: the samples that best keep the shape of the
+    first metric), metrics (comma-separated weather columns, default all).
+    Returns {history: {columns, rows, samples, downsampled, ...}}.
+    """
+    try:
+        start, end = weather.history_range(request.args.get("start"), request.args.get("end"))
+        metrics = weather.history_metrics(request.args.get("metrics"))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        points = int(request.args.get("points", weather.HISTORY_POINTS))
+    except ValueError:
+        return jsonify({"message": "points must be an integer"}), 400
+    if not 3 <= points <= weather.HISTORY_MAX_POINTS:
+        return jsonify({"message": f"points must be between 3 and {weather.HISTORY_MAX_POINTS}"}), 400
+    mode = request.args.get("mode", "bucket")
+    if mode not in weather.HISTORY_MODES:
+        return jsonify({"message": "mode must be bucket or lttb"}), 400
+
+    tags = ["fields", "weather"]
+    if not request.args.get("end"):
+        # an open-ended range moves with the clock
+        tags.append(datetime.utcnow().strftime("%Y%m%d%H"))
+    return versions.conditional(tags, g.user_id,
+                                lambda: _field_weather_history(field_id, start, end, points, mode, metrics))
+
+
+def _field_weather_history(field_id, start, end, points, mode, metrics):
+    with connection() as conn, conn.cursor() as cursor:
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            user_id = payload.get("user_id")
-        except Exception:
-            # ignore token errors for now; proceed if user_id provided in body
-            user_id = None
+            _check_field_access(cursor, [field_id])
+            history = weather.load_history(cursor, field_id, start, end, points, mode, metrics)
+        except (LookupError, PermissionError) as e:
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching weather history", "error": str(e)}), 500
+
+    return jsonify({"history": history}), 200
+
+
+# -------------------------
+# Field events (watering / fertilizer / pesticide log)
+# -------------------------
+def _check_field_access(cursor, field_ids):
+    """Raise LookupError / PermissionError unless every field exists and the caller may write it.
+
+    Returns {field_id: owner user_id}.
+    """
+    cursor.execute("SELECT field_id, user_id FROM fields WHERE field_id = ANY(%s);", (list(field_ids),))
+    return _require_access("Field", field_ids, dict(cursor.fetchall()))
+
 
-    if not user_id:
-        user_id = data.get("user_id")
+def _require_access(kind, ids, owners):
+    """Raise LookupError / PermissionError unless every id is in ``owners`` and the caller may write it."""
+    missing = set(ids) - set(owners)
+    if missing:
+        raise LookupError(f"{kind}(s) not found: {sorted(missing)}")
+    if not auth.is_admin():
+        # anonymous callers own nothing
+        foreign = [rid for rid, uid in owners.items() if g.user_id is None or uid != g.user_id]
+        if foreign:
+            raise PermissionError(f"Not allowed to access {kind.lower()}(s): {sorted(foreign)}")
+    return owners
 
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
 
-    cursor = conn.cursor()
+def _events_error(e):
+    if isinstance(e, LookupError):
+        return jsonify({"message": str(e)}), 404
+    if isinstance(e, PermissionError):
+        return jsonify({"message": str(e)}), 403
+    return jsonify({"message": str(e)}), 400
+
+
+def _csv_body():
+    return io.TextIOWrapper(request.stream, encoding="utf-8-sig", newline="")
+
+
+@bp.route("/fields/<int:field_id>/events", methods=["GET"])
+@auth.login_required
+def list_field_events(field_id):
+    """Events for one field, optionally limited to ?from=&to= (YYYY-MM-DD).
+
+    ?format=csv streams the calendar's CSV export format.
+    """
+    clauses, params = ["field_id=%s"], [field_id]
+    for arg, op in (("from", ">="), ("to", "<=")):
+        if request.args.get(arg):
+            clauses.append(f"date {op} %s")
+            params.append(request.args[arg])
+    sql = f"{events.SELECT_SQL} WHERE {' AND '.join(clauses)} ORDER BY date"
+
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            _check_field_access(cursor, [field_id])
+            if request.args.get("format") != "csv":
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        except (LookupError, PermissionError) as e:
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching events", "error": str(e)}), 500
+
+    if request.args.get("format") == "csv":
+        return pagination.stream_query(
+            "events", sql, params, events.render_csv, "text/csv",
+            headers={"Content-Disposition": f"attachment; filename=field-{field_id}-events.csv"},
+        )
+    return jsonify({"events": [events.to_dict(r) for r in rows]}), 200
+
+
+@bp.route("/fields/<int:field_id>/events", methods=["PUT"])
+@auth.login_required
+def upsert_field_events(field_id):
+    """Upsert events by (field_id, date).
+
+    JSON: {events: [{date, watered, fertilizer, pesticide, note}]} or the
+    calendar's {"YYYY-MM-DD": {...}} map. text/csv: the calendar's export
+    format, parsed and written in chunks.
+    """
+    is_csv = request.mimetype in ("text/csv", "application/csv")
     try:
-        cursor.execute("INSERT INTO fields (location, user_id) VALUES (%s, %s) RETURNING field_id;", (location, user_id))
-        row = cursor.fetchone()
-        conn.commit()
-        field_id = row[0] if row else None
-    except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error creating field", "error": str(e)}), 500
+        rows = events.read_csv(_csv_body(), field_id) if is_csv else \
+            events.parse_events(field_id, request.get_json(silent=True))
+    except events.EventError as e:
+        return _events_error(e)
 
-    cursor.close()
-    conn.close()
-    return jsonify({"field": {"id": field_id, "location": location, "user_id": user_id}}), 201
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            owners = _check_field_access(cursor, [field_id])
+            written = events.import_rows(cursor, rows)
+            conn.commit()
+            versions.bump(["field_events"], owners.values())
+        except (LookupError, PermissionError, events.EventError, UnicodeDecodeError) as e:
+            conn.rollback()
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error saving events", "error": str(e)}), 500
 
+    return jsonify({"field_id": field_id, "upserted": written}), 200
 
-@bp.route("/fields", methods=["GET"]) 
-def list_fields():
-    # Optional query params: user_id
-    q_user = request.args.get("user_id")
 
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
+@bp.route("/fields/<int:field_id>/events", methods=["DELETE"])
+@auth.login_required
+def clear_field_events(field_id):
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            owners = _check_field_access(cursor, [field_id])
+            cursor.execute("DELETE FROM field_events WHERE field_id=%s;", (field_id,))
+            deleted = cursor.rowcount
+            conn.commit()
+            versions.bump(["field_events"], owners.values())
+        except (LookupError, PermissionError) as e:
+            conn.rollback()
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error clearing events", "error": str(e)}), 500
+
+    return jsonify({"field_id": field_id, "deleted": deleted}), 200
+
+
+@bp.route("/events/import", methods=["POST"])
+@auth.login_required
+def import_events():
+    """Bulk CSV import across fields: field_id,date,watered,fertilizer,pesticide,note.
+
+    All-or-nothing; the file is read and upserted in chunks.
+    """
+    owners = {}
+
+    def check(cursor, field_ids):
+        owners.update(_check_field_access(cursor, field_ids))
 
-    cursor = conn.cursor()
     try:
-        if q_user:
-            cursor.execute("SELECT field_id, location, user_id FROM fields WHERE user_id=%s;", (q_user,))
-        else:
-            cursor.execute("SELECT field_id, location, user_id FROM fields;")
-        rows = cursor.fetchall()
-        fields = []
-        for row in rows:
-            fid, location, uid = row
-            fields.append({"id": fid, "location": location, "user_id": uid})
+        rows = events.read_csv(_csv_body())
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                written = events.import_rows(cursor, rows, check)
+                conn.commit()
+                versions.bump(["field_events"], owners.values())
+            except Exception:
+                conn.rollback()
+                raise
+    except (LookupError, PermissionError, events.EventError, UnicodeDecodeError) as e:
+        return _events_error(e)
+    except PoolError:
+        raise
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error fetching fields", "error": str(e)}), 500
-
-    cursor.close()
-    conn.close()
-    return jsonify({"fields": fields}), 200
+        return jsonify({"message": "Error importing events", "error": str(e)}), 500
+
+    return jsonify({"upserted": written}), 200
+
+
+@bp.route("/events/export", methods=["GET"])
+@auth.login_required
+def export_events():
+    """Stream events for all of a user's fields as CSV (field_id column first)."""
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
+    sql = "SELECT e.field_id, e.date, e.watered, e.fertilizer, e.pesticide, e.note FROM field_events e"
+    params = []
+    if q_user:
+        sql += " JOIN fields f ON f.field_id = e.field_id WHERE f.user_id = %s"
+        params.append(q_user)
+    sql += " ORDER BY e.field_id, e.date"
+    return pagination.stream_query(
+        "events", sql, params, lambda cursor: events.render_csv(cursor, with_field=True), "text/csv",
+        headers={"Content-Disposition": "attachment; filename=field-events.csv"},
+    )
 
 
 # -------------------------
 # Crops endpoints
 # -------------------------
 @bp.route("/crops", methods=["POST"]) 
+@auth.login_required
 def create_crop():
     data = request.get_json() or {}
     name = data.get("name")
@@ -310,85 +761,447 @@ def create_crop():
     if not name:
         return jsonify({"message": "Crop name is required"}), 400
 
-    # user association from token if provided
-    auth = request.headers.get("Authorization")
-    user_id = None
-    if auth and auth.startswith("Bearer "):
-        token = auth.split(" ", 1)[1].strip()
+    if field_id in ("", None):
+        field_id = None
+    elif not str(field_id).strip().isdigit():
+        return jsonify({"message": "field_id must be an integer"}), 400
+    else:
+        field_id = int(field_id)
+
+    # owner is the authenticated caller; only admins may name another user_id
+    user_id = (auth.is_admin() and data.get("user_id")) or g.user_id
+
+    with connection() as conn, conn.cursor() as cursor:
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            user_id = payload.get("user_id")
-        except Exception:
-            user_id = None
+            if field_id is not None:
+                user_id = _check_field_access(cursor, [field_id])[field_id]
+            cursor.execute(
+                "INSERT INTO crops (name, health_status, planting_date, user_id, field_id) VALUES (%s, %s, %s, %s, %s) RETURNING crop_id;",
+                (name, health_status, planting_date, user_id, field_id),
+            )
+            row = cursor.fetchone()
+            if field_id and planting_date:
+                analytics.refresh(cursor, [(field_id, planting_date)])
+            conn.commit()
+            versions.bump(["crops"], [user_id])
+            crop_id = row[0] if row else None
+        except (LookupError, PermissionError) as e:
+            conn.rollback()
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error creating crop", "error": str(e)}), 500
+
+    return jsonify({"crop": {"id": crop_id, "name": name, "health_status": health_status, "planting_date": planting_date, "user_id": user_id, "field_id": field_id}}), 201
 
-    if not user_id:
-        user_id = data.get("user_id")
 
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
+@bp.route("/crops/batch", methods=["POST"])
+@auth.login_required
+def create_crops_batch():
+    """Create many crops in one transaction. Body: { crops: [...] }; ids are returned in input order.
 
-    cursor = conn.cursor()
+    Every referenced field must exist and belong to the caller (or the caller is an admin).
+    """
     try:
-        cursor.execute(
-            "INSERT INTO crops (name, health_status, planting_date, user_id, field_id) VALUES (%s, %s, %s, %s, %s) RETURNING crop_id;",
-            (name, health_status, planting_date, user_id, field_id),
-        )
-        row = cursor.fetchone()
-        conn.commit()
-        crop_id = row[0] if row else None
-    except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error creating crop", "error": str(e)}), 500
+        crops = bulk.parse_crops(request.get_json(silent=True), g.user_id, auth.is_admin())
+    except bulk.BatchError as e:
+        return jsonify({"message": str(e), "errors": e.errors}), 400
 
-    cursor.close()
-    conn.close()
-    return jsonify({"crop": {"id": crop_id, "name": name, "health_status": health_status, "planting_date": planting_date, "user_id": user_id, "field_id": field_id}}), 201
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            field_ids = {c["field_id"] for c in crops if c["field_id"] is not None}
+            owners = _check_field_access(cursor, field_ids) if field_ids else {}
+            for c in crops:
+                # a crop on a field belongs to the field's owner
+                if c["field_id"] is not None:
+                    c["user_id"] = owners[c["field_id"]]
+            touched = bulk.insert_crops(cursor, crops)
+            analytics.refresh(cursor, touched)
+            conn.commit()
+            versions.bump(["crops"], {c["user_id"] for c in crops})
+        except (LookupError, PermissionError) as e:
+            conn.rollback()
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error creating crops", "error": str(e)}), 500
+
+    return jsonify({"crops": crops}), 201
 
 
 @bp.route("/crops", methods=["GET"]) 
 def list_crops():
-    q_user = request.args.get("user_id")
+    # Optional query params: user_id, field_id, limit, after, stream
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
     q_field = request.args.get("field_id")
 
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
+    clauses, params = [], []
+    if q_user:
+        clauses.append("user_id=%s")
+        params.append(q_user)
+    if q_field:
+        clauses.append("field_id=%s")
+        params.append(q_field)
+    return _list_rows("crops", "SELECT crop_id, name, health_status, planting_date, user_id, field_id FROM crops",
+                      "crop_id", clauses, params, _crop_dict, "Error fetching crops", q_user)
+
+
+@bp.route("/crops/<int:crop_id>", methods=["GET"])
+@auth.login_required
+def get_crop(crop_id):
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            # crops created without a user_id belong to their field's owner
+            cursor.execute(
+                "SELECT c.crop_id, c.name, c.health_status, c.planting_date, c.user_id, c.field_id, "
+                "COALESCE(c.user_id, f.user_id) FROM crops c LEFT JOIN fields f ON f.field_id = c.field_id "
+                "WHERE c.crop_id=%s;",
+                (crop_id,),
+            )
+            row = cursor.fetchone()
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching crop", "error": str(e)}), 500
+
+    if not row:
+        return jsonify({"message": "Crop not found"}), 404
+    if row[6] != g.user_id and not auth.is_admin():
+        return jsonify({"message": "Not allowed to view this crop"}), 403
+    return jsonify({"crop": _crop_dict(row[:6])}), 200
+
+
+def _crop_dict(row):
+    cid, name, health_status, planting_date, uid, fid = row
+    return {
+        "id": cid,
+        "name": name,
+        "health_status": health_status,
+        "planting_date": planting_date,
+        "user_id": uid,
+        "field_id": fid,
+    }
+
+
+# -------------------------
+# Inventory (stock levels and movement ledger)
+# -------------------------
+# ledger pages and ?at= answers also change when compaction prunes or snapshots
+_LEDGER_TABLES = ["inventory", "inventory_movements"]
+
+
+@bp.route("/inventory", methods=["GET"])
+@auth.login_required
+def list_inventory():
+    """List items with their current stock. Optional query params: user_id (admins), type, limit, after, stream."""
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
+    clauses, params = ["user_id=%s"], [q_user]
+    if request.args.get("type"):
+        clauses.append("type=%s")
+        params.append(request.args["type"])
+    return _list_rows("inventory", f"SELECT {inventory.COLUMNS} FROM inventory", "item_id", clauses, params,
+                      inventory.item_dict, "Error fetching inventory", q_user)
+
+
+@bp.route("/inventory", methods=["POST"])
+@auth.login_required
+def create_inventory_item():
+    """Create an item. Body: {name, quantity?, type?, user_id? (admins)}.
+
+    A starting quantity is recorded as the item's first ledger movement.
+    """
+    data = request.get_json(silent=True)
+    try:
+        name, quantity, item_type = inventory.parse_item(data)
+    except inventory.InventoryError as e:
+        return jsonify({"message": str(e)}), 400
+    user_id = data.get("user_id") if auth.is_admin() and data.get("user_id") else g.user_id
+
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            item_id = inventory.create(cursor, name, quantity, item_type, user_id, g.user_id)
+            conn.commit()
+            versions.bump(["inventory"], [user_id])
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error creating inventory item", "error": str(e)}), 500
+
+    return jsonify({"item": inventory.item_dict((item_id, name, quantity, item_type, user_id))}), 201
 
-    cursor = conn.cursor()
+
+@bp.route("/inventory/<int:item_id>", methods=["GET"])
+@auth.login_required
+def get_inventory_item(item_id):
+    """One item with its current stock. ?at=YYYY-MM-DD adds ``quantity_at``, the stock at the end of that day."""
     try:
-        if q_user and q_field:
-            cursor.execute("SELECT crop_id, name, health_status, planting_date, user_id, field_id FROM crops WHERE user_id=%s AND field_id=%s;", (q_user, q_field))
+        at = _as_of_arg("at", None)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    owner, error = _item_owner(item_id)
+    if error:
+        return error
+
+    def build():
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute(f"SELECT {inventory.COLUMNS} FROM inventory WHERE item_id=%s;", (item_id,))
+                row = cursor.fetchone()
+                quantity_at = inventory.stock_at(cursor, item_id, at) if row and at else None
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"message": "Error fetching inventory item", "error": str(e)}), 500
+
+        if not row:
+            return jsonify({"message": "Item not found"}), 404
+        item = inventory.item_dict(row)
+        if at:
+            item.update({"at": at, "quantity_at": quantity_at})
+        return jsonify({"item": item}), 200
+
+    return versions.conditional(_LEDGER_TABLES if at else ["inventory"], owner, build)
+
+
+def _item_owner(item_id):
+    """(owner user_id, None) if the caller may read the item, else (None, error response).
+
+    Runs before versions.conditional: cached bodies are shared by everyone
+    presenting the same ETag, so access is checked outside them.
+    """
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            cursor.execute("SELECT item_id, user_id FROM inventory WHERE item_id=%s;", (item_id,))
+            owners = _require_access("Item", [item_id], dict(cursor.fetchall()))
+        except (LookupError, PermissionError) as e:
+            return None, _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return None, (jsonify({"message": "Error fetching inventory item", "error": str(e)}), 500)
+    return owners[item_id], None
+
+
+@bp.route("/inventory/<int:item_id>/movements", methods=["GET"])
+@auth.login_required
+def list_inventory_movements(item_id):
+    """The item's ledger, oldest first. Query params: limit, after, stream.
+
+    Rows older than the compaction retention are summarized into daily
+    snapshots (see app/inventory.py) and no longer listed.
+    """
+    owner, error = _item_owner(item_id)
+    if error:
+        return error
+    return _list_rows("movements", f"SELECT {inventory.MOVEMENT_COLUMNS} FROM inventory_movements",
+                      "movement_id", ["item_id=%s"], [item_id], inventory.movement_dict,
+                      "Error fetching movements", owner, _LEDGER_TABLES)
+
+
+@bp.route("/inventory/<int:item_id>/movements", methods=["POST"])
+@auth.login_required
+def add_inventory_movement(item_id):
+    """Adjust one item's stock. Body: {delta, reason?}; negative deltas take stock out."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"message": "Body must be an object"}), 400
+    return _apply_movements([{**data, "item_id": item_id}])
+
+
+@bp.route("/inventory/movements", methods=["POST"])
+@auth.login_required
+def add_inventory_movements():
+    """Apply many movements atomically. Body: {movements: [{item_id, delta, reason?}, ...]}.
+
+    Movements apply in order; if any item would go below zero nothing is
+    applied (409).
+    """
+    return _apply_movements(request.get_json(silent=True))
+
+
+def _apply_movements(data):
+    try:
+        movements = inventory.parse_movements(data)
+    except inventory.InventoryError as e:
+        return jsonify({"message": str(e)}), 400
+
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            item_ids = [m[0] for m in movements]
+            owners = _require_access("Item", item_ids, inventory.lock(cursor, item_ids))
+            applied, quantities = inventory.apply(cursor, movements, g.user_id)
+            conn.commit()
+            versions.bump(["inventory"], owners.values())
+        except inventory.InsufficientStock as e:
+            conn.rollback()
+            return jsonify({"message": str(e)}), 409
+        except (LookupError, PermissionError) as e:
+            conn.rollback()
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error applying inventory movements", "error": str(e)}), 500
+
+    items = [{"id": i, "quantity": q} for i, q in sorted(quantities.items())]
+    return jsonify({"movements": applied, "items": items}), 201
+
+
+# -------------------------
+# Analytics
+# -------------------------
+@bp.route("/analytics", methods=["GET"])
+def get_analytics():
+    """Weather/crop aggregates for a user or a single field, read from the rollup table.
+
+    Query params: user_id or field_id, period (week|month|year, default month),
+    view (location|season, default location).
+    week -> daily buckets, month -> weekly buckets, year -> monthly buckets.
+    """
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
+    q_field = request.args.get("field_id")
+    period = request.args.get("period", "month")
+    view = request.args.get("view", "location")
+
+    if period not in analytics.VIEWS:
+        return jsonify({"message": "period must be one of week, month, year"}), 400
+    if view not in ("location", "season"):
+        return jsonify({"message": "view must be location or season"}), 400
+    try:
+        if q_field:
+            scope, scope_id = "field", int(q_field)
         elif q_user:
-            cursor.execute("SELECT crop_id, name, health_status, planting_date, user_id, field_id FROM crops WHERE user_id=%s;", (q_user,))
-        elif q_field:
-            cursor.execute("SELECT crop_id, name, health_status, planting_date, user_id, field_id FROM crops WHERE field_id=%s;", (q_field,))
+            scope, scope_id = "user", int(q_user)
         else:
-            cursor.execute("SELECT crop_id, name, health_status, planting_date, user_id, field_id FROM crops;")
-
-        rows = cursor.fetchall()
-        crops = []
-        for row in rows:
-            cid, name, health_status, planting_date, uid, fid = row
-            crops.append({
-                "id": cid,
-                "name": name,
-                "health_status": health_status,
-                "planting_date": planting_date.isoformat() if planting_date else None,
-                "user_id": uid,
-                "field_id": fid,
-            })
+            return jsonify({"message": "user_id or field_id is required"}), 400
+    except ValueError:
+        return jsonify({"message": "user_id and field_id must be integers"}), 400
+
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            if scope == "field":
+                _check_field_access(cursor, [scope_id])
+            result = analytics.report(cursor, scope, scope_id, period, view)
+        except (LookupError, PermissionError) as e:
+            return _events_error(e)
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error fetching analytics", "error": str(e)}), 500
+
+    return jsonify({"analytics": result}), 200
+
+
+# -------------------------
+# Market prices
+# -------------------------
+@bp.route("/market-prices", methods=["POST"])
+@auth.admin_required
+def import_market_prices():
+    """Bulk price ingestion. Admin only; all-or-nothing.
+
+    JSON: {prices: [{crop_name, date, price_per_kg, crop_id?}]} or a bare list.
+    text/csv: crop_name,date,price_per_kg[,crop_id], read and inserted in
+    chunks. The daily rollup behind the trend queries is refreshed in the
+    same transaction.
+    """
+    is_csv = request.mimetype in ("text/csv", "application/csv")
+    try:
+        rows = market.read_csv(_csv_body()) if is_csv else market.parse_prices(request.get_json(silent=True))
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                inserted, days = market.import_rows(cursor, rows)
+                conn.commit()
+                versions.bump(["marketprice"])
+            except Exception:
+                conn.rollback()
+                raise
+    except (market.MarketError, UnicodeDecodeError) as e:
+        return jsonify({"message": str(e)}), 400
+    except PoolError:
+        raise
     except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error fetching crops", "error": str(e)}), 500
+        return jsonify({"message": "Error importing market prices", "error": str(e)}), 500
+
+    return jsonify({"inserted": inserted, "crop_days_refreshed": days}), 201
+
+
+def _as_of_arg(name, default):
+    value = request.args.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"{name} must be YYYY-MM-DD")
+
+
+def _crop_args():
+    # ?crop=Rice&crop=Corn or ?crop=Rice,Corn
+    return [c for value in request.args.getlist("crop") for c in value.split(",") if c.strip()]
+
+
+@bp.route("/market-prices/trends", methods=["GET"])
+def market_price_trends():
+    """Per-crop average, min/max and percent change over the last 7, 30 and 90 days.
+
+    Query params: crop (repeat or comma-separate; default every crop with
+    prices in the last 90 days), as_of (YYYY-MM-DD, default today).
+    """
+    today = datetime.utcnow().date()
+    try:
+        as_of = _as_of_arg("as_of", today)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    crops = _crop_args()
+
+    def build():
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                result = market.trends(cursor, crops, as_of)
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"message": "Error fetching market trends", "error": str(e)}), 500
+        return jsonify({"trends": result}), 200
+
+    return versions.conditional(["marketprice", today.isoformat()], None, build)
 
-    cursor.close()
-    conn.close()
-    return jsonify({"crops": crops}), 200
+
+@bp.route("/market-prices/series", methods=["GET"])
+def market_price_series():
+    """Daily prices of one crop with a trailing moving average, for charts.
+
+    Query params: crop (required), start / end (YYYY-MM-DD, default the 90
+    days up to today), window (moving average days, 1-90, default 7).
+    """
+    crops = _crop_args()
+    if len(crops) != 1:
+        return jsonify({"message": "Exactly one crop is required"}), 400
+    today = datetime.utcnow().date()
+    try:
+        end = _as_of_arg("end", today)
+        start = _as_of_arg("start", end - timedelta(days=89))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    try:
+        window = int(request.args.get("window", 7))
+    except ValueError:
+        return jsonify({"message": "window must be an integer"}), 400
+    if not 1 <= window <= max(market.WINDOWS):
+        return jsonify({"message": f"window must be between 1 and {max(market.WINDOWS)}"}), 400
+    if start > end or (end - start).days >= market.MAX_SERIES_DAYS:
+        return jsonify({"message": f"start must be on or before end, at most {market.MAX_SERIES_DAYS} days apart"}), 400
+
+    def build():
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                result = market.series(cursor, crops[0], start, end, window)
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"message": "Error fetching market prices", "error": str(e)}), 500
+        return jsonify({"prices": result}), 200
+
+    return versions.conditional(["marketprice", today.isoformat()], None, build)
 
 
 # -------------------------
@@ -399,7 +1212,7 @@ def reverse_geocode():
     """Reverse-geocode a latitude/longitude pair and return a city-like name.
 
     Query params: lat, lon
-    Returns JSON: { city: <string|null>, display_name: <string|null> }
+    Returns JSON: { city: <string|null>, state: <string|null>, display_name: <string|null>, cached: <bool> }
     """
     lat = request.args.get("lat")
     lon = request.args.get("lon")
@@ -413,19 +1226,9 @@ def reverse_geocode():
         return jsonify({"message": "Invalid lat/lon values"}), 400
 
     try:
-        # Use a longer timeout to avoid quick failures (Nominatim default is short)
-        loc = _geolocator.reverse((lat_f, lon_f), exactly_one=True, language='en', timeout=10)
-        if not loc:
-            return jsonify({"city": None, "state": None, "display_name": None}), 200
-
-        raw = getattr(loc, 'raw', {}) or {}
-        address = raw.get('address', {}) if isinstance(raw, dict) else {}
-        city = (address.get('city') or address.get('town') or address.get('village') or
-            address.get('hamlet') or address.get('county') or None)
-        # Prefer 'state' but fall back to other region-like fields
-        state = address.get('state') or address.get('region') or None
-        return jsonify({"city": city, "state": state, "display_name": loc.address}), 200
-    except (GeocoderTimedOut, GeocoderServiceError) as e:
+        result, cached = geocode.reverse(lat_f, lon_f)
+        return jsonify({**result, "cached": cached}), 200
+    except geocode.GeocodeError as e:
         # Don't fail the client - return nulls so UI can render without breaking
         return jsonify({"city": None, "state": None, "display_name": None, "warning": "geocoding_failed", "error": str(e)}), 200
     except Exception as e:
@@ -433,15 +1236,53 @@ def reverse_geocode():
         return jsonify({"city": None, "state": None, "display_name": None, "warning": "geocoding_error", "error": str(e)}), 200
 
 
+@bp.route("/reverse-geocode", methods=["POST"])
+def reverse_geocode_batch():
+    """Reverse-geocode many coordinates in one round trip.
+
+    JSON body: { coordinates: [[lat, lon], ...] } (or a list of {lat, lon} objects)
+    Returns JSON: { results: [{ lat, lon, city, state, display_name, cached, warning? }, ...] }
+    in request order. Cached grid cells are answered immediately; at most
+    GEOCODE_BATCH_MAX_MISSES uncached cells are looked up upstream per call and the
+    rest come back with warning "deferred" so the client can ask again later.
+    """
+    data = request.get_json(silent=True) or {}
+    coords = data.get("coordinates")
+    if not isinstance(coords, list) or not coords:
+        return jsonify({"message": "coordinates must be a non-empty list"}), 400
+    if len(coords) > GEOCODE_BATCH_MAX:
+        return jsonify({"message": f"At most {GEOCODE_BATCH_MAX} coordinates per request"}), 400
+
+    points = []
+    try:
+        for c in coords:
+            if isinstance(c, dict):
+                points.append((float(c["lat"]), float(c["lon"])))
+            else:
+                lat, lon = c
+                points.append((float(lat), float(lon)))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"message": "Invalid lat/lon values"}), 400
+
+    results = geocode.reverse_many(points, max_upstream=GEOCODE_BATCH_MAX_MISSES)
+    return jsonify({"results": results}), 200
+
+
 # -------------------------
-# Fetch weather from Open-Meteo and store
+# Fetch weather from Open-Meteo and store the hourly series
 # -------------------------
 @bp.route("/fetch-weather", methods=["POST"])
 def fetch_weather_for_location():
-    """Fetch current hourly weather from Open-Meteo for lat/lon and store one row in the weather table.
-
-    Accepts JSON body or query params with `lat` and `lon`.
-    Returns the inserted weather row on success.
+    """Return current weather for lat/lon, refreshing the stored hourly series when stale.
+
+    Accepts JSON body or query params with `lat` and `lon`, optional `field_id`
+    (used only when the caller owns that field; otherwise the series is stored
+    by location alone), `forecast_days` (0-16, extra days to store beyond today) and `refresh`
+    (force an upstream call). When the stored hours are fresher than
+    WEATHER_CACHE_TTL the row nearest to now is returned without contacting
+    Open-Meteo (200); otherwise the whole series is fetched, upserted in one
+    statement and the current hour is returned (201). If Open-Meteo is failing
+    the last stored sample is returned with ``stale: true`` (200).
     """
     data = request.get_json(silent=True) or {}
     lat = data.get('lat') or request.args.get('lat')
@@ -464,128 +1305,162 @@ def fetch_weather_for_location():
             field_id = int(field_id_raw)
     except Exception:
         field_id = None
-
-    # Build Open-Meteo hourly request for today
-    # Request the set of hourly variables we need
-    params = {
-        'latitude': lat_f,
-        'longitude': lon_f,
-        'hourly': ','.join([
-            'temperature_2m',
-            'relativehumidity_2m',
-            'precipitation_probability',
-            'precipitation',
-            'cloudcover',
-            'windspeed_10m',
-            'winddirection_10m',
-            'weathercode',
-        ]),
-        'timezone': 'UTC',
-        'start_date': datetime.utcnow().date().isoformat(),
-        'end_date': datetime.utcnow().date().isoformat(),
-    }
+    if field_id is not None and not _owns_field(field_id):
+        # stored rows are upserted per (field_id, hour): only the owner may replace them
+        field_id = None
 
     try:
-        res = requests.get('https://api.open-meteo.com/v1/forecast', params=params, timeout=10)
-        if res.status_code != 200:
-            return jsonify({"message": "Open-Meteo request failed", "status_code": res.status_code, "body": res.text}), 502
-        payload = res.json()
-    except Exception as e:
-        return jsonify({"message": "Error contacting Open-Meteo", "error": str(e)}), 502
+        forecast_days = int(data.get('forecast_days') or request.args.get('forecast_days') or 0)
+    except ValueError:
+        return jsonify({"message": "forecast_days must be an integer"}), 400
+    if not 0 <= forecast_days <= weather.MAX_FORECAST_DAYS:
+        return jsonify({"message": f"forecast_days must be between 0 and {weather.MAX_FORECAST_DAYS}"}), 400
+
+    refresh = str(data.get('refresh') or request.args.get('refresh') or '').lower() in ('1', 'true', 'yes')
+    location = f"{lat_f},{lon_f}"
+    now = datetime.utcnow()
 
-    hours = payload.get('hourly', {})
-    times = hours.get('time', [])
+    if not refresh:
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                current = weather.load_current(cursor, field_id, location, now)
+            except Exception as e:
+                conn.rollback()
+                return jsonify({"message": "Error reading weather from DB", "error": str(e)}), 500
+        if current:
+            return jsonify({"weather": weather.serialize(current, field_id, location), "cached": True}), 200
 
-    if not times:
+    try:
+        payload = weather.fetch_hourly(lat_f, lon_f, forecast_days)
+    except weather.UpstreamError as e:
+        # Open-Meteo is down or its circuit is open: serve the last stored sample if there is one
+        with connection() as conn, conn.cursor() as cursor:
+            try:
+                fallback = weather.load_fallback(cursor, field_id, location, now)
+            except Exception:
+                conn.rollback()
+                fallback = None
+        if fallback:
+            return jsonify({"weather": weather.serialize(fallback, field_id, location), "cached": True,
+                            "stale": True, "warning": "upstream_unavailable", "error": str(e)}), 200
+        return jsonify({"message": "Open-Meteo request failed", "error": str(e)}), 502
+
+    rows = weather.parse_hourly(payload)
+    if not rows:
         return jsonify({"message": "No hourly data returned by Open-Meteo"}), 502
 
-    # Choose the hour nearest to now (UTC)
-    now = datetime.utcnow()
-    best_idx = 0
-    best_diff = None
-    for i, t in enumerate(times):
+    with connection() as conn, conn.cursor() as cursor:
         try:
-            dt = date_parser.isoparse(t)
-            diff = fabs((dt - now).total_seconds())
-            if best_diff is None or diff < best_diff:
-                best_diff = diff
-                best_idx = i
-        except Exception:
-            continue
-
-    def get_hourly(name):
-        arr = hours.get(name, [])
+            ids = weather.store_series(cursor, rows, field_id, location, fetched_at=now)
+            if field_id is not None:
+                analytics.refresh(cursor, {(field_id, r['observed_at'].date()) for r in rows})
+            conn.commit()
+            versions.bump(["weather"])
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error inserting weather into DB", "error": str(e)}), 500
+
+    current = weather.nearest(rows, now)
+    current['weather_id'] = ids.get(current['observed_at'])
+    return jsonify({"weather": weather.serialize(current, field_id, location), "cached": False, "stored": len(rows)}), 201
+
+
+def _owns_field(field_id):
+    """True if the authenticated caller owns ``field_id`` or is an admin."""
+    if g.user_id is None:
+        return False
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT user_id FROM fields WHERE field_id=%s;", (field_id,))
+        row = cursor.fetchone()
+    return row is not None and (row[0] == g.user_id or auth.is_admin())
+
+
+# -------------------------
+# Delta sync for offline clients
+# -------------------------
+@bp.route("/sync", methods=["GET"])
+@auth.login_required
+def sync_changes():
+    """Rows of fields, crops, inventory and weather changed or deleted since ``cursor``.
+
+    Query params: cursor (from the previous sync; omit it for a full snapshot),
+    user_id (admins only). Every sync is recorded in synclog. See app/sync.py
+    for the response shape.
+    """
+    q_user, denied = auth.scoped_user_id(request.args.get("user_id"))
+    if denied:
+        return denied
+    try:
+        q_user = int(q_user)
+    except ValueError:
+        return jsonify({"message": "user_id must be an integer"}), 400
+
+    with connection() as conn, conn.cursor() as cursor:
         try:
-            return arr[best_idx]
-        except Exception:
-            return None
-
-    weather_code = get_hourly('weathercode')
-    temperature = get_hourly('temperature_2m')
-    relative_humidity = get_hourly('relativehumidity_2m')
-    precipitation_probability = get_hourly('precipitation_probability')
-    precipitation = get_hourly('precipitation')
-    cloud_cover = get_hourly('cloudcover')
-    wind_speed_10m = get_hourly('windspeed_10m')
-    wind_direction_10m = get_hourly('winddirection_10m')
-
-    # Insert into DB (date = date part of the selected hour)
-    date_str = None
+            payload, sent = sync.changes(cursor, q_user, request.args.get("cursor"))
+            sync.record(cursor, q_user, "full" if payload["full"] else "delta", sent)
+            conn.commit()
+        except sync.CursorError as e:
+            conn.rollback()
+            return jsonify({"message": str(e)}), 400
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error building sync", "error": str(e)}), 500
+
+    return sync.to_response(payload)
+
+
+# -------------------------
+# Admin: refresh weather for every field
+# -------------------------
+@bp.route("/admin/refresh-weather", methods=["POST"])
+@auth.admin_required
+def admin_refresh_weather():
+    """Refresh hourly weather for all fields (same as `flask refresh-weather`).
+
+    Requires a Bearer token for a user with role 'admin'. Optional JSON body:
+    { forecast_days, batch_size, concurrency }. Runs synchronously and returns
+    the refresh summary; failed batches are listed under "errors".
+    """
+    data = request.get_json(silent=True) or {}
     try:
-        date_str = times[best_idx].split('T')[0]
-    except Exception:
-        date_str = datetime.utcnow().date().isoformat()
+        forecast_days = int(data.get("forecast_days", 0))
+        batch_size = int(data.get("batch_size", weather.BATCH_SIZE))
+        concurrency = int(data.get("concurrency", weather.CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"message": "forecast_days, batch_size and concurrency must be integers"}), 400
+    if not 0 <= forecast_days <= weather.MAX_FORECAST_DAYS or batch_size < 1 or concurrency < 1:
+        return jsonify({"message": "Invalid refresh parameters"}), 400
+
+    summary = weather.refresh_all(forecast_days, batch_size, concurrency)
+    return jsonify({"refresh": summary}), 200
 
-    conn = get_connection()
-    if conn is None:
-        return jsonify({"message": "Database connection not available"}), 500
 
-    cursor = conn.cursor()
+# -------------------------
+# Admin: compact the inventory ledger
+# -------------------------
+@bp.route("/admin/compact-inventory", methods=["POST"])
+@auth.admin_required
+def admin_compact_inventory():
+    """Snapshot daily closing stock and prune old ledger rows (same as `flask compact-inventory`).
+
+    Optional JSON body: { keep_days } (default INVENTORY_LEDGER_DAYS; 0 keeps every movement).
+    """
+    data = request.get_json(silent=True) or {}
     try:
-        cursor.execute(
-            """
-            INSERT INTO weather (date, weather_code, temperature, relative_humidity, precipitation_probability, precipitation, cloud_cover, wind_speed_10m, wind_direction_10m, field_id, location)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING weather_id;
-            """,
-            (
-                date_str,
-                int(weather_code) if weather_code is not None else None,
-                float(temperature) if temperature is not None else None,
-                float(relative_humidity) if relative_humidity is not None else None,
-                float(precipitation_probability) if precipitation_probability is not None else None,
-                float(precipitation) if precipitation is not None else None,
-                float(cloud_cover) if cloud_cover is not None else None,
-                float(wind_speed_10m) if wind_speed_10m is not None else None,
-                float(wind_direction_10m) if wind_direction_10m is not None else None,
-                field_id,
-                f"{lat_f},{lon_f}",
-            )
-        )
-        row = cursor.fetchone()
-        conn.commit()
-        weather_id = row[0] if row else None
-    except Exception as e:
-        conn.rollback()
-        cursor.close()
-        conn.close()
-        return jsonify({"message": "Error inserting weather into DB", "error": str(e)}), 500
+        keep_days = int(data.get("keep_days", inventory.LEDGER_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({"message": "keep_days must be an integer"}), 400
+    if keep_days < 0:
+        return jsonify({"message": "keep_days must not be negative"}), 400
 
-    cursor.close()
-    conn.close()
+    with connection() as conn, conn.cursor() as cursor:
+        try:
+            summary = inventory.compact(cursor, keep_days)
+            conn.commit()
+            versions.bump(["inventory_movements"])
+        except Exception as e:
+            conn.rollback()
+            return jsonify({"message": "Error compacting inventory", "error": str(e)}), 500
 
-    return jsonify({
-        "weather": {
-            "id": weather_id,
-            "date": date_str,
-            "weather_code": weather_code,
-            "temperature": temperature,
-            "relative_humidity": relative_humidity,
-            "precipitation_probability": precipitation_probability,
-            "precipitation": precipitation,
-            "cloud_cover": cloud_cover,
-            "wind_speed_10m": wind_speed_10m,
-            "wind_direction_10m": wind_direction_10m,
-            "field_id": field_id,
-            "location": f"{lat_f},{lon_f}",
-        }
-    }), 201
\ No newline at end of file
+    return jsonify({"compaction": summary}), 200
@@ -0,0 +1,113 @@
+"""Viewport and nearest-N field queries on the numeric lat/lon columns.
+
+``fields.lat`` / ``fields.lon`` are parsed from the "lat,lon" location text
+on insert (weather.parse_location; NULL when it is not a valid coordinate)
+and indexed per backend (migration 9):
+
+- Postgres: a GiST index on ``point(lon, lat)``. Bounding boxes are ``<@``
+  containment tests and nearest-N is a KNN scan ordered by ``<->``, both
+  answered from the index without PostGIS.
+- SQLite: a btree on (lat, lon). Boxes are range scans. Nearest-N widens a
+  box around the point until it holds enough fields within its inscribed
+  circle.
+
+Boxes may cross the antimeridian (west > east). Distances are great-circle
+kilometres. KNN orders by planar degree distance, so the few results are
+re-sorted by the real distance before returning.
+"""
+import math
+
+from .model import BACKEND
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# SQLite nearest search: first box half-size (degrees) and growth factor per round
+_START_DEGREES = 0.05
+_GROWTH = 4
+
+COLUMNS = "field_id, location, user_id, lat, lon"
+
+
+def parse_bbox(text):
+    """Parse ?bbox=west,south,east,north (Leaflet's toBBoxString order). Raises ValueError."""
+    try:
+        west, south, east, north = (float(v) for v in text.split(','))
+    except ValueError:
+        raise ValueError("bbox must be west,south,east,north in degrees")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox is out of range or south > north")
+    return west, south, east, north
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+if BACKEND == "sqlite":
+    def bbox_clause(west, south, east, north):
+        """SQL condition (and params) for fields inside the box."""
+        if west <= east:
+            return "lat BETWEEN %s AND %s AND lon BETWEEN %s AND %s", [south, north, west, east]
+        return "lat BETWEEN %s AND %s AND (lon >= %s OR lon <= %s)", [south, north, west, east]
+else:
+    _BOX = "point(lon, lat) <@ box(point(%s, %s), point(%s, %s))"
+
+    def bbox_clause(west, south, east, north):
+        """SQL condition (and params) for fields inside the box."""
+        if west <= east:
+            return _BOX, [west, south, east, north]
+        return f"({_BOX} OR {_BOX})", [west, south, 180, north, -180, south, east, north]
+
+
+def _by_distance(rows, lat, lon):
+    return sorted(((distance_km(lat, lon, r[3], r[4]), r) for r in rows), key=lambda x: x[0])
+
+
+def _nearest_knn(cursor, lat, lon, limit, clauses, params):
+    where = " AND ".join(["lat IS NOT NULL"] + clauses)
+    cursor.execute(
+        f"SELECT {COLUMNS} FROM fields WHERE {where} ORDER BY point(lon, lat) <-> point(%s, %s) LIMIT %s;",
+        params + [lon, lat, limit],
+    )
+    return _by_distance(cursor.fetchall(), lat, lon)
+
+
+def _nearest_box(cursor, lat, lon, limit, clauses, params):
+    half = _START_DEGREES
+    while True:
+        south, north = max(-90.0, lat - half), min(90.0, lat + half)
+        edge = max(abs(south), abs(north))
+        # degrees of longitude spanning ``half`` degrees of arc at the box's poleward edge
+        lon_half = half / math.cos(math.radians(edge)) if edge < 89.9 else 180
+        everything = half >= 180
+        where, box_params = list(clauses), list(params)
+        if not everything:
+            if lon_half >= 180:
+                clause, extra = "lat BETWEEN %s AND %s", [south, north]
+            else:
+                west = (lon - lon_half + 180) % 360 - 180
+                east = (lon + lon_half + 180) % 360 - 180
+                clause, extra = bbox_clause(west, south, east, north)
+            where.append(clause)
+            box_params += extra
+        where.append("lat IS NOT NULL")
+        cursor.execute(f"SELECT {COLUMNS} FROM fields WHERE {' AND '.join(where)};", box_params)
+        found = _by_distance(cursor.fetchall(), lat, lon)
+        # only fields inside the box's inscribed circle are certain to beat anything outside it
+        certain = [f for f in found if f[0] <= half * KM_PER_DEGREE]
+        if len(certain) >= limit or everything:
+            return (found if everything else certain)[:limit]
+        half *= _GROWTH
+
+
+def nearest(cursor, lat, lon, limit, clauses=(), params=()):
+    """The ``limit`` located fields closest to (lat, lon) matching ``clauses``.
+
+    Returns [(distance_km, row)] nearest first; rows are ``COLUMNS``.
+    """
+    search = _nearest_box if BACKEND == "sqlite" else _nearest_knn
+    return search(cursor, lat, lon, limit, list(clauses), list(params))
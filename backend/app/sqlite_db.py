@@ -0,0 +1,187 @@
+"""Embedded SQLite storage for single-node field stations (DB_BACKEND=sqlite).
+
+``connect`` returns a connection that behaves like the psycopg2 ones the
+rest of the app is written against: ``with conn.cursor() as cursor``,
+``%s`` / ``%(name)s`` parameters, lists bound to ``= ANY(%s)``, explicit
+commit/rollback. Statements are rewritten once per distinct SQL string and
+then hit sqlite3's per-connection prepared statement cache.
+
+Transactions follow Postgres' READ COMMITTED closely enough for this app:
+reads run in autocommit (each statement sees the latest committed data) and
+the first write of a transaction takes the database write lock with
+``BEGIN IMMEDIATE``, so writers queue on busy_timeout instead of failing
+with SQLITE_BUSY when upgrading a read snapshot. The file runs in WAL mode,
+so readers never wait for the writer.
+
+Settings: SQLITE_PATH, SQLITE_BUSY_TIMEOUT (ms), SQLITE_CACHE_MB,
+SQLITE_MMAP_MB, SQLITE_STATEMENT_CACHE.
+"""
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import date, datetime
+from functools import lru_cache
+
+from . import metrics
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "32"))
+MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))
+# SQLITE_MAX_VARIABLE_NUMBER for the bundled library (3.32+)
+MAX_VARIABLES = 32766
+
+# Stored as text in the same "YYYY-MM-DD HH:MM:SS" shape CURRENT_TIMESTAMP
+# produces, so range comparisons between the two sort correctly
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()[:10]))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter("BOOLEAN", lambda b: b not in (b"0", b""))
+
+_ANY = re.compile(r"=\s*ANY\(\s*(%s|%\(\w+\)s)\s*\)", re.I)
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_NOW = re.compile(r"\bNOW\(\)", re.I)
+_WRITE = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP)\b", re.I)
+_WITH_WRITE = re.compile(r"\s*WITH\b.*\b(INSERT|UPDATE|DELETE)\b", re.I | re.S)
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """Rewrite a psycopg2-style statement for sqlite3. Returns (sql, is_write)."""
+    text = _ANY.sub(lambda m: f"IN (SELECT value FROM json_each({m.group(1)}))", sql)
+    text = _NOW.sub("CURRENT_TIMESTAMP", text)
+    text = _PLACEHOLDER.sub(lambda m: f":{m.group(1)}" if m.group(1) else ("?" if m.group(0) == "%s" else "%"), text)
+    return text, bool(_WRITE.match(sql) or _WITH_WRITE.match(sql))
+
+
+def _value(v):
+    # arrays (ANY / json_each parameters) travel as JSON text
+    if isinstance(v, (list, tuple, set)):
+        return json.dumps([x.isoformat() if isinstance(x, date) else x for x in v])
+    return v
+
+
+def _params(vars):
+    if vars is None:
+        return ()
+    if isinstance(vars, dict):
+        return {k: _value(v) for k, v in vars.items()}
+    return [_value(v) for v in vars]
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._raw.cursor()
+        # accepted for psycopg2 compatibility; sqlite steps rows lazily anyway
+        self.itersize = 2000
+
+    def execute(self, query, vars=None):
+        sql, is_write = translate(query)
+        if is_write and not self.connection._raw.in_transaction:
+            self.connection.begin()
+        label = metrics.statement_label(query)
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(sql, _params(vars))
+        except Exception:
+            metrics.DB_QUERY_ERRORS.inc(label)
+            raise
+        finally:
+            metrics.DB_QUERY.observe(time.perf_counter() - started, label)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Connection:
+    def __init__(self, raw):
+        self._raw = raw
+        self.closed = 0
+
+    def cursor(self, name=None):
+        # named (server-side) cursors are a Postgres concept; a plain cursor streams here
+        return Cursor(self)
+
+    def begin(self):
+        """Start a write transaction now, waiting up to busy_timeout for the write lock."""
+        self._raw.execute("BEGIN IMMEDIATE")
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._raw.execute("PRAGMA optimize")
+            finally:
+                self._raw.close()
+                self.closed = 1
+
+
+def connect(path):
+    raw = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        isolation_level=None,  # transactions are started explicitly, see Cursor.execute
+        check_same_thread=False,  # connections move between request threads via the pool
+        cached_statements=STATEMENT_CACHE,
+    )
+    raw.execute("PRAGMA journal_mode = WAL")
+    raw.execute("PRAGMA synchronous = NORMAL")  # durable at checkpoints; WAL keeps the file consistent
+    raw.execute("PRAGMA foreign_keys = ON")
+    raw.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    raw.execute(f"PRAGMA cache_size = {-CACHE_MB * 1024}")
+    raw.execute(f"PRAGMA mmap_size = {MMAP_MB * 1024 * 1024}")
+    raw.execute("PRAGMA temp_store = MEMORY")
+    return Connection(raw)
+
+
+def execute_values(cursor, sql, argslist, template=None, page_size=100, fetch=False):
+    """Same contract as psycopg2.extras.execute_values: ``VALUES %s`` becomes a multi-row VALUES list."""
+    rows = list(argslist)
+    if not rows:
+        return [] if fetch else None
+    template = template or "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+    head, tail = sql.split("%s", 1)
+    page_size = max(1, min(page_size, MAX_VARIABLES // max(1, template.count("%s"))))
+    result = []
+    for i in range(0, len(rows), page_size):
+        page = rows[i:i + page_size]
+        cursor.execute(head + ", ".join([template] * len(page)) + tail, [v for row in page for v in row])
+        if fetch:
+            result.extend(cursor.fetchall())
+    return result if fetch else None
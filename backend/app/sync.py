@@ -0,0 +1,151 @@
+"""Delta sync for offline / mobile clients.
+
+``fields``, ``crops``, ``inventory`` and ``weather`` carry a ``row_version``
+that triggers set on every insert and real update, and deletes leave a
+tombstone in ``sync_deleted`` (migration 7). A client keeps the opaque
+``cursor`` from its last sync and gets back only what changed since:
+
+    {"cursor": "...", "full": false,
+     "changes": {"fields": {"columns": [...], "rows": [[...], ...]}, ...},
+     "deleted": {"crops": [12, 15]}}
+
+Rows are sent as arrays under one ``columns`` list per table to keep the
+payload small, and the body is compressed like every response (encoding.py).
+Without a cursor (or with one older than the tombstone retention,
+SYNC_TOMBSTONE_DAYS) the response is a full snapshot with ``full: true``
+and the client should replace its copy. Weather is limited
+to hours from SYNC_WEATHER_DAYS back onward. Rows of a deleted field
+(crops, weather) may not have their own tombstones; they go with the field.
+
+Cursor values are a lower bound, so a row may be sent twice but never
+skipped. On Postgres row_version is the writing transaction's id and the
+cursor is the oldest transaction still running when the sync started
+(rows of transactions that commit late are picked up next time). On SQLite
+writers are serialized, so a counter bumped under the write lock suffices.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import Response
+
+from . import encoding
+from .model import BACKEND
+
+WEATHER_DAYS = int(os.getenv("SYNC_WEATHER_DAYS", "7"))
+TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "30"))
+# Purge expired tombstones once every this many syncs
+PURGE_EVERY = 200
+
+# table -> (columns sent, FROM/WHERE clause restricted to one user's rows)
+TABLES = {
+    "fields": (
+        ("field_id", "location", "user_id", "lat", "lon"),
+        "fields t WHERE t.user_id = %s",
+    ),
+    "crops": (
+        ("crop_id", "name", "health_status", "planting_date", "user_id", "field_id"),
+        "crops t WHERE t.user_id = %s",
+    ),
+    "inventory": (
+        ("item_id", "name", "quantity", "type", "user_id"),
+        "inventory t WHERE t.user_id = %s",
+    ),
+    "weather": (
+        ("weather_id", "field_id", "observed_at", "weather_code", "temperature", "relative_humidity",
+         "precipitation_probability", "precipitation", "cloud_cover", "wind_speed_10m", "wind_direction_10m"),
+        "weather t JOIN fields f ON f.field_id = t.field_id WHERE f.user_id = %s AND t.observed_at >= %s",
+    ),
+}
+
+if BACKEND == "sqlite":
+    _WATERMARK_SQL = "SELECT version + 1 FROM sync_clock;"
+    _PURGE_SQL = "DELETE FROM sync_deleted WHERE deleted_at < datetime('now', '-' || %s || ' days');"
+else:
+    # every transaction older than this has committed or aborted
+    _WATERMARK_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot());"
+    _PURGE_SQL = "DELETE FROM sync_deleted WHERE deleted_at < NOW() - %s * INTERVAL '1 day';"
+
+_syncs_since_purge = 0
+_purge_lock = threading.Lock()
+
+
+class CursorError(ValueError):
+    """The client sent a cursor this server did not issue."""
+
+
+def _encode(version, issued_at):
+    return f"{version}.{int(issued_at)}"
+
+
+def _decode(cursor):
+    try:
+        version, issued_at = cursor.split(".", 1)
+        return int(version), int(issued_at)
+    except (AttributeError, ValueError):
+        raise CursorError("cursor is not valid; sync again without one")
+
+
+def changes(cursor, user_id, since=None, now=None):
+    """Collect the changes for ``user_id`` since the client cursor ``since``.
+
+    Returns (payload dict, rows sent). Runs on the caller's cursor; the
+    caller records the sync and commits.
+    """
+    now = now or time.time()
+    version = 0
+    if since:
+        version, issued_at = _decode(since)
+        if now - issued_at > TOMBSTONE_DAYS * 86400:
+            # tombstones from that far back may be purged; start over
+            version = 0
+
+    # read the watermark first: anything committed after it is picked up next time
+    cursor.execute(_WATERMARK_SQL)
+    watermark = cursor.fetchone()[0]
+    weather_from = datetime.utcfromtimestamp(now) - timedelta(days=WEATHER_DAYS)
+
+    result = {"cursor": _encode(watermark, now), "full": version == 0, "changes": {}, "deleted": {}}
+    sent = 0
+    for table, (columns, source) in TABLES.items():
+        params = [user_id, weather_from] if table == "weather" else [user_id]
+        cursor.execute(
+            f"SELECT {', '.join('t.' + c for c in columns)} FROM {source} AND t.row_version >= %s;",
+            params + [version],
+        )
+        rows = cursor.fetchall()
+        if rows:
+            result["changes"][table] = {"columns": list(columns), "rows": [list(r) for r in rows]}
+            sent += len(rows)
+
+    if version:
+        cursor.execute(
+            "SELECT table_name, row_id FROM sync_deleted WHERE user_id = %s AND row_version >= %s;",
+            (user_id, version),
+        )
+        for table, row_id in cursor.fetchall():
+            result["deleted"].setdefault(table, []).append(row_id)
+            sent += 1
+    return result, sent
+
+
+def record(cursor, user_id, status, rows_sent):
+    """Log the sync in ``synclog`` and purge expired tombstones now and then."""
+    global _syncs_since_purge
+    cursor.execute("INSERT INTO synclog (user_id, status, rows_sent) VALUES (%s, %s, %s);",
+                   (user_id, status, rows_sent))
+    with _purge_lock:
+        _syncs_since_purge += 1
+        purge = _syncs_since_purge >= PURGE_EVERY
+        if purge:
+            _syncs_since_purge = 0
+    if purge:
+        cursor.execute(_PURGE_SQL, (TOMBSTONE_DAYS,))
+
+
+def to_response(payload):
+    """Compact JSON; compressed by the app-wide hook in encoding.py like every response."""
+    response = Response(encoding.dumps_bytes(payload), mimetype="application/json")
+    response.headers["Cache-Control"] = "no-store"
+    return response
@@ -0,0 +1,196 @@
+"""Shared outbound HTTP client for Open-Meteo and Nominatim.
+
+One ``Client`` per upstream keeps a pooled keep-alive ``requests.Session``
+and caps how many calls may be in flight at once (a caller that cannot get
+a slot within UPSTREAM_QUEUE_TIMEOUT fails instead of parking a request
+thread). Identical GETs already in flight are coalesced, so twenty users
+opening the same field trigger one upstream call. A circuit breaker opens
+after UPSTREAM_FAILURES consecutive failures (connection errors, timeouts,
+429 and 5xx) and fails fast for UPSTREAM_RESET seconds, then lets a single
+trial call through; callers catch ``UpstreamError`` and serve the last data
+they stored instead.
+
+Base URLs come from the environment (OPEN_METEO_URL, NOMINATIM_URL), so
+everything can be pointed at the stubs in ``backend/tools``.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from . import metrics
+
+FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURES", "5"))
+RESET_AFTER = float(os.getenv("UPSTREAM_RESET", "30"))
+QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "2"))
+
+
+class UpstreamError(Exception):
+    """The upstream could not be reached or returned an error."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpen(UpstreamError):
+    """Recent calls kept failing; not trying again yet."""
+
+
+class Client:
+    def __init__(self, name, base_url, timeout=10, max_concurrent=8, headers=None,
+                 failure_threshold=FAILURE_THRESHOLD, reset_after=RESET_AFTER):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.headers = headers or {}
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+
+        self._session = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._in_flight = {}
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._stats = {"calls": 0, "errors": 0, "coalesced": 0, "rejected": 0, "busy": 0}
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests  # deferred: only needed when actually calling upstream
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrent, max_retries=0)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+        return self._session
+
+    # -- circuit breaker --------------------------------------------------
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_after:
+            return "open"
+        return "half_open"
+
+    def _admit(self):
+        """Called under the lock before a new call starts; raises CircuitOpen to fail fast."""
+        state = self.state()
+        if state == "open" or (state == "half_open" and self._trial_running):
+            self._stats["rejected"] += 1
+            metrics.UPSTREAM_REJECTED.inc(self.name, "circuit_open")
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open after {self._failures} failures)")
+        if state == "half_open":
+            self._trial_running = True
+
+    def _record(self, ok):
+        with self._lock:
+            self._trial_running = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            self._stats["errors"] += 1
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                # a failed half-open trial re-opens for another full period
+                self._opened_at = time.monotonic()
+
+    # -- calls ----------------------------------------------------------------
+    def get_json(self, path="", params=None, timeout=None):
+        """GET ``base_url + path`` and decode JSON. Raises UpstreamError (or CircuitOpen)."""
+        params = params or {}
+        key = (path, tuple(sorted((k, str(v)) for k, v in params.items())))
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                self._admit()
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._call(path, params, timeout or self.timeout)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def _call(self, path, params, timeout):
+        if not self._slots.acquire(timeout=QUEUE_TIMEOUT):
+            with self._lock:
+                self._stats["busy"] += 1
+                self._trial_running = False
+            metrics.UPSTREAM_REJECTED.inc(self.name, "busy")
+            raise UpstreamError(f"Too many concurrent {self.name} requests")
+        started = time.perf_counter()
+        try:
+            self._stats["calls"] += 1
+            try:
+                res = self._get_session().get(self.base_url + path, params=params, timeout=timeout)
+            except Exception as e:
+                self._record(False)
+                metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, self.name, "error")
+                raise UpstreamError(f"Error contacting {self.name}: {e}") from e
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, self.name, str(res.status_code))
+            if res.status_code == 429 or res.status_code >= 500:
+                self._record(False)
+                raise UpstreamError(f"{self.name} request failed with status {res.status_code}: {res.text[:200]}",
+                                    res.status_code)
+            # other 4xx are our mistake, not an unhealthy upstream
+            self._record(True)
+            if res.status_code != 200:
+                raise UpstreamError(f"{self.name} request failed with status {res.status_code}: {res.text[:200]}",
+                                    res.status_code)
+            try:
+                return res.json()
+            except ValueError as e:
+                raise UpstreamError(f"{self.name} returned invalid JSON") from e
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state(), "consecutive_failures": self._failures,
+                    "in_flight": len(self._in_flight), **self._stats}
+
+
+open_meteo = Client(
+    "open-meteo",
+    os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast"),
+    timeout=float(os.getenv("OPEN_METEO_TIMEOUT", "10")),
+    max_concurrent=int(os.getenv("OPEN_METEO_MAX_CONCURRENT", "8")),
+)
+
+nominatim = Client(
+    "nominatim",
+    os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org"),
+    timeout=float(os.getenv("GEOCODE_TIMEOUT", "10")),
+    # requests are spaced 1/s by geocode's rate limiter anyway
+    max_concurrent=2,
+    headers={"User-Agent": "croptech-reverse-geocoder"},
+)
+
+
+def stats():
+    return {c.name: c.stats() for c in (open_meteo, nominatim)}
+
+
+metrics.gauge("upstream_circuit_open", "1 while an upstream's circuit breaker is refusing calls.",
+              lambda: {(("upstream", c.name),): int(c.state() == "open") for c in (open_meteo, nominatim)})
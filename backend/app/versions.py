@@ -0,0 +1,100 @@
+"""Write-driven data versions for conditional GETs.
+
+Every write path calls ``bump`` with the tables it changed and the users
+whose rows it touched. Read endpoints derive a weak ETag from the current
+counters, answer ``If-None-Match`` with 304 without touching the database,
+and keep recently built bodies in a small LRU keyed on that ETag, so a hot
+list is serialized once per change instead of once per request.
+
+Counters live in process memory, which matches how the app is served
+(``run.py``, one threaded process). They start over on restart; the
+process epoch in every ETag keeps old tags from matching. Running several
+worker processes would need a shared counter store; set RESPONSE_CACHE=0
+until then.
+"""
+import os
+import threading
+import uuid
+
+from flask import Response, make_response, request
+
+from .cache import LRUCache
+
+ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# bodies larger than this are revalidated with ETags but not kept in memory
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1024 * 1024)))
+# entries are self-invalidating through the ETag; the TTL only ages out cold ones
+CACHE_TTL = 3600
+
+# Tables whose writers know the owning user; others only have a table-wide counter
+PER_USER_TABLES = {"users", "fields", "crops", "field_events", "inventory"}
+
+_EPOCH = uuid.uuid4().hex[:8]
+_counters = {}
+_lock = threading.Lock()
+_responses = LRUCache(CACHE_SIZE)
+_stats = {"not_modified": 0, "hits": 0, "misses": 0}
+
+
+def bump(tables, user_ids=()):
+    """Record a committed write to ``tables`` touching rows owned by ``user_ids``."""
+    user_ids = {str(u) for u in user_ids if u is not None}
+    with _lock:
+        for table in tables:
+            _counters[(table, None)] = _counters.get((table, None), 0) + 1
+            if table in PER_USER_TABLES:
+                for uid in user_ids:
+                    _counters[(table, uid)] = _counters.get((table, uid), 0) + 1
+
+
+def etag(tables, user_id=None):
+    """ETag value for data from ``tables``, scoped to ``user_id`` where that is tracked."""
+    uid = str(user_id) if user_id is not None else None
+    with _lock:
+        parts = [
+            _counters.get((t, uid if uid is not None and t in PER_USER_TABLES else None), 0)
+            for t in tables
+        ]
+    return f"{_EPOCH}-{uid or '*'}-" + ".".join(map(str, parts))
+
+
+def conditional(tables, user_id, build):
+    """Serve a GET through the ETag check and response cache.
+
+    ``build()`` returns what a view would; only 200 responses are cached.
+    The tag is taken before building, so a write racing with the query can
+    only make the cached body newer than its tag, never older.
+    """
+    if not ENABLED:
+        return build()
+    tag = etag(tables, user_id)
+    if request.if_none_match.contains_weak(tag):
+        _stats["not_modified"] += 1
+        return _finish(Response(status=304), tag)
+
+    key = (request.endpoint, request.full_path, tag)
+    body = _responses.get(key)
+    if body is not None:
+        _stats["hits"] += 1
+        return _finish(Response(body, mimetype="application/json"), tag)
+
+    _stats["misses"] += 1
+    response = make_response(build())
+    if response.status_code != 200 or response.is_streamed:
+        return response
+    data = response.get_data()
+    if len(data) <= CACHE_MAX_BYTES:
+        _responses.put(key, data, CACHE_TTL)
+    return _finish(response, tag)
+
+
+def _finish(response, tag):
+    response.set_etag(tag, weak=True)
+    # let browsers keep the body but revalidate it every time
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def stats():
+    return {"enabled": ENABLED, "entries": len(_responses), **_stats}
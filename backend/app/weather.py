@@ -0,0 +1,458 @@
+"""Open-Meteo hourly weather: fetch, parse and store whole series.
+
+One upstream call returns every hour for the requested days; all of them are
+upserted into ``weather`` in a single statement, deduplicated on
+(field_id, observed_at) — or (location, observed_at) for rows not tied to a
+field. "Current conditions" are then read back from the stored series until
+the rows are older than WEATHER_CACHE_TTL. ``load_history`` serves stored
+hours over a time range, downsampled in the database (min/avg/max per time
+bucket) or with LTTB to a point budget for charts.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from . import analytics, versions
+from .model import BACKEND, connection, execute_values
+from .upstream import UpstreamError, open_meteo
+
+CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "3600"))
+# Bulk refresh: fields within the same grid cell share one upstream coordinate
+GRID_DECIMALS = int(os.getenv("WEATHER_GRID_DECIMALS", "2"))
+BATCH_SIZE = int(os.getenv("WEATHER_BATCH_SIZE", "50"))
+CONCURRENCY = int(os.getenv("WEATHER_REFRESH_CONCURRENCY", "4"))
+MAX_FORECAST_DAYS = 16
+# History: default range and point budget, and the most points one request may ask for
+HISTORY_DAYS = 7
+HISTORY_POINTS = int(os.getenv("WEATHER_HISTORY_POINTS", "500"))
+HISTORY_MAX_POINTS = 5000
+HISTORY_MODES = ("bucket", "lttb")
+
+# Open-Meteo hourly variable -> weather table column
+HOURLY_VARIABLES = {
+    'weathercode': 'weather_code',
+    'temperature_2m': 'temperature',
+    'relativehumidity_2m': 'relative_humidity',
+    'precipitation_probability': 'precipitation_probability',
+    'precipitation': 'precipitation',
+    'cloudcover': 'cloud_cover',
+    'windspeed_10m': 'wind_speed_10m',
+    'winddirection_10m': 'wind_direction_10m',
+}
+COLUMNS = list(HOURLY_VARIABLES.values())
+
+# distance between a stored hour and a given time, for "nearest sample" ordering
+if BACKEND == "sqlite":
+    _DISTANCE = "ABS(julianday(observed_at) - julianday(%s))"
+else:
+    _DISTANCE = "ABS(EXTRACT(EPOCH FROM observed_at - %s))"
+
+# observed_at in whole seconds since (start epoch, first parameter), divided into
+# buckets of the second parameter's width; observed_at is naive UTC on both backends
+if BACKEND == "sqlite":
+    _BUCKET = "(CAST(strftime('%%s', observed_at) AS INTEGER) - %s) / %s"
+else:
+    _BUCKET = "FLOOR((EXTRACT(EPOCH FROM observed_at) - %s) / %s)::bigint"
+
+
+def build_params(lat, lon, forecast_days=0, today=None):
+    today = today or datetime.utcnow().date()
+    return {
+        'latitude': lat,
+        'longitude': lon,
+        'hourly': ','.join(HOURLY_VARIABLES),
+        'timezone': 'UTC',
+        'start_date': today.isoformat(),
+        'end_date': (today + timedelta(days=forecast_days)).isoformat(),
+    }
+
+
+def _get(params, timeout=None):
+    # pooled session, request coalescing and circuit breaker live in upstream.open_meteo
+    return open_meteo.get_json(params=params, timeout=timeout)
+
+
+def fetch_hourly(lat, lon, forecast_days=0):
+    """Return the raw Open-Meteo payload for today plus ``forecast_days`` days."""
+    return _get(build_params(lat, lon, forecast_days))
+
+
+def fetch_hourly_many(coords, forecast_days=0):
+    """Fetch several (lat, lon) points in one Open-Meteo call. Returns payloads in input order."""
+    params = build_params(
+        ','.join(str(lat) for lat, _ in coords),
+        ','.join(str(lon) for _, lon in coords),
+        forecast_days,
+    )
+    payload = _get(params, timeout=30)
+    # A single coordinate comes back as an object, several as a list
+    payloads = payload if isinstance(payload, list) else [payload]
+    if len(payloads) != len(coords):
+        raise UpstreamError(f"Open-Meteo returned {len(payloads)} locations for {len(coords)} requested")
+    return payloads
+
+
+def _number(value, cast):
+    return cast(value) if value is not None else None
+
+
+def parse_hourly(payload):
+    """Turn an Open-Meteo payload into a list of row dicts keyed by column name."""
+    hours = payload.get('hourly', {}) or {}
+    times = hours.get('time', []) or []
+    series = {col: hours.get(var) or [] for var, col in HOURLY_VARIABLES.items()}
+    rows = []
+    for i, t in enumerate(times):
+        try:
+            # Open-Meteo returns "YYYY-MM-DDTHH:MM" in the requested (UTC) timezone
+            observed_at = datetime.fromisoformat(t)
+        except (TypeError, ValueError):
+            continue
+        row = {'observed_at': observed_at}
+        for col, values in series.items():
+            value = values[i] if i < len(values) else None
+            row[col] = _number(value, int if col == 'weather_code' else float)
+        rows.append(row)
+    return rows
+
+
+def nearest(rows, when):
+    """Pick the row whose observed_at is closest to ``when``."""
+    if not rows:
+        return None
+    return min(rows, key=lambda r: abs((r['observed_at'] - when).total_seconds()))
+
+
+def _row_values(rows, field_id, location, fetched_at):
+    return [
+        (r['observed_at'].date(), r['observed_at'], *[r[c] for c in COLUMNS], field_id, location, fetched_at)
+        for r in rows
+    ]
+
+
+def _upsert(cursor, values, by_field, returning=False):
+    if by_field:
+        conflict = "(field_id, observed_at) WHERE field_id IS NOT NULL"
+    else:
+        conflict = "(location, observed_at) WHERE field_id IS NULL"
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS + ['location', 'fetched_at'])
+    return execute_values(
+        cursor,
+        f"""
+        INSERT INTO weather (date, observed_at, {", ".join(COLUMNS)}, field_id, location, fetched_at)
+        VALUES %s
+        ON CONFLICT {conflict} DO UPDATE SET {updates}
+        {"RETURNING observed_at, weather_id" if returning else ""};
+        """,
+        values,
+        page_size=len(values) if returning else 1000,
+        fetch=returning,
+    )
+
+
+def store_series(cursor, rows, field_id, location, fetched_at=None):
+    """Upsert a parsed series in one statement. Returns {observed_at: weather_id}."""
+    if not rows:
+        return {}
+    values = _row_values(rows, field_id, location, fetched_at or datetime.utcnow())
+    return dict(_upsert(cursor, values, field_id is not None, returning=True))
+
+
+def load_current(cursor, field_id, location, now=None, max_age=CACHE_TTL):
+    """Return the stored row nearest to ``now`` if it was fetched within ``max_age`` seconds."""
+    now = now or datetime.utcnow()
+    if field_id is not None:
+        where, key = "field_id = %s", field_id
+    else:
+        where, key = "field_id IS NULL AND location = %s", location
+    cursor.execute(
+        f"""
+        SELECT weather_id, observed_at, {", ".join(COLUMNS)}
+        FROM weather
+        WHERE {where}
+          AND observed_at BETWEEN %s AND %s
+          AND fetched_at >= %s
+        ORDER BY {_DISTANCE}
+        LIMIT 1;
+        """,
+        (key, now - timedelta(minutes=30), now + timedelta(minutes=30), now - timedelta(seconds=max_age), now),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    result = {'weather_id': row[0], 'observed_at': row[1]}
+    result.update(zip(COLUMNS, row[2:]))
+    return result
+
+
+def load_fallback(cursor, field_id, location, now=None):
+    """Last stored sample at or shortly before ``now`` regardless of age, for when Open-Meteo is down."""
+    now = now or datetime.utcnow()
+    if field_id is not None:
+        where, key = "field_id = %s", field_id
+    else:
+        where, key = "field_id IS NULL AND location = %s", location
+    cursor.execute(
+        f"""
+        SELECT weather_id, observed_at, {", ".join(COLUMNS)}
+        FROM weather
+        WHERE {where} AND observed_at <= %s
+        ORDER BY observed_at DESC
+        LIMIT 1;
+        """,
+        (key, now + timedelta(minutes=30)),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    result = {'weather_id': row[0], 'observed_at': row[1]}
+    result.update(zip(COLUMNS, row[2:]))
+    return result
+
+
+def load_latest(cursor, field_id, now=None):
+    """Return the most recent stored sample at or before ``now`` for a field, or None."""
+    cursor.execute(
+        f"""
+        SELECT weather_id, observed_at, {", ".join(COLUMNS)}
+        FROM weather
+        WHERE field_id = %s AND observed_at <= %s
+        ORDER BY observed_at DESC
+        LIMIT 1;
+        """,
+        (field_id, now or datetime.utcnow()),
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    result = {'weather_id': row[0], 'observed_at': row[1]}
+    result.update(zip(COLUMNS, row[2:]))
+    return result
+
+
+def serialize(row, field_id, location):
+    return {
+        "id": row.get('weather_id'),
+        "date": row['observed_at'].date().isoformat(),
+        "time": row['observed_at'].isoformat(),
+        **{c: row.get(c) for c in COLUMNS},
+        "field_id": field_id,
+        "location": location,
+    }
+
+
+# -------------------------
+# History with server-side downsampling
+# -------------------------
+def _parse_time(text, end=False):
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    # a bare end date includes that whole day
+    if end and len(text) == 10:
+        value += timedelta(days=1)
+    return value
+
+
+def history_range(start=None, end=None, now=None):
+    """Parse ?start=&end= (ISO dates or datetimes, UTC unless offset) into a [start, end) pair."""
+    try:
+        end_at = _parse_time(end, end=True) if end else (now or datetime.utcnow())
+        start_at = _parse_time(start) if start else end_at - timedelta(days=HISTORY_DAYS)
+    except ValueError:
+        raise ValueError("start and end must be ISO dates or datetimes")
+    if start_at >= end_at:
+        raise ValueError("start must be before end")
+    return start_at, end_at
+
+
+def history_metrics(text=None):
+    """Parse ?metrics=a,b into weather columns (default all)."""
+    if not text:
+        return list(COLUMNS)
+    metrics = [m.strip() for m in text.split(',') if m.strip()]
+    unknown = [m for m in metrics if m not in COLUMNS]
+    if unknown or not metrics:
+        raise ValueError(f"metrics must be among {', '.join(COLUMNS)}")
+    return metrics
+
+
+def _epoch(value):
+    return int((value - datetime(1970, 1, 1)).total_seconds())
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets: keep ``threshold`` of the (x, y, ...) tuples.
+
+    The first and last points are kept; from each bucket in between the point
+    forming the largest triangle with the previous pick and the next bucket's
+    average, which preserves peaks and troughs of the curve.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+    span = threshold - 2
+    sampled = [points[0]]
+    a = 0
+    for i in range(span):
+        start = 1 + i * (n - 2) // span
+        end = 1 + (i + 1) * (n - 2) // span
+        following = points[end:min(1 + (i + 2) * (n - 2) // span, n)] or points[-1:]
+        avg_x = sum(p[0] for p in following) / len(following)
+        avg_y = sum(p[1] for p in following) / len(following)
+        ax, ay = points[a][0], points[a][1]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def load_history(cursor, field_id, start, end, points=HISTORY_POINTS, mode="bucket", metrics=None):
+    """Stored hours of one field in [start, end), at most ``points`` rows.
+
+    Ranges holding no more samples than that are returned as stored. Otherwise
+    mode "bucket" splits the range into ``points`` equal time buckets and
+    returns each non-empty one's sample count and min/avg/max per metric,
+    aggregated in the database; mode "lttb" picks ``points`` samples shaped
+    by the first metric (hours where it is null are skipped).
+    Returns {"columns": [...], "rows": [[...], ...], ...} for charting.
+    """
+    metrics = metrics or list(COLUMNS)
+    where = "field_id = %s AND observed_at >= %s AND observed_at < %s"
+    cursor.execute(f"SELECT COUNT(*) FROM weather WHERE {where};", (field_id, start, end))
+    samples = cursor.fetchone()[0]
+    result = {"field_id": field_id, "start": start, "end": end, "samples": samples,
+              "mode": mode, "downsampled": samples > points}
+
+    if samples > points and mode == "bucket":
+        width = max(1, -((_epoch(start) - _epoch(end)) // points))  # ceil(range seconds / points)
+        aggregates = ", ".join(f"MIN({m}), AVG({m}), MAX({m})" for m in metrics)
+        cursor.execute(
+            f"""
+            SELECT {_BUCKET} AS bucket, COUNT(*), {aggregates}
+            FROM weather
+            WHERE {where}
+            GROUP BY 1
+            ORDER BY 1;
+            """,
+            (_epoch(start), width, field_id, start, end),
+        )
+        result["bucket_seconds"] = width
+        result["columns"] = ["time", "samples"] + [f"{m}_{agg}" for m in metrics for agg in ("min", "avg", "max")]
+        result["rows"] = [
+            [start + timedelta(seconds=int(r[0]) * width), r[1],
+             *[round(v, 2) if v is not None and i % 3 == 1 else v for i, v in enumerate(r[2:])]]
+            for r in cursor.fetchall()
+        ]
+        return result
+
+    cursor.execute(
+        f"SELECT observed_at, {', '.join(metrics)} FROM weather WHERE {where} ORDER BY observed_at;",
+        (field_id, start, end),
+    )
+    rows = cursor.fetchall()
+    if samples > points:
+        series = [(_epoch(r[0]), r[1], r) for r in rows if r[1] is not None]
+        rows = [p[2] for p in lttb(series, points)]
+    result["columns"] = ["time"] + metrics
+    result["rows"] = [list(r) for r in rows]
+    return result
+
+
+# -------------------------
+# Bulk refresh for every field
+# -------------------------
+def parse_location(text):
+    """Parse a fields.location "lat,lon" string. Returns (lat, lon) or None."""
+    try:
+        lat_s, lon_s = str(text).split(',', 1)
+        lat, lon = float(lat_s), float(lon_s)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def group_by_cell(fields, decimals=GRID_DECIMALS):
+    """Group (field_id, location, lat, lon) rows by grid cell.
+
+    Fields without coordinates (lat/lon NULL, see migration 9) are skipped.
+    Returns ({(lat, lon) cell center: [(field_id, location), ...]}, skipped_count).
+    """
+    cells = {}
+    skipped = 0
+    for field_id, location, lat, lon in fields:
+        if lat is None or lon is None:
+            skipped += 1
+            continue
+        center = (round(lat, decimals), round(lon, decimals))
+        cells.setdefault(center, []).append((field_id, location))
+    return cells, skipped
+
+
+def _refresh_batch(batch, forecast_days, fetched_at):
+    """Fetch one multi-coordinate batch and upsert rows for every field in it."""
+    payloads = fetch_hourly_many([center for center, _ in batch], forecast_days)
+    values = []
+    touched = set()
+    for (_, members), payload in zip(batch, payloads):
+        rows = parse_hourly(payload)
+        days = {r['observed_at'].date() for r in rows}
+        for field_id, location in members:
+            values.extend(_row_values(rows, field_id, location, fetched_at))
+            touched.update((field_id, day) for day in days)
+    if values:
+        with connection() as conn, conn.cursor() as cursor:
+            _upsert(cursor, values, by_field=True)
+            analytics.refresh(cursor, touched)
+            conn.commit()
+        versions.bump(["weather"])
+    return len(values)
+
+
+def refresh_all(forecast_days=0, batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+    """Refresh hourly weather for every field with coalesced multi-location requests.
+
+    Fields are grouped into grid cells, cells are sent to Open-Meteo
+    ``batch_size`` at a time and at most ``concurrency`` batches run at once.
+    Each batch is written back with a single bulk upsert, and the analytics
+    rollups for the days it covered are refreshed in the same transaction.
+    Returns a summary dict.
+    """
+    started = time.monotonic()
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT field_id, location, lat, lon FROM fields;")
+        fields = cursor.fetchall()
+
+    cells, skipped = group_by_cell(fields)
+    items = list(cells.items())
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    fetched_at = datetime.utcnow()
+
+    rows = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(_refresh_batch, batch, forecast_days, fetched_at): i
+                   for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            try:
+                rows += future.result()
+            except Exception as e:
+                errors.append({"batch": futures[future], "error": str(e)})
+
+    return {
+        "fields": len(fields),
+        "skipped": skipped,
+        "cells": len(cells),
+        "batches": len(batches),
+        "rows": rows,
+        "errors": sorted(errors, key=lambda e: e["batch"]),
+        "seconds": round(time.monotonic() - started, 3),
+    }
@@ -0,0 +1,34 @@
+"""The index expectations of tools/check_query_plans.py as a test.
+
+Needs a Postgres migrated with `flask --app run migrate` and configured
+through the DB_* variables (same .env as the app); skipped otherwise.
+Run from the backend directory: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "tools"))
+
+import check_query_plans  # noqa: E402
+from app.model import BACKEND, connection  # noqa: E402
+
+
+@unittest.skipUnless(BACKEND == "postgres" and os.getenv("DB_NAME"), "needs a migrated Postgres (DB_* settings)")
+class QueryPlanTest(unittest.TestCase):
+    def test_hot_lookups_use_their_indexes(self):
+        with connection() as conn, conn.cursor() as cursor:
+            # tiny development tables would otherwise be scanned sequentially
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            try:
+                for description, query, params, index in check_query_plans.CHECKS:
+                    with self.subTest(description):
+                        self.assertIn(index, check_query_plans.plan_indexes(cursor, query, params))
+            finally:
+                conn.rollback()
+
+
+if __name__ == "__main__":
+    unittest.main()
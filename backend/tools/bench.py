@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Reproducible load benchmark for the API.
+
+Starts the app on a local HTTP server together with the in-process
+Open-Meteo and Nominatim stubs (tools/stub_*.py), seeds throwaway users,
+fields and crops, then drives concurrent workloads and prints one JSON
+document with throughput and p50/p95/p99 latency per endpoint:
+
+  health     GET /api/health (no database; smoke-tests the harness)
+  login      login storm against the seeded accounts
+  dashboard  fields overview, field detail, lists and batch reverse-geocode
+  weather    fetch-weather per field (forced refresh against the stub)
+  refresh    one bulk /admin/refresh-weather over every field (timed once)
+
+With --db postgres (default) the database is whatever DB_* in the
+environment / .env points at; --db sqlite uses a fresh file (--sqlite-path,
+default a temporary one). Either is migrated to the latest version first.
+Seeded rows are deleted at the end unless --keep is given. Run from the
+backend directory, once per backend to compare them:
+
+    python tools/bench.py --workloads login,dashboard --concurrency 8 --seconds 10 --output bench.json
+    python tools/bench.py --db sqlite --workloads login,dashboard --concurrency 8 --seconds 10 --output bench-sqlite.json
+
+(The app logs with print(), so prefer --output over redirecting stdout.)
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import stub_nominatim  # noqa: E402
+import stub_open_meteo  # noqa: E402
+
+WORKLOADS = ("health", "login", "dashboard", "weather", "refresh")
+PASSWORD = "bench-password"
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(samples, seconds):
+    """samples: [(endpoint, latency_seconds, ok)] -> per-endpoint stats."""
+    by_endpoint = {}
+    for endpoint, latency, ok in samples:
+        by_endpoint.setdefault(endpoint, []).append((latency, ok))
+    result = {}
+    for endpoint, items in sorted(by_endpoint.items()):
+        latencies = [lat for lat, _ in items]
+        result[endpoint] = {
+            "requests": len(items),
+            "errors": sum(1 for _, ok in items if not ok),
+            "throughput_rps": round(len(items) / seconds, 2) if seconds else None,
+            "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(max(latencies) * 1000, 2),
+        }
+    return result
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.users = []  # [{"email", "token", "id", "fields": [{"id", "location"}]}]
+        self.temp_dir = None
+
+    # -- setup --------------------------------------------------------------
+    def start(self):
+        self.open_meteo = stub_open_meteo.start(delay=self.args.upstream_delay)
+        self.nominatim = stub_nominatim.start(delay=self.args.upstream_delay)
+        # upstream clients and geocode settings read these at import time
+        os.environ["OPEN_METEO_URL"] = f"http://127.0.0.1:{self.open_meteo.server_port}/v1/forecast"
+        os.environ["NOMINATIM_URL"] = f"http://127.0.0.1:{self.nominatim.server_port}"
+        os.environ.setdefault("GEOCODE_MIN_INTERVAL", "0")
+        os.environ.setdefault("JWT_SECRET", "bench-" + "x" * 32)
+        # the backend is fixed when app.model is imported
+        os.environ["DB_BACKEND"] = self.args.db
+        if self.args.db == "sqlite":
+            if not self.args.sqlite_path:
+                self.temp_dir = tempfile.mkdtemp(prefix="croptech-bench-")
+                self.args.sqlite_path = os.path.join(self.temp_dir, "bench.db")
+            os.environ["SQLITE_PATH"] = self.args.sqlite_path
+
+        from werkzeug.serving import make_server
+
+        from app import auth, create_app, migrations
+
+        self.app = create_app()
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.server = make_server("127.0.0.1", 0, self.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}/api"
+        self.admin_token = auth.issue_token(0, "admin")
+        self.migrations = migrations
+
+    def session(self, token=None):
+        import requests
+
+        s = requests.Session()
+        if token:
+            s.headers["Authorization"] = f"Bearer {token}"
+        return s
+
+    def seed(self):
+        self.migrations.migrate(log=lambda msg: print(msg, file=sys.stderr))
+        admin = self.session(self.admin_token)
+        users = [{"name": f"Bench {i}", "email": f"bench-{self.run_id}-{i}@example.com", "password": PASSWORD}
+                 for i in range(self.args.users)]
+        res = admin.post(f"{self.base}/users/bulk", json={"users": users})
+        res.raise_for_status()
+        rng = random.Random(self.args.seed)
+        for result in res.json()["results"]:
+            token = self.session().post(f"{self.base}/login",
+                                        json={"email": result["email"], "password": PASSWORD}).json()["token"]
+            # spread fields over Negros so some share geocode / weather grid cells
+            fields = [{"location": f"{rng.uniform(9.5, 11.0):.5f},{rng.uniform(122.5, 123.3):.5f}",
+                       "crops": [{"name": "Rice", "planting_date": "2026-06-01"}]}
+                      for _ in range(self.args.fields_per_user)]
+            created = self.session(token).post(f"{self.base}/fields/batch", json={"fields": fields})
+            created.raise_for_status()
+            self.users.append({
+                "email": result["email"], "id": result["id"], "token": token,
+                "fields": [{"id": f["id"], "location": f["location"]} for f in created.json()["fields"]],
+            })
+
+    def cleanup(self):
+        from app.model import connection
+
+        with connection() as conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE email LIKE %s;", (f"bench-{self.run_id}-%",))
+            conn.commit()
+
+    # -- workloads ----------------------------------------------------------
+    # each op returns [(endpoint label, zero-argument call)]; calls are timed one by one
+    def op_health(self, s, rng):
+        return [("GET /api/health", lambda: s.get(f"{self.base}/health"))]
+
+    def op_login(self, s, rng):
+        user = rng.choice(self.users)
+        body = {"email": user["email"], "password": PASSWORD}
+        return [("POST /api/login", lambda: s.post(f"{self.base}/login", json=body))]
+
+    def op_dashboard(self, s, rng):
+        user = rng.choice(self.users)
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        field = rng.choice(user["fields"])
+        coords = [[float(x) for x in f["location"].split(",")] for f in user["fields"]]
+        return [
+            ("GET /api/fields/overview", lambda: s.get(f"{self.base}/fields/overview", headers=headers)),
+            ("GET /api/fields/<id>", lambda: s.get(f"{self.base}/fields/{field['id']}", headers=headers)),
+            ("GET /api/crops", lambda: s.get(f"{self.base}/crops", headers=headers)),
+            ("POST /api/reverse-geocode", lambda: s.post(f"{self.base}/reverse-geocode", json={"coordinates": coords})),
+        ]
+
+    def op_weather(self, s, rng):
+        user = rng.choice(self.users)
+        field = rng.choice(user["fields"])
+        lat, lon = field["location"].split(",")
+        body = {"lat": lat, "lon": lon, "field_id": field["id"], "refresh": True}
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        return [("POST /api/fetch-weather", lambda: s.post(f"{self.base}/fetch-weather", json=body, headers=headers))]
+
+    def drive(self, name):
+        op = getattr(self, f"op_{name}")
+        samples = []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + self.args.seconds
+
+        def worker(i):
+            rng = random.Random(self.args.seed * 1000 + i)
+            s = self.session()
+            local = []
+            while time.perf_counter() < deadline:
+                for endpoint, call in op(s, rng):
+                    started = time.perf_counter()
+                    try:
+                        ok = call().status_code < 400
+                    except Exception:
+                        ok = False
+                    local.append((endpoint, time.perf_counter() - started, ok))
+            with lock:
+                samples.extend(local)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        return {"seconds": round(elapsed, 3), "requests": len(samples),
+                "throughput_rps": round(len(samples) / elapsed, 2), "endpoints": summarize(samples, elapsed)}
+
+    def drive_refresh(self):
+        s = self.session(self.admin_token)
+        started = time.perf_counter()
+        res = s.post(f"{self.base}/admin/refresh-weather", json={})
+        elapsed = time.perf_counter() - started
+        return {"seconds": round(elapsed, 3), "status": res.status_code,
+                "summary": res.json() if res.headers.get("Content-Type", "").startswith("application/json") else None}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--workloads", default="login,dashboard,weather,refresh",
+                    help=f"comma-separated, from {', '.join(WORKLOADS)}")
+    ap.add_argument("--db", choices=("postgres", "sqlite"), default="postgres", help="storage backend to run against")
+    ap.add_argument("--sqlite-path", help="SQLite file for --db sqlite (default: a new temporary file)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=10.0, help="duration of each timed workload")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--fields-per-user", type=int, default=10)
+    ap.add_argument("--upstream-delay", type=float, default=0.05, help="stub latency per upstream request")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--keep", action="store_true", help="keep the seeded users/fields")
+    ap.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = ap.parse_args()
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        ap.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    harness = Harness(args)
+    harness.start()
+    needs_db = any(w != "health" for w in workloads)
+    report = {
+        "config": vars(args),
+        "workloads": {},
+    }
+    try:
+        if needs_db:
+            harness.seed()
+        for name in workloads:
+            print(f"running {name}...", file=sys.stderr)
+            report["workloads"][name] = harness.drive_refresh() if name == "refresh" else harness.drive(name)
+    finally:
+        if needs_db and not args.keep:
+            try:
+                harness.cleanup()
+            except Exception as e:
+                print(f"cleanup failed: {e}", file=sys.stderr)
+        if harness.temp_dir and not args.keep:
+            shutil.rmtree(harness.temp_dir, ignore_errors=True)
+    report["upstream_requests"] = {"open_meteo": harness.open_meteo.requests,
+                                   "nominatim": harness.nominatim.requests}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
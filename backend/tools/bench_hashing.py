@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Benchmark password hashing on the request thread vs the hashing process pool.
+
+Runs a login storm (threads verifying passwords) while other threads call a
+lightweight endpoint (GET /api/health) through the Flask test client, and
+reports login throughput and light-request latency for both modes:
+
+  inline - werkzeug check_password_hash on the calling thread (old behaviour)
+  pool   - app.hashing.check_password (process pool)
+
+No database is needed. Run from the backend directory:
+    python tools/bench_hashing.py [--seconds 5] [--logins 8] [--light 4]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from werkzeug.security import check_password_hash, generate_password_hash  # noqa: E402
+
+from app import create_app, hashing  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run(mode, seconds, login_threads, light_threads, stored_hash):
+    app = create_app()
+    check = check_password_hash if mode == "inline" else hashing.check_password
+    stop = threading.Event()
+    logins = []
+    busy = []
+    light_latencies = []
+
+    def login_worker():
+        while not stop.is_set():
+            try:
+                check(stored_hash, "correct horse")
+                logins.append(1)
+            except hashing.HashingBusy:
+                busy.append(1)
+
+    def light_worker():
+        client = app.test_client()
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get("/api/health")
+            light_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=login_worker) for _ in range(login_threads)]
+    threads += [threading.Thread(target=light_worker) for _ in range(light_threads)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return {
+        "mode": mode,
+        "logins_per_second": round(len(logins) / seconds, 2),
+        "logins_rejected_busy": len(busy),
+        "light_requests_per_second": round(len(light_latencies) / seconds, 2),
+        "light_p50_ms": round(percentile(light_latencies, 50) * 1000, 3) if light_latencies else None,
+        "light_p95_ms": round(percentile(light_latencies, 95) * 1000, 3) if light_latencies else None,
+        "light_p99_ms": round(percentile(light_latencies, 99) * 1000, 3) if light_latencies else None,
+        "light_mean_ms": round(statistics.mean(light_latencies) * 1000, 3) if light_latencies else None,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--seconds", type=float, default=5)
+    ap.add_argument("--logins", type=int, default=8, help="concurrent login threads")
+    ap.add_argument("--light", type=int, default=4, help="concurrent lightweight request threads")
+    args = ap.parse_args()
+
+    stored = generate_password_hash("correct horse", hashing.HASH_METHOD)
+    hashing.check_password(stored, "warm up")  # start the worker processes outside the timing
+    results = [run(mode, args.seconds, args.logins, args.light, stored) for mode in ("inline", "pool")]
+    print(json.dumps({"hash_method": hashing.HASH_METHOD, "workers": hashing.WORKERS, "results": results}, indent=2))
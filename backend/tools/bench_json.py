@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Benchmark response serialization and compression on large list payloads.
+
+Builds a synthetic crops page and a weather series (dates and datetimes as
+they come back from the database) and compares:
+
+  flask_ms    - previous path: per-row .isoformat() then Flask's default
+                provider (stdlib json, sorted keys)
+  stdlib_ms   - app.encoding's stdlib encoder (the JSON_ORJSON=0 fallback)
+  encoding_ms - app.encoding as configured (orjson when installed)
+
+and then the size/time of gzip (and brotli, if installed) on the encoded
+body at the configured levels. No database is needed. Run from the backend
+directory:
+    python tools/bench_json.py [--rows 5000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from app import encoding  # noqa: E402
+
+WEATHER_COLUMNS = ("weather_code", "temperature", "relative_humidity", "precipitation_probability",
+                   "precipitation", "cloud_cover", "wind_speed_10m", "wind_direction_10m")
+
+
+def make_payloads(rows, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    crops = [{"id": i, "name": rng.choice(["Rice", "Corn", "Sugarcane", "Banana"]),
+              "health_status": rng.choice([None, "Good", "Needs water"]),
+              "planting_date": date(2026, 1, 1) + timedelta(days=rng.randrange(300)),
+              "user_id": rng.randrange(1, 50), "field_id": rng.randrange(1, 500)} for i in range(rows)]
+    weather = [{"id": i, "observed_at": start + timedelta(hours=i), "field_id": 7,
+                **{c: round(rng.uniform(0, 100), 1) for c in WEATHER_COLUMNS}} for i in range(rows)]
+    return {"crops": crops, "weather": weather}
+
+
+def iso_rows(rows):
+    """What the views used to do before handing rows to jsonify."""
+    out = []
+    for row in rows:
+        row = dict(row)
+        for key, value in row.items():
+            if isinstance(value, (date, datetime)):
+                row[key] = value.isoformat()
+        out.append(row)
+    return out
+
+
+def timed(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return result, round(statistics.median(times) * 1000, 3)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    app = Flask(__name__)
+    flask_json = DefaultJSONProvider(app)
+    stdlib = json.JSONEncoder(default=encoding._default, ensure_ascii=False, separators=(",", ":"))
+    report = {"rows": args.rows, "json": encoding.stats()["json"], "payloads": {}}
+
+    for name, rows in make_payloads(args.rows).items():
+        body = {name: rows, "next_after": None}
+        results = {}
+        flask_body, results["flask_ms"] = timed(
+            lambda: flask_json.dumps({name: iso_rows(rows), "next_after": None}).encode(), args.repeat)
+        _, results["stdlib_ms"] = timed(lambda: stdlib.encode(body).encode(), args.repeat)
+        fast_body, results["encoding_ms"] = timed(lambda: encoding.dumps_bytes(body), args.repeat)
+        assert json.loads(fast_body) == json.loads(flask_body), "serializers disagree"
+
+        results["bytes"] = len(fast_body)
+        for enc in ["gzip"] + (["br"] if encoding.brotli is not None else []):
+            packed, ms = timed(lambda: encoding.compress(fast_body, enc), max(3, args.repeat // 4))
+            results[f"{enc}_bytes"] = len(packed)
+            results[f"{enc}_ms"] = ms
+        report["payloads"][name] = results
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Check that the hot lookups are served by the expected indexes.
+
+Runs EXPLAIN for each access pattern against the configured database (same
+.env as the app, migrated with `flask --app run migrate`) with sequential scans disabled, so the check also passes on
+tiny development tables, and fails if the planner cannot use the index.
+
+Run from the backend directory: python tools/check_query_plans.py
+(tests/test_query_plans.py runs the same checks as a unit test).
+"""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.model import connection  # noqa: E402
+
+# (description, query, params, index the plan must use)
+CHECKS = [
+    ("field by id", "SELECT field_id, location, user_id FROM fields WHERE field_id=%s", (1,), "fields_pkey"),
+    ("fields by user (keyset)",
+     "SELECT field_id, location, user_id FROM fields WHERE user_id=%s AND field_id > %s ORDER BY field_id LIMIT 101",
+     (1, 0), "idx_fields_user_id"),
+    ("crop by id", "SELECT crop_id FROM crops WHERE crop_id=%s", (1,), "crops_pkey"),
+    ("crops by user (keyset)",
+     "SELECT crop_id FROM crops WHERE user_id=%s AND crop_id > %s ORDER BY crop_id LIMIT 101",
+     (1, 0), "idx_crops_user_id"),
+    ("crops by field", "SELECT crop_id FROM crops WHERE field_id=%s ORDER BY crop_id", (1,), "idx_crops_field_id"),
+    ("latest weather for field",
+     "SELECT weather_id FROM weather WHERE field_id=%s AND observed_at <= now() ORDER BY observed_at DESC LIMIT 1",
+     (1,), "uq_weather_field_observed"),
+    ("fields in map viewport",
+     "SELECT field_id FROM fields WHERE point(lon, lat) <@ box(point(%s, %s), point(%s, %s))",
+     (120.0, 10.0, 123.0, 12.0), "idx_fields_point"),
+    ("nearest fields",
+     "SELECT field_id FROM fields WHERE lat IS NOT NULL ORDER BY point(lon, lat) <-> point(%s, %s) LIMIT 10",
+     (122.0, 11.0), "idx_fields_point"),
+    ("market price windows for a crop",
+     "SELECT day, quotes, price_sum FROM market_daily WHERE crop_key = ANY(%s) AND day BETWEEN %s AND %s "
+     "ORDER BY crop_key, day", (["rice"], "2026-01-01", "2026-03-31"), "market_daily_pkey"),
+    ("inventory ledger as of a day",
+     "SELECT quantity_after FROM inventory_movements WHERE item_id = %s AND created_at < %s "
+     "ORDER BY created_at DESC, movement_id DESC LIMIT 1", (1, "2026-01-02"), "idx_inventory_movements_item"),
+    ("inventory snapshot as of a day",
+     "SELECT quantity FROM inventory_snapshots WHERE item_id = %s AND day <= %s ORDER BY day DESC LIMIT 1",
+     (1, "2026-01-01"), "inventory_snapshots_pkey"),
+]
+
+
+def _indexes(plan):
+    found = set()
+    if "Index Name" in plan:
+        found.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found |= _indexes(child)
+    return found
+
+
+def plan_indexes(cursor, query, params):
+    """Names of the indexes in the plan of ``query``."""
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _indexes(plan[0]["Plan"])
+
+
+def main():
+    failures = 0
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off;")
+        for description, query, params, index in CHECKS:
+            used = plan_indexes(cursor, query, params)
+            ok = index in used
+            failures += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} {description}: uses {sorted(used) or 'no index'} (expected {index})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
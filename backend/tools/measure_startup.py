@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Measure backend cold-start time.
+
+Starts a fresh interpreter N times, each importing the app package and
+calling create_app(), and reports min/median/max wall time plus the
+heaviest imports from the last run (python -X importtime).
+
+Run from the backend directory: python tools/measure_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SNIPPET = "from app import create_app; create_app()"
+
+
+def run_once(importtime=False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", SNIPPET]
+    started = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=BACKEND, capture_output=True, text=True)
+    return time.perf_counter() - started, proc.stderr
+
+
+def top_imports(stderr, n=10):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        try:
+            rows.append((int(parts[1]), parts[2].strip()))
+        except (ValueError, IndexError):
+            continue
+    return sorted(rows, reverse=True)[:n]
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    times = [run_once()[0] for _ in range(runs)]
+    print(f"create_app cold start over {runs} runs: "
+          f"min {min(times):.3f}s  median {statistics.median(times):.3f}s  max {max(times):.3f}s")
+    _, stderr = run_once(importtime=True)
+    print("Heaviest imports (cumulative microseconds):")
+    for us, name in top_imports(stderr):
+        print(f"  {us:>9}  {name}")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Nominatim /reverse API.
+
+Answers every point with a deterministic address derived from its
+coordinates (points with lat < -60 come back as "Unable to geocode", like
+the open sea). Point the backend at it with:
+
+    python backend/tools/stub_nominatim.py --port 8082
+    NOMINATIM_URL=http://127.0.0.1:8082 GEOCODE_MIN_INTERVAL=0 python backend/run.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class NominatimStub(BaseHTTPRequestHandler):
+    # Extra seconds to sleep per request, to emulate upstream latency
+    delay = 0.0
+    # HTTP status to answer with instead of data, to exercise failure handling
+    fail_status = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/reverse":
+            self._send(404, {"error": "not found"})
+            return
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            lat, lon = float(q["lat"]), float(q["lon"])
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": str(e)})
+            return
+
+        self.server.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail_status:
+            self._send(self.fail_status, {"error": "stub failure"})
+            return
+        if lat < -60:
+            self._send(200, {"error": "Unable to geocode"})
+            return
+        city = f"City {round(lat, 1)}/{round(lon, 1)}"
+        state = f"Province {int(lat)}"
+        self._send(200, {
+            "lat": str(lat), "lon": str(lon),
+            "display_name": f"{city}, {state}, Philippines",
+            "address": {"city": city, "state": state, "country": "Philippines"},
+        })
+
+    def _send(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, delay=0.0, fail_status=None):
+    """Start the stub on a background thread. Returns the server (server.server_port, server.requests)."""
+    handler = type("Handler", (NominatimStub,), {"delay": delay, "fail_status": fail_status})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8082)
+    ap.add_argument("--delay", type=float, default=0.0, help="seconds of artificial latency per request")
+    ap.add_argument("--fail-status", type=int, default=None, help="answer every request with this HTTP status")
+    args = ap.parse_args()
+    server = start(args.port, args.delay, args.fail_status)
+    print(f"Nominatim stub listening on http://127.0.0.1:{server.server_port}/reverse")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Open-Meteo forecast API.
+
+Serves deterministic hourly data for any number of comma-separated
+coordinates, so weather fetches and bulk refreshes can run without the
+internet. Point the backend at it with:
+
+    python backend/tools/stub_open_meteo.py --port 8081
+    OPEN_METEO_URL=http://127.0.0.1:8081/v1/forecast flask --app run refresh-weather
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _series(lat, lon, start, end):
+    hours = []
+    day = start
+    while day <= end:
+        for h in range(24):
+            hours.append(datetime(day.year, day.month, day.day, h))
+        day += timedelta(days=1)
+    seed = abs(lat) + abs(lon)
+    return {
+        "time": [t.strftime("%Y-%m-%dT%H:%M") for t in hours],
+        "temperature_2m": [round(20 + (seed + i) % 10, 1) for i in range(len(hours))],
+        "relativehumidity_2m": [float(60 + (i % 30)) for i in range(len(hours))],
+        "precipitation_probability": [float(i % 100) for i in range(len(hours))],
+        "precipitation": [round((i % 5) * 0.2, 1) for i in range(len(hours))],
+        "cloudcover": [float((i * 7) % 100) for i in range(len(hours))],
+        "windspeed_10m": [round(2 + (i % 8) * 0.5, 1) for i in range(len(hours))],
+        "winddirection_10m": [float((i * 15) % 360) for i in range(len(hours))],
+        "weathercode": [(i % 4) for i in range(len(hours))],
+    }
+
+
+class OpenMeteoStub(BaseHTTPRequestHandler):
+    # Extra seconds to sleep per request, to emulate upstream latency
+    delay = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/v1/forecast":
+            self._send(404, {"error": True, "reason": "not found"})
+            return
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            lats = [float(x) for x in q["latitude"].split(",")]
+            lons = [float(x) for x in q["longitude"].split(",")]
+            start = date.fromisoformat(q.get("start_date") or date.today().isoformat())
+            end = date.fromisoformat(q.get("end_date") or start.isoformat())
+        except (KeyError, ValueError) as e:
+            self._send(400, {"error": True, "reason": str(e)})
+            return
+        if len(lats) != len(lons):
+            self._send(400, {"error": True, "reason": "latitude and longitude must have the same length"})
+            return
+
+        self.server.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+        payloads = [{"latitude": lat, "longitude": lon, "hourly": _series(lat, lon, start, end)}
+                    for lat, lon in zip(lats, lons)]
+        self._send(200, payloads if len(payloads) > 1 else payloads[0])
+
+    def _send(self, status, body):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, delay=0.0):
+    """Start the stub on a background thread. Returns the server (server.server_port, server.requests)."""
+    handler = type("Handler", (OpenMeteoStub,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--delay", type=float, default=0.0, help="seconds of artificial latency per request")
+    args = ap.parse_args()
+    server = start(args.port, args.delay)
+    print(f"Open-Meteo stub listening on http://127.0.0.1:{server.server_port}/v1/forecast")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -55,10 +55,13 @@ export default async function FieldDetailPage({ params }: { params: { id: string
     area_ha: 1.25,
   };
 
+  // Numeric coordinates from the backend (null when the location is not "lat,lon")
+  let point: [number, number] | null = null;
+
   // Try to fetch the real field from the backend (server-side). If the
   // backend isn't available or returns no data, keep the defaults above.
   try {
-    const res = await fetch(`http://127.0.0.1:5001/api/fields?id=${encodeURIComponent(String(id))}`, { cache: 'no-store' });
+    const res = await fetch(`http://127.0.0.1:5001/api/fields/${encodeURIComponent(String(id))}`, { cache: 'no-store' });
       if (res.ok) {
         const data = await res.json().catch(() => ({}));
         // Backend returns either a single `field` or an array `fields`.
@@ -74,6 +77,7 @@ export default async function FieldDetailPage({ params }: { params: { id: string
             location: f.location ?? field.location,
             area_ha: f.area_ha ?? field.area_ha,
           };
+          if (f.lat != null && f.lon != null) point = [f.lat, f.lon];
         }
       }
   } catch (err) {
@@ -85,7 +89,10 @@ export default async function FieldDetailPage({ params }: { params: { id: string
   // Parse coordinates once for reuse (reverse-geocode + weather fetch)
   let latNum: number | null = null;
   let lonNum: number | null = null;
-  if (field.location && typeof field.location === 'string' && field.location.includes(',')) {
+  if (point) {
+    [latNum, lonNum] = point;
+  } else if (field.location && typeof field.location === 'string' && field.location.includes(',')) {
+    // demo fallback values only carry the location text
     const [latS, lonS] = field.location.split(',').map(s => s.trim());
     const lat = parseFloat(latS);
     const lon = parseFloat(lonS);
@@ -1,5 +1,14 @@
 "use client";
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
+
+type DayEvents = { watered?: boolean; fertilizer?: boolean; pesticide?: boolean; note?: string };
+
+function authHeaders(): Record<string, string> {
+  const headers: Record<string, string> = { 'Content-Type': 'application/json' };
+  const token = typeof window !== 'undefined' ? localStorage.getItem('token') : null;
+  if (token) headers['Authorization'] = `Bearer ${token}`;
+  return headers;
+}
 
 interface Props {
   fieldId: string | number;
@@ -12,7 +21,9 @@ export default function PlantingCalendar({ fieldId, initialPlantingDate, initial
   const eventsKey = `field-${fieldId}-events`;
   const [plantingDate, setPlantingDate] = useState<string>(initialPlantingDate ?? "");
   const [harvestDate, setHarvestDate] = useState<string>(initialHarvestDate ?? "");
-  const [events, setEvents] = useState<Record<string, { watered?: boolean; fertilizer?: boolean; pesticide?: boolean; note?: string }>>({});
+  const [events, setEvents] = useState<Record<string, DayEvents>>({});
+  // last state known to be stored on the server; used to send only changed days
+  const syncedEvents = useRef<Record<string, DayEvents>>({});
   const [selectedDate, setSelectedDate] = useState<string | null>(null);
 
   useEffect(() => {
@@ -42,7 +53,7 @@ export default function PlantingCalendar({ fieldId, initialPlantingDate, initial
     }
   }, [plantingDate, harvestDate, storageKey]);
 
-  // load/save events
+  // load/save events; localStorage is the offline copy, the backend is the source of truth
   useEffect(() => {
     try {
       const raw = localStorage.getItem(eventsKey);
@@ -50,13 +61,49 @@ export default function PlantingCalendar({ fieldId, initialPlantingDate, initial
     } catch (e) {
       // ignore
     }
-  }, [eventsKey]);
+    (async () => {
+      try {
+        const res = await fetch(`http://localhost:5001/api/fields/${fieldId}/events`, { headers: authHeaders() });
+        if (!res.ok) return;
+        const data = await res.json();
+        const fromServer: Record<string, DayEvents> = {};
+        for (const e of data.events || []) {
+          fromServer[e.date] = { watered: e.watered, fertilizer: e.fertilizer, pesticide: e.pesticide, note: e.note };
+        }
+        syncedEvents.current = fromServer;
+        // days only recorded locally (e.g. while offline) are kept and pushed by the sync effect
+        setEvents(prev => ({ ...prev, ...fromServer }));
+      } catch (e) {
+        // offline: keep the local copy
+      }
+    })();
+  }, [eventsKey, fieldId]);
 
   useEffect(() => {
     try {
       localStorage.setItem(eventsKey, JSON.stringify(events));
     } catch (e) {}
-  }, [events, eventsKey]);
+
+    const changed: Record<string, DayEvents> = {};
+    for (const [day, entry] of Object.entries(events)) {
+      if (JSON.stringify(entry) !== JSON.stringify(syncedEvents.current[day])) changed[day] = entry;
+    }
+    if (Object.keys(changed).length === 0) return;
+    // debounce so typing a note sends one request
+    const timer = setTimeout(async () => {
+      try {
+        const res = await fetch(`http://localhost:5001/api/fields/${fieldId}/events`, {
+          method: 'PUT',
+          headers: authHeaders(),
+          body: JSON.stringify(changed),
+        });
+        if (res.ok) syncedEvents.current = { ...syncedEvents.current, ...changed };
+      } catch (e) {
+        // retried on the next change
+      }
+    }, 500);
+    return () => clearTimeout(timer);
+  }, [events, eventsKey, fieldId]);
 
   function clearDates() {
     setPlantingDate("");
@@ -139,7 +186,9 @@ export default function PlantingCalendar({ fieldId, initialPlantingDate, initial
   function clearAllEvents() {
     if (!confirm('Clear all recorded events for this field? This cannot be undone.')) return;
     setEvents({});
+    syncedEvents.current = {};
     try { localStorage.removeItem(eventsKey); } catch (e) {}
+    fetch(`http://localhost:5001/api/fields/${fieldId}/events`, { method: 'DELETE', headers: authHeaders() }).catch(() => {});
     setSelectedDate(null);
   }
 
@@ -58,8 +58,9 @@ export default function LandTrackerPage() {
         const headers: any = { 'Content-Type': 'application/json' };
         if (token) headers['Authorization'] = `Bearer ${token}`;
 
-        // Fetch fields for user (if userId present, filter by it)
-        let fieldsUrl = 'http://localhost:5001/api/fields';
+        // One overview call returns each field with its first crop, cached city/state
+        // and latest weather (if userId present, filter by it)
+        let fieldsUrl = 'http://localhost:5001/api/fields/overview';
         if (userId) fieldsUrl += `?user_id=${userId}`;
         const fRes = await fetch(fieldsUrl, { headers });
         if (!fRes.ok) {
@@ -67,65 +68,43 @@ export default function LandTrackerPage() {
           return;
         }
         const fData = await fRes.json().catch(() => ({}));
-        const fetchedFields = (fData.fields || []).map((f: any) => {
-          let center: [number, number] = [0, 0];
-          try {
-            if (f.location && typeof f.location === 'string' && f.location.includes(',')) {
-              const [latS, lngS] = f.location.split(',');
-              const lat = parseFloat(latS);
-              const lng = parseFloat(lngS);
-              if (!Number.isNaN(lat) && !Number.isNaN(lng)) center = [lat, lng];
-            }
-          } catch (e) {}
+        const overview = fData.fields || [];
+        const fetchedFields = overview.map((f: any) => {
+          // lat/lon are null when the stored location is not a "lat,lon" pair
+          const center: [number, number] = f.lat != null && f.lon != null ? [f.lat, f.lon] : [0, 0];
 
           return {
             id: f.id,
             name: f.name || `Field ${f.id}`,
-            crop: '',
+            crop: f.crop?.name || '',
             coordinates: [],
             center,
+            city: f.city || null,
+            state: f.state || null,
           } as FieldData;
         });
 
-        // Fetch crops for this user and map to fields by field_id
-        let cropsUrl = 'http://localhost:5001/api/crops';
-        if (userId) cropsUrl += `?user_id=${userId}`;
-        const cRes = await fetch(cropsUrl, { headers });
-        if (cRes.ok) {
-          const cData = await cRes.json().catch(() => ({}));
-          const crops = cData.crops || [];
-          const cropByField: Record<string, string> = {};
-          for (const c of crops) {
-            if (c.field_id) {
-              // store first crop name per field
-              if (!cropByField[c.field_id]) cropByField[c.field_id] = c.name || '';
-            }
-          }
-
-          // attach crop names
-          for (const ff of fetchedFields) {
-            if (cropByField[ff.id]) ff.crop = cropByField[ff.id];
-          }
-        }
-
-        // Reverse-geocode each field's center to obtain city and state.
-        // Do this sequentially to avoid hammering the Nominatim service.
-        for (let i = 0; i < fetchedFields.length; i++) {
-          const ff = fetchedFields[i];
+        // Only fields whose location is not in the server's geocode cache yet need a
+        // reverse-geocode call; the backend rate-limits Nominatim itself.
+        const located = fetchedFields.filter((ff: FieldData, i: number) =>
+          !overview[i].geocoded && (ff.center[0] !== 0 || ff.center[1] !== 0));
+        if (located.length > 0) {
           try {
-            const [lat, lon] = ff.center;
-            if (lat !== 0 || lon !== 0) {
-              const r = await fetch(`http://localhost:5001/api/reverse-geocode?lat=${lat}&lon=${lon}`);
-              if (r.ok) {
-                const j = await r.json().catch(() => ({}));
-                ff.city = j.city || null;
-                ff.state = j.state || null;
-              }
+            const r = await fetch('http://localhost:5001/api/reverse-geocode', {
+              method: 'POST',
+              headers: { 'Content-Type': 'application/json' },
+              body: JSON.stringify({ coordinates: located.map((ff: FieldData) => ff.center) }),
+            });
+            if (r.ok) {
+              const j = await r.json().catch(() => ({}));
+              const results = j.results || [];
+              located.forEach((ff: FieldData, i: number) => {
+                ff.city = results[i]?.city || null;
+                ff.state = results[i]?.state || null;
+              });
             }
           } catch (e) {
-            // ignore per-field reverse geocode errors
-            ff.city = null;
-            ff.state = null;
+            // ignore reverse geocode errors; fields render without city/state
           }
         }
 
@@ -302,7 +281,11 @@ export default function LandTrackerPage() {
                                   const token = typeof window !== 'undefined' ? localStorage.getItem('token') : null;
                                   const storedUserRaw = typeof window !== 'undefined' ? localStorage.getItem('user') : null;
                                   const storedUser = storedUserRaw ? JSON.parse(storedUserRaw) : null;
-                                  const bodyField: any = { location: `${centerLat},${centerLng}` };
+                                  // Field and its crop are created together in one atomic request
+                                  const bodyField: any = {
+                                    location: `${centerLat},${centerLng}`,
+                                    crops: [{ name: selectedCrop, planting_date: new Date().toISOString().slice(0,10) }],
+                                  };
                                   if (!token && storedUser && (storedUser.id || storedUser.user_id)) bodyField.user_id = storedUser.id || storedUser.user_id;
 
                                   try {
@@ -318,22 +301,6 @@ export default function LandTrackerPage() {
                                       const fData = await fRes.json().catch(() => ({}));
                                       const createdField = fData.field;
                                       if (createdField && createdField.id) {
-                                        // create crop linked to field
-                                        const cropBody: any = {
-                                          name: selectedCrop,
-                                          field_id: createdField.id,
-                                          planting_date: new Date().toISOString().slice(0,10),
-                                        };
-                                        if (!token && storedUser && (storedUser.id || storedUser.user_id)) cropBody.user_id = storedUser.id || storedUser.user_id;
-
-                                        const cRes = await fetch('http://localhost:5001/api/crops', {
-                                          method: 'POST',
-                                          headers,
-                                          body: JSON.stringify(cropBody),
-                                        });
-                                        if (!cRes.ok) {
-                                          console.warn('Crop creation failed', await cRes.text());
-                                        }
                                         // Attach created field id to local object
                                         newField.id = createdField.id;
                                       }